@@ -0,0 +1,603 @@
+# Benchmarks of the chat server.
+# Auther: Gilad Moyal.
+
+import argparse
+import gc
+import heapq
+import multiprocessing
+import multiprocessing.pool
+import os
+import time
+import random
+import selectors
+import socket
+import tempfile
+import Server2
+import ProtocolV2
+import ChatHistory
+import MessageFilters
+import Presence
+import TimerWheel
+
+"""
+Every benchmark is a function that receives the parsed arguments, runs and prints its results.
+Run it with: python Benchmark.py <BENCHMARK NAME> [options]
+"""
+
+# The names of the benchmarks that can be run.
+BENCHMARKS = ["parse", "history", "metrics", "syscalls", "timers", "memory", "frames", "compression", "filters",
+              "presence"]
+DEFAULT_FRAMES_NUMBER = 200000  # The number of frames parsed by the parse benchmark.
+DEFAULT_CHUNK_SIZE = 4096  # The size of the pieces the received data is fed in, like the data returned by recv.
+DEFAULT_MESSAGES_NUMBER = 1000000  # The number of messages saved by the history benchmark.
+DEFAULT_COMMIT_BATCH = 100  # The number of messages saved together by the history benchmark (like one loop iteration).
+REPLAY_REQUESTS = 1000  # The number of requests for messages from the history, of every kind.
+REPLAY_COUNT = 100  # The number of messages every request asks for.
+DEFAULT_RECIPIENTS = 100  # The number of users that receive the chat messages of the metrics benchmark.
+METRICS_ROUNDS = 5  # The number of times the metrics benchmark runs every mode (the fastest time is kept).
+DEFAULT_BURSTS = 200  # The number of bursts of chat messages sent by the syscalls benchmark.
+DEFAULT_BURST_SIZE = 10  # The number of chat messages in every burst (sent together, like a busy user).
+DEFAULT_CONNECTIONS = 50000  # The number of connections whose deadlines are handled by the timers benchmark.
+TIMERS_DURATION = 90  # The seconds of deadlines simulated by the timers benchmark (like the idle timeout).
+DEFAULT_FRAME_MESSAGES = 200000  # The number of chat messages the frames benchmark builds the frames of.
+COMPRESSION_LEVELS = [1, 6, 9]  # The levels of zlib compared by the compression benchmark.
+COMPRESSION_ROUNDS = 200  # The number of times every payload is compressed (the average time is printed).
+DEFAULT_FILTER_MESSAGES = 20000  # The number of messages checked by the filters benchmark.
+FILTER_WORKERS = 2  # The number of processes (or threads) of the pools of the filters benchmark.
+# The filters of the filters benchmark: many words and patterns, like the filters of a real chat.
+BENCHMARK_FILTERS = [{"kind": "keywords", "words": ["blocked" + str(i) for i in range(500)]},
+                     {"kind": "regex", "patterns": [r"\b" + str(i) + r"\d{3}-\d{4}\b" for i in range(50)]},
+                     {"kind": "spam"},
+                     {"kind": "links", "allowed_domains": ["example.com"]}]
+DEFAULT_PRESENCE_USERS = 10000  # The number of users in the roster of the presence benchmark.
+PRESENCE_CHANGES = 1000  # The number of changes of the roster (joins, leaves, rooms and roles) in the benchmark.
+MEMORY_CONNECTIONS = [10000, 100000]  # The numbers of idle connections the memory benchmark measures.
+SYSCALL_NAMES = ["recv", "sendmsg", "epoll_wait", "epoll_ctl"]
+syscalls = dict.fromkeys(SYSCALL_NAMES, 0)  # The number of every system call the server made (syscalls benchmark).
+
+
+"""
+Represents a client socket of the syscalls benchmark, which counts the system calls the server makes with it.
+"""
+
+
+class CountingSocket(socket.socket):
+    def recv(self, bufsize, *flags):
+        syscalls["recv"] += 1
+        return super().recv(bufsize, *flags)
+
+    def sendmsg(self, buffers, *args):
+        syscalls["sendmsg"] += 1
+        return super().sendmsg(buffers, *args)
+
+
+"""
+Represents the selector of the syscalls benchmark, which counts its system calls. A modification that doesn't change 
+the events isn't passed to the kernel, so it isn't counted.
+"""
+
+
+class CountingSelector(selectors.DefaultSelector):
+    def register(self, fileobj, events, data=None):
+        syscalls["epoll_ctl"] += 1
+        return super().register(fileobj, events, data)
+
+    def unregister(self, fileobj):
+        syscalls["epoll_ctl"] += 1
+        return super().unregister(fileobj)
+
+    def modify(self, fileobj, events, data=None):
+        if self.get_key(fileobj).events != events:
+            syscalls["epoll_ctl"] += 1
+        return super().modify(fileobj, events, data)
+
+    def select(self, timeout=None):
+        syscalls["epoll_wait"] += 1
+        return super().select(timeout)
+
+
+def main():
+    arguments = parse_arguments()
+    if arguments.benchmark == "parse":
+        benchmark_parse(arguments)
+    elif arguments.benchmark == "history":
+        benchmark_history(arguments)
+    elif arguments.benchmark == "metrics":
+        benchmark_metrics(arguments)
+    elif arguments.benchmark == "syscalls":
+        benchmark_syscalls(arguments)
+    elif arguments.benchmark == "timers":
+        benchmark_timers(arguments)
+    elif arguments.benchmark == "memory":
+        benchmark_memory(arguments)
+    elif arguments.benchmark == "frames":
+        benchmark_frames(arguments)
+    elif arguments.benchmark == "compression":
+        benchmark_compression(arguments)
+    elif arguments.benchmark == "filters":
+        benchmark_filters(arguments)
+    elif arguments.benchmark == "presence":
+        benchmark_presence(arguments)
+
+
+# Parses the arguments of the command line and returns them.
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmarks of the chat server.")
+    parser.add_argument("benchmark", choices=BENCHMARKS, help="the benchmark to run")
+    parser.add_argument("--frames", type=int, default=DEFAULT_FRAMES_NUMBER, help="the number of frames to parse")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="the size of the pieces the data is fed in")
+    parser.add_argument("--messages", type=int, default=DEFAULT_MESSAGES_NUMBER,
+                        help="the number of messages saved in the history")
+    parser.add_argument("--commit-batch", type=int, default=DEFAULT_COMMIT_BATCH,
+                        help="the number of messages saved in the history together")
+    parser.add_argument("--history-dir", help="the directory of the history (by default a temporary directory)")
+    parser.add_argument("--recipients", type=int, default=DEFAULT_RECIPIENTS,
+                        help="the number of users that receive the chat messages of the metrics and syscalls "
+                             "benchmarks")
+    parser.add_argument("--bursts", type=int, default=DEFAULT_BURSTS,
+                        help="the number of bursts of chat messages sent by the syscalls benchmark")
+    parser.add_argument("--burst-size", type=int, default=DEFAULT_BURST_SIZE,
+                        help="the number of chat messages in every burst of the syscalls benchmark")
+    parser.add_argument("--frame-messages", type=int, default=DEFAULT_FRAME_MESSAGES,
+                        help="the number of chat messages the frames benchmark builds the frames of")
+    parser.add_argument("--connections", type=int, default=DEFAULT_CONNECTIONS,
+                        help="the number of connections whose deadlines are handled by the timers benchmark")
+    parser.add_argument("--filter-messages", type=int, default=DEFAULT_FILTER_MESSAGES,
+                        help="the number of messages checked by the filters benchmark")
+    parser.add_argument("--presence-users", type=int, default=DEFAULT_PRESENCE_USERS,
+                        help="the number of users in the roster of the presence benchmark")
+    return parser.parse_args()
+
+
+"""
+The formats of the frames compared by the parse benchmark - the original frames of version 1, which repeat the name 
+of the user in every command, and the frames of versions 1 and 2 after a login message.
+"""
+PARSE_FORMATS = ["1 with names", "1", "2"]
+
+
+# Receives a format of frames, and returns the data sent by a client in this format: the hello and login messages
+# (if the format uses them), and a list of a chat message and a private message.
+def prepare_frames(frames_format):
+    name = "benchmark-user"
+    target_name = "other-user"
+    message = "Hello everyone, this is a message of the parse benchmark."
+    if frames_format == "2":
+        return (ProtocolV2.hello(ProtocolV2.VERSION) + ProtocolV2.encode_client_frame(ProtocolV2.LOGIN, name),
+                [ProtocolV2.encode_client_frame(ProtocolV2.CHAT_MESSAGE, message),
+                 ProtocolV2.encode_client_frame(ProtocolV2.PRIVATE_MESSAGE, target_name, message)])
+    login = ""
+    name_field = ""
+    if frames_format == "1":
+        login = Server2.LOGIN + text_field(name, Server2.NAME_LENGTH_DIGITS)
+    else:
+        name_field = text_field(name, Server2.NAME_LENGTH_DIGITS)
+    message_field = text_field(message, Server2.MESSAGE_LENGTH_DIGITS)
+    return (login.encode(),
+            [(name_field + str(Server2.CHAT_MESSAGE) + message_field).encode(),
+             (name_field + str(Server2.PRIVATE_MESSAGE) + text_field(target_name, Server2.NAME_LENGTH_DIGITS)
+              + message_field).encode()])
+
+
+# Receives a text and the number of digits of its length, and returns the field of version 1 of the protocol (the
+# length, with 0s at its beginning, followed by the text).
+def text_field(text, digits_number):
+    return str(len(text)).zfill(digits_number) + text
+
+
+# Receives the parsed arguments. Feeds the same chat and private messages in every format to a FrameReader, in pieces
+# of the chunk size, and prints the time it took to parse them.
+def benchmark_parse(arguments):
+    results = {}
+    for frames_format in PARSE_FORMATS:
+        opening, frames = prepare_frames(frames_format)
+        data = opening + b"".join(frames) * (arguments.frames // len(frames))
+        frame_reader = Server2.FrameReader()
+        parsed_frames = 0
+        start = time.perf_counter()
+        for position in range(0, len(data), arguments.chunk_size):
+            for details in frame_reader.feed(data[position:position + arguments.chunk_size]):
+                if details != Server2.HELLO and details[0] != Server2.LOGIN:
+                    parsed_frames += 1
+        elapsed = time.perf_counter() - start
+        results[frames_format] = elapsed
+        print("Version " + frames_format + ": " + str(parsed_frames) + " frames, " + str(len(data)) + " bytes, "
+              + str(round(elapsed, 3)) + " seconds, " + str(round(elapsed * 1e9 / parsed_frames)) + " ns per frame")
+    for frames_format in PARSE_FORMATS[1:]:
+        print("Version " + frames_format + " parses in " +
+              str(round(results[frames_format] / results[PARSE_FORMATS[0]] * 100)) + "% of the time of version "
+              + PARSE_FORMATS[0])
+
+
+"""
+Receives the parsed arguments. Saves messages in a history, committing them in batches, loads the history again, and 
+asks for the last messages and for the messages after random sequence numbers. Prints the time every part took.
+"""
+def benchmark_history(arguments):
+    if arguments.history_dir is not None:
+        run_history_benchmark(arguments, arguments.history_dir)
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        run_history_benchmark(arguments, directory)
+
+
+# Receives the parsed arguments and the directory of the history, and runs the history benchmark in it.
+def run_history_benchmark(arguments, directory):
+    history = ChatHistory.ChatHistory(directory)
+    text = "00:00 benchmark-user: Hello everyone, this is a message of the history benchmark."
+    start = time.perf_counter()
+    for i in range(arguments.messages):
+        history.append(ChatHistory.CHAT, text)
+        if i % arguments.commit_batch == arguments.commit_batch - 1:
+            history.commit()
+    history.close()
+    elapsed = time.perf_counter() - start
+    print("Saved " + str(arguments.messages) + " messages in " + str(round(elapsed, 3)) + " seconds (" +
+          str(round(arguments.messages / elapsed)) + " messages per second, " +
+          str(arguments.messages // arguments.commit_batch) + " commits)")
+
+    start = time.perf_counter()
+    history = ChatHistory.ChatHistory(directory)
+    print("Loaded " + str(len(history.segments)) + " segments in " + str(round(time.perf_counter() - start, 3)) +
+          " seconds")
+
+    start = time.perf_counter()
+    for i in range(REPLAY_REQUESTS):
+        history.last(REPLAY_COUNT)
+    print_replay_time("last", time.perf_counter() - start)
+    start = time.perf_counter()
+    for i in range(REPLAY_REQUESTS):
+        history.since(random.randrange(history.next_sequence), REPLAY_COUNT)
+    print_replay_time("since", time.perf_counter() - start)
+    history.close()
+
+
+# Receives the kind of the requests for messages from the history and the time they took, and prints it.
+def print_replay_time(kind, elapsed):
+    print(str(REPLAY_REQUESTS) + " requests for " + str(REPLAY_COUNT) + " messages (" + kind + ") in " +
+          str(round(elapsed, 3)) + " seconds, " + str(round(elapsed * 1e6 / REPLAY_REQUESTS)) + " us per request")
+
+
+
+"""
+Receives the parsed arguments. Handles chat messages of one user to the other users in the server itself (the users 
+are AsyncClient objects that aren't connected, and their queues are emptied after every batch), with the metrics 
+disabled and enabled, and prints the overhead of the metrics.
+"""
+def benchmark_metrics(arguments):
+    clients = [Server2.AsyncClient(None, None) for i in range(arguments.recipients + 1)]
+    sender = clients[0]
+    frame = ProtocolV2.encode_client_frame(ProtocolV2.CHAT_MESSAGE, "Hello everyone, this is a metrics benchmark.")
+    results = {"disabled": None, "enabled": None}
+    for client in clients:
+        Server2.add_client(client)
+    Server2.handle_received_bytes(sender, ProtocolV2.hello(ProtocolV2.VERSION) +
+                                  ProtocolV2.encode_client_frame(ProtocolV2.LOGIN, "benchmark-user"))
+    for i in range(METRICS_ROUNDS):
+        for mode in results:
+            Server2.metrics = None
+            if mode == "enabled":
+                Server2.metrics = Server2.ServerMetrics()
+            elapsed = handle_chat_frames(clients, frame, arguments.frames, arguments.commit_batch)
+            if results[mode] is None or elapsed < results[mode]:
+                results[mode] = elapsed
+    Server2.metrics = None
+    for mode, elapsed in results.items():
+        print("Metrics " + mode + ": " + str(arguments.frames) + " chat messages to " + str(arguments.recipients) +
+              " users in " + str(round(elapsed, 3)) + " seconds, " + str(round(elapsed * 1e9 / arguments.frames)) +
+              " ns per message")
+    print("The metrics add " + str(round((results["enabled"] / results["disabled"] - 1) * 100, 1)) + "% to the time")
+
+
+# Receives the clients of the metrics benchmark, a chat frame, the number of frames and the size of a batch. The
+# first client sends the frames, and the queues are emptied after every batch. Returns the time it took.
+def handle_chat_frames(clients, frame, frames_number, batch):
+    start = time.perf_counter()
+    for i in range(0, frames_number, batch):
+        Server2.handle_received_bytes(clients[0], frame * min(batch, frames_number - i))
+        for client in clients:
+            user = Server2.users_dict[client]
+            user.outgoing = Server2.NO_MESSAGES
+            user.queued_bytes = 0
+    return time.perf_counter() - start
+
+
+"""
+Receives the parsed arguments. Runs the selectors engine of the server in this process, with clients connected over 
+pairs of local sockets: one of them sends bursts of chat messages, which are delivered to all of them. Counts the 
+system calls of the server with every flush policy (see Server2.flush_policy) and prints them per delivered message.
+"""
+def benchmark_syscalls(arguments):
+    Server2.selector = CountingSelector()
+    clients = []  # Pairs of the socket of the server and the socket of the client.
+    for i in range(arguments.recipients + 1):
+        server_side, client_side = socket.socketpair()
+        server_side = CountingSocket(fileno=server_side.detach())
+        server_side.setblocking(False)
+        client_side.setblocking(False)
+        Server2.selector.register(server_side, selectors.EVENT_READ)
+        Server2.add_client(server_side)
+        clients.append((server_side, client_side))
+    sender = clients[0][1]
+    sender.sendall(ProtocolV2.hello(ProtocolV2.VERSION) +
+                   ProtocolV2.encode_client_frame(ProtocolV2.LOGIN, "benchmark-user"))
+    run_until_idle(clients)
+    frame = ProtocolV2.encode_client_frame(ProtocolV2.CHAT_MESSAGE, "Hello everyone, this is a syscalls benchmark.")
+    delivered = arguments.bursts * arguments.burst_size * len(clients)
+    results = {}
+    for policy in ["writable", "tick"]:
+        Server2.flush_policy = policy
+        for name in SYSCALL_NAMES:
+            syscalls[name] = 0
+        start = time.perf_counter()
+        for i in range(arguments.bursts):
+            sender.sendall(frame * arguments.burst_size)
+            run_until_idle(clients)
+        elapsed = time.perf_counter() - start
+        results[policy] = sum(syscalls.values())
+        print("Flush policy " + policy + ": " + str(delivered) + " messages delivered in " + str(round(elapsed, 3)) +
+              " seconds, " + ", ".join(name + " " + str(syscalls[name]) for name in SYSCALL_NAMES) + " - " +
+              str(round(results[policy] / delivered, 3)) + " system calls per delivered message")
+    print("The tick policy makes " + str(round((1 - results["tick"] / results["writable"]) * 100, 1)) +
+          "% fewer system calls")
+    for server_side, client_side in clients:
+        client_side.close()
+
+
+# Receives the pairs of sockets of the syscalls benchmark, and runs iterations of the server's loop until it has
+# nothing to do. The clients read everything the server sends them meanwhile.
+def run_until_idle(clients):
+    while True:
+        events = Server2.selector.select(0)
+        Server2.handle_selector_events(events)
+        for server_side, client_side in clients:
+            try:
+                while client_side.recv(Server2.MAX_BYTES) != b"":
+                    pass
+            except BlockingIOError:
+                pass
+        if len(events) == 0 and all(len(user.outgoing) == 0 for user in Server2.users_dict.values()):
+            return
+
+
+"""
+Receives the parsed arguments. Gives every connection a deadline in the next TIMERS_DURATION seconds, and runs the 
+ticks of this time (without waiting) with three ways of finding the expired deadlines: the timer wheel of the server, 
+a heap, and checking every connection in every tick. Prints the time every way spends per tick.
+"""
+def benchmark_timers(arguments):
+    start = time.monotonic()
+    resolution = TimerWheel.DEFAULT_RESOLUTION
+    deadlines = [start + random.uniform(0, TIMERS_DURATION) for i in range(arguments.connections)]
+    ticks = [start + resolution * (i + 1) for i in range(int(TIMERS_DURATION / resolution) + 1)]
+
+    wheel = TimerWheel.TimerWheel(resolution)
+    begin = time.perf_counter()
+    for connection, deadline in enumerate(deadlines):
+        wheel.add(deadline, connection)
+    expired = sum(len(wheel.advance(now)) for now in ticks)
+    print_timers_time("Timer wheel", time.perf_counter() - begin, len(ticks), expired)
+
+    heap = []
+    begin = time.perf_counter()
+    for connection, deadline in enumerate(deadlines):
+        heapq.heappush(heap, (deadline, connection))
+    expired = 0
+    for now in ticks:
+        while len(heap) != 0 and heap[0][0] <= now:
+            heapq.heappop(heap)
+            expired += 1
+    print_timers_time("Heap", time.perf_counter() - begin, len(ticks), expired)
+
+    waiting = dict(enumerate(deadlines))
+    begin = time.perf_counter()
+    expired = 0
+    for now in ticks:
+        for connection in [connection for connection, deadline in waiting.items() if deadline <= now]:
+            del waiting[connection]
+            expired += 1
+    print_timers_time("Checking every connection", time.perf_counter() - begin, len(ticks), expired)
+
+
+# Receives the name of a way of the timers benchmark, its time, the number of ticks and the number of expired
+# deadlines, and prints them.
+def print_timers_time(name, elapsed, ticks_number, expired):
+    print(name + ": " + str(expired) + " deadlines expired in " + str(ticks_number) + " ticks, " +
+          str(round(elapsed / ticks_number * 1000000, 1)) + " microseconds per tick")
+
+
+"""
+Receives the parsed arguments. For every number of connections in MEMORY_CONNECTIONS, creates in a new process the 
+state the server keeps for that many idle users - logged in with version 2 of the protocol, in the main room, with 
+their deadline in the timers and an empty queue - and prints the growth of the RSS of the process. The sockets 
+themselves aren't created (they are the same with any state), so a plain object stands for every socket.
+Linux only (the RSS is read from /proc).
+"""
+def benchmark_memory(arguments):
+    for connections_number in MEMORY_CONNECTIONS:
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_end)
+            os.write(write_end, str(measure_idle_users(connections_number)).encode())
+            os._exit(0)
+        os.close(write_end)
+        growth = int(os.read(read_end, 100))
+        os.close(read_end)
+        os.waitpid(pid, 0)
+        print(str(connections_number) + " idle connections: RSS grew by " + str(round(growth / 2 ** 20, 1)) +
+              " MiB, " + str(growth // connections_number) + " bytes per connection")
+
+
+# Receives a number of connections, creates the state of that many idle users (see benchmark_memory) and returns the
+# growth of the RSS of the process in bytes.
+def measure_idle_users(connections_number):
+    login = ProtocolV2.hello(ProtocolV2.VERSION)
+    gc.collect()
+    rss_before = read_rss()
+    for i in range(connections_number):
+        client = object()
+        user = Server2.User()
+        Server2.users_dict[client] = user
+        Server2.enter_room(client, user, Server2.main_room)
+        user.frame_reader.feed(login + ProtocolV2.encode_client_frame(ProtocolV2.LOGIN, "user" + str(i)))
+        user.protocol_version = user.frame_reader.protocol_version
+        user.name = "user" + str(i)
+        Server2.sockets_by_name[user.name] = [client]
+        Server2.schedule_connection_check(client, user)
+    gc.collect()
+    return read_rss() - rss_before
+
+
+# Returns the resident set size of this process, in bytes.
+def read_rss():
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+"""
+Receives the parsed arguments. Builds the frames of chat messages the way handle_chat_message does - the echo to the 
+sender and the message to the others (with a sequence number, like a message saved in the history), each of them in 
+both versions of the protocol - and prints the frames built every second.
+"""
+def benchmark_frames(arguments):
+    texts = ["Message number " + str(i) + " of the frames benchmark, about as long as a chat message."
+             for i in range(1000)]
+    name = "benchmark-user"
+    start = time.perf_counter()
+    for i in range(arguments.frame_messages):
+        message = texts[i % len(texts)]
+        echo = Server2.EncodedMessage(Server2.str_time() + "You: " + message)
+        broadcast = Server2.EncodedMessage(Server2.str_time() + name + ": " + message, i)
+        for data in (echo, broadcast):
+            data.frame(1)
+            data.frame(ProtocolV2.VERSION)
+    elapsed = time.perf_counter() - start
+    frames_number = arguments.frame_messages * 4
+    print(str(frames_number) + " frames built in " + str(round(elapsed, 3)) + " seconds, " +
+          str(round(frames_number / elapsed)) + " frames per second")
+
+"""
+Receives the parsed arguments. Compresses payloads of the kinds users send - a typical chat message, a pasted log and 
+pasted code, as long as a message can be, and random text that doesn't compress - with every level in 
+COMPRESSION_LEVELS. Prints the time of compressing and decompressing every payload once, and the bytes a broadcast of 
+it to the recipients (--recipients) takes, with and without compression. The server compresses a broadcast once, so 
+the time is paid once while the bytes are saved for every recipient.
+"""
+def benchmark_compression(arguments):
+    log_line = "12:00:01 INFO worker handled the request of the room in 12 ms, 3 messages waiting.\n"
+    with open(Server2.__file__) as code_file:
+        code = code_file.read()[:Server2.MAX_MESSAGE_LENGTH]
+    payloads = {"typical": "Is anyone up for lunch at the place near the station? I can be there at one.",
+                "log": (log_line * (Server2.MAX_MESSAGE_LENGTH // len(log_line) + 1))[:Server2.MAX_MESSAGE_LENGTH],
+                "code": code,
+                "random": "".join(random.choice("abcdefghijklmnopqrstuvwxyz0123456789 ")
+                                  for i in range(Server2.MAX_MESSAGE_LENGTH))}
+    for kind, text in payloads.items():
+        plain = ProtocolV2.encode_server_frame(text)
+        print("Payload " + kind + ": " + str(len(plain)) + " bytes, " + str(len(plain) * arguments.recipients) +
+              " bytes to " + str(arguments.recipients) + " recipients without compression")
+        for level in COMPRESSION_LEVELS:
+            start = time.perf_counter()
+            for i in range(COMPRESSION_ROUNDS):
+                frame = ProtocolV2.encode_compressed_server_frame(text, None, level)
+            compress_time = (time.perf_counter() - start) / COMPRESSION_ROUNDS
+            if frame is None:
+                print("    Level " + str(level) + ": doesn't get shorter (" + str(round(compress_time * 1e6, 1)) +
+                      " microseconds wasted)")
+                continue
+            compressed = frame[ProtocolV2.read_frame_header(frame, 0)[2]:]
+            start = time.perf_counter()
+            for i in range(COMPRESSION_ROUNDS):
+                ProtocolV2.decompress_text(compressed)
+            decompress_time = (time.perf_counter() - start) / COMPRESSION_ROUNDS
+            print("    Level " + str(level) + ": " + str(len(frame)) + " bytes (" +
+                  str(round(len(frame) / len(plain) * 100, 1)) + "%), " + str(len(frame) * arguments.recipients) +
+                  " bytes to the recipients, compressed in " + str(round(compress_time * 1e6, 1)) +
+                  " microseconds, decompressed in " + str(round(decompress_time * 1e6, 1)) + " microseconds")
+
+
+"""
+Receives the parsed arguments. Checks chat messages with BENCHMARK_FILTERS: in the loop itself, and in a pool of 
+processes and a pool of threads (like the server). Prints the time the loop spends on every message - all of the 
+filters when they run in it, or only sending the message when they run in a pool - and the messages checked every 
+second.
+"""
+def benchmark_filters(arguments):
+    texts = ["Message number " + str(i) + " of the filters benchmark, see http://example.com/page" + str(i)
+             for i in range(1000)]
+    MessageFilters.configure(BENCHMARK_FILTERS)
+    start = time.perf_counter()
+    for i in range(arguments.filter_messages):
+        MessageFilters.run_pipeline(texts[i % len(texts)])
+    print_filters_time("In the loop", time.perf_counter() - start, time.perf_counter() - start,
+                       arguments.filter_messages)
+    pools = {"Process pool": multiprocessing.get_context("spawn").Pool(FILTER_WORKERS, MessageFilters.start_worker,
+                                                                       (BENCHMARK_FILTERS,)),
+             "Thread pool": multiprocessing.pool.ThreadPool(FILTER_WORKERS)}
+    for name, pool in pools.items():
+        pool.apply(MessageFilters.total_timeout, ([],))  # Waits until the pool has started.
+        start = time.perf_counter()
+        results = [pool.apply_async(MessageFilters.run_pipeline, (texts[i % len(texts)],))
+                   for i in range(arguments.filter_messages)]
+        loop_time = time.perf_counter() - start
+        for result in results:
+            result.get()
+        print_filters_time(name, loop_time, time.perf_counter() - start, arguments.filter_messages)
+        pool.terminate()
+
+
+# Receives the name of the way the filters run, the time the loop spent, the time until all the messages were checked
+# and the number of messages, and prints them.
+def print_filters_time(name, loop_time, elapsed, messages_number):
+    print(name + ": " + str(round(loop_time / messages_number * 1e6, 1)) + " microseconds of the loop per message, " +
+          str(round(messages_number / elapsed)) + " messages per second")
+
+
+"""
+Receives the parsed arguments. Fills a roster with users (--presence-users), and makes PRESENCE_CHANGES changes of it - 
+users join, leave, move between rooms and are appointed. Compares the subscribers (--recipients) getting the delta of 
+every change with the subscribers asking for the whole roster after every change (as they ask for the managers). 
+Prints the bytes sent to the subscribers and the time the server spends on the changes in both ways (the whole roster 
+is built once for every request).
+"""
+def benchmark_presence(arguments):
+    roster = Presence.Roster()
+    rooms = ["main"] + ["room" + str(i) for i in range(20)]
+    for key in range(arguments.presence_users):
+        roster.update(key, "user" + str(key), random.choice(rooms), 0)
+    next_key = arguments.presence_users
+    delta_bytes = 0
+    snapshot_bytes = 0
+    delta_time = 0
+    snapshot_time = 0
+    for i in range(PRESENCE_CHANGES):
+        change = random.choice(["join", "leave", "room", "manager"])
+        key = next_key if change == "join" else random.choice(list(roster.entries))
+        start = time.perf_counter()
+        if change == "join":
+            delta = roster.update(key, "user" + str(key), "main", 0)
+            next_key += 1
+        elif change == "leave":
+            delta = roster.remove(key)
+        elif change == "room":
+            delta = roster.update(key, roster.entries[key].name, random.choice(rooms), 0)
+        else:
+            delta = roster.update(key, roster.entries[key].name, roster.entries[key].room, Presence.MANAGER)
+        delta_time += time.perf_counter() - start
+        if delta is None:  # The user was in the room or a manager already.
+            continue
+        delta_bytes += len(delta) * arguments.recipients
+        start = time.perf_counter()
+        pages = Presence.encode_snapshot(roster.version, roster.entries.values())
+        snapshot_time += (time.perf_counter() - start) * arguments.recipients
+        snapshot_bytes += sum(len(page) for page in pages) * arguments.recipients
+    print(str(PRESENCE_CHANGES) + " changes of a roster of " + str(arguments.presence_users) + " users, " +
+          str(arguments.recipients) + " subscribers:")
+    print("Deltas: " + str(delta_bytes) + " bytes, " + str(round(delta_time * 1000, 2)) + " ms of the server")
+    print("The whole roster after every change: " + str(snapshot_bytes) + " bytes, " +
+          str(round(snapshot_time * 1000, 2)) + " ms of the server")
+
+if __name__ == '__main__':
+    main()
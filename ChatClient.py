@@ -0,0 +1,344 @@
+# A client library of the chat: an asyncio connection to the server, without a terminal.
+# Auther: Gilad Moyal.
+
+import asyncio
+import collections
+import Presence
+import ProtocolV2
+
+"""
+connect() opens a connection, negotiates the version of the protocol and logs in. The ChatConnection it returns has a
+method for every command, and is an async iterator of the messages of the server:
+
+    connection = await ChatClient.connect("bot")
+    await connection.send_chat("Hello")
+    async for message in connection:
+        print(message.text)
+
+Nothing here depends on a terminal or on the operating system, so one process can open thousands of connections
+(Client2.py, the console of the chat, and LoadGenerator.py are built on it).
+"""
+
+SERVER_ADDRESS = ('127.0.0.1', 1111)
+MAX_BYTES = 100000  # The maximal size of every "chunk" of bytes sent threw the socket (6 digits)
+LENGTH_DIGITS = len(str(MAX_BYTES))  # The number of digits of the length at the beginning of a message of version 1.
+MAX_NAME_LENGTH = 99  # The maximal length of the user's name (2 digits).
+MAX_MESSAGE_LENGTH = 9999  # The maximal length of a message the user sends (4 digits).
+
+# A dictionary of the commands of version 1 without a number (the key is their frame type in version 2), the value is
+# the text sent instead of the number.
+BASIC_MESSAGES = {ProtocolV2.QUIT: "quit", ProtocolV2.VIEW_MANAGERS: "view-managers", ProtocolV2.LOGIN: "login",
+                  ProtocolV2.JOIN_ROOM: "join-room", ProtocolV2.LEAVE_ROOM: "leave-room",
+                  ProtocolV2.VIEW_ROOMS: "view-rooms"}
+# A dictionary of the commands with fields, the value is the maximal length of every field. In version 1 every field
+# starts with its length, with as many digits as the maximal length has.
+FIELD_LENGTHS = {ProtocolV2.CHAT_MESSAGE: (MAX_MESSAGE_LENGTH,), ProtocolV2.APPOINT_MANAGER: (MAX_NAME_LENGTH,),
+                 ProtocolV2.REMOVE_FROM_CHAT: (MAX_NAME_LENGTH,), ProtocolV2.SILENCE_USER: (MAX_NAME_LENGTH,),
+                 ProtocolV2.PRIVATE_MESSAGE: (MAX_NAME_LENGTH, MAX_MESSAGE_LENGTH),
+                 ProtocolV2.HISTORY: (MAX_NAME_LENGTH, MAX_NAME_LENGTH), ProtocolV2.LOGIN: (MAX_NAME_LENGTH,),
+                 ProtocolV2.JOIN_ROOM: (MAX_NAME_LENGTH,), ProtocolV2.COMPRESSION: (MAX_NAME_LENGTH,)}
+
+"""
+Represents a message received from the server.
+Described by:
+text (string) - the message, as it should be printed.
+sequence (int) - the sequence number of the message in the history of the chat, or None if the server didn't send it
+        (only messages from the history have it, in version 2 of the protocol).
+"""
+
+
+class ServerMessage:
+    def __init__(self, text, sequence=None):
+        self.text = text
+        self.sequence = sequence
+
+
+"""
+Represents a connection of a logged in user to the server. Created by connect().
+Described by:
+name (string) - the name of the user.
+reader, writer (asyncio streams) - the streams of the connection.
+protocol_version (int) - the version of the protocol chosen by the server.
+hello_answered (boolean) - whether or not the server answered the hello message (chose the version).
+buffer (bytearray) - the received data that hasn't been separated into frames yet (the beginning of a partial frame).
+pending (deque of ServerMessage) - the messages that have been received, before they are read by the user.
+closed (boolean) - whether or not the connection has been closed.
+roster (dictionary) - the users of the chat after subscribe_presence(), kept up to date by the deltas of the server.
+        The key is the number of the entry, the value is a Presence.RosterEntry.
+roster_version (int) - the version of the roster, or None before its snapshot arrives.
+snapshot_pages (dictionary) - the entries of the pages of the snapshot that have arrived, until its last page arrives
+        (None when no snapshot is arriving).
+snapshot_version (int) - the version of the snapshot that is arriving.
+The data is read in chunks of whatever has arrived, and all the frames completed by a chunk are separated at once, so 
+a burst of messages costs one read instead of several reads for every message.
+"""
+
+
+class ChatConnection:
+    def __init__(self, name, reader, writer):
+        self.name = name
+        self.reader = reader
+        self.writer = writer
+        self.protocol_version = 1
+        self.hello_answered = False
+        self.buffer = bytearray()
+        self.pending = collections.deque()
+        self.closed = False
+        self.roster = {}
+        self.roster_version = None
+        self.snapshot_pages = None
+        self.snapshot_version = None
+
+    # Receives a message and sends it to all the users in the room.
+    async def send_chat(self, message):
+        await self.send(ProtocolV2.CHAT_MESSAGE, message)
+
+    # Receives the name of a user and a message, and sends the message to this user only.
+    async def send_private(self, target_name, message):
+        await self.send(ProtocolV2.PRIVATE_MESSAGE, target_name, message)
+
+    # Receives the name of a user and appoints him as a manager (for managers only).
+    async def appoint(self, target_name):
+        await self.send(ProtocolV2.APPOINT_MANAGER, target_name)
+
+    # Receives the name of a user and removes him from the chat or from the room (for managers only).
+    async def remove(self, target_name):
+        await self.send(ProtocolV2.REMOVE_FROM_CHAT, target_name)
+
+    # Receives the name of a user and silences him (for managers only).
+    async def silence(self, target_name):
+        await self.send(ProtocolV2.SILENCE_USER, target_name)
+
+    # Asks for the list of managers of the room.
+    async def view_managers(self):
+        await self.send(ProtocolV2.VIEW_MANAGERS)
+
+    # Receives a number of messages and a sequence number (optional), and asks for the messages from the history of
+    # the chat: the last messages, or the messages after the sequence number. Raises ValueError if they aren't numbers.
+    async def view_history(self, count, since=""):
+        count = str(count)
+        since = str(since)
+        if not count.isdigit() or not (since == "" or since.isdigit()):
+            raise ValueError("the count and the sequence number should be numbers")
+        await self.send(ProtocolV2.HISTORY, count, since)
+
+    # Receives the name of a room and joins it (it's opened if it doesn't exist).
+    async def join_room(self, room_name):
+        await self.send(ProtocolV2.JOIN_ROOM, room_name)
+
+    # Leaves the room and goes back to the main room.
+    async def leave_room(self):
+        await self.send(ProtocolV2.LEAVE_ROOM)
+
+    # Asks for the list of rooms.
+    async def view_rooms(self):
+        await self.send(ProtocolV2.VIEW_ROOMS)
+
+    # Subscribes to the presence: the server sends the roster of the chat once, and then every change of it, which
+    # update the roster of the connection. Raises ValueError if the connection uses version 1 of the protocol.
+    async def subscribe_presence(self):
+        if self.protocol_version != ProtocolV2.VERSION:
+            raise ValueError("the presence needs version 2 of the protocol")
+        await self.send(ProtocolV2.PRESENCE)
+
+    # Leaves the chat and closes the connection.
+    async def quit(self):
+        if self.closed is False:
+            await self.send(ProtocolV2.QUIT)
+        await self.close()
+
+    # Receives a command (its frame type in version 2) and its fields, and sends it in the chosen version of the
+    # protocol. Raises ValueError if a field is too long.
+    async def send(self, command, *fields):
+        self.writer.write(encode_command(self.protocol_version, command, *fields))
+        await self.writer.drain()
+
+    # Closes the connection.
+    async def close(self):
+        if self.closed is True:
+            return
+        self.closed = True
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self.receive()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    # Returns the next message of the server (a ServerMessage), or None if the connection has been closed.
+    async def receive(self):
+        while len(self.pending) == 0:
+            if await self.fill() is False and len(self.pending) == 0:
+                return None
+        return self.pending.popleft()
+
+    # Waits for the next message of the server, and returns a list of it and of all the messages that have already
+    # been received after it (without waiting for more data), so a burst can be handled at once. Returns an empty
+    # list if the connection has been closed.
+    async def receive_available(self):
+        while len(self.pending) == 0:
+            if await self.fill() is False and len(self.pending) == 0:
+                return []
+        messages = list(self.pending)
+        self.pending.clear()
+        return messages
+
+    """
+    Reads the data that has arrived from the server (waits until some has), and adds the messages of all the frames 
+    it completes to pending. Returns False if the connection has been closed, or the server sent data that doesn't 
+    match the protocol (like a compressed text that isn't valid). Otherwise returns True.
+    """
+    async def fill(self):
+        try:
+            data = await self.reader.read(MAX_BYTES)
+        except ConnectionError:
+            return False
+        if data == b"":
+            return False
+        self.buffer += data
+        try:
+            position = self.parse_frames()
+        except (ValueError, UnicodeDecodeError):
+            return False
+        del self.buffer[:position]
+        return True
+
+    """
+    Separates the complete frames in the buffer: the messages are added to pending, the answer to the hello message 
+    sets the version of the protocol, and a ping of the server is answered right away.
+    Returns the position after the last complete frame. Raises ValueError if the data doesn't match the protocol.
+    """
+    def parse_frames(self):
+        buffer = self.buffer
+        position = 0
+        while position < len(buffer):
+            first_byte = buffer[position]
+            if first_byte == ProtocolV2.HELLO_BYTE:
+                if len(buffer) - position < 2:
+                    break
+                self.protocol_version = buffer[position + 1]
+                self.hello_answered = True
+                position += 2
+            elif first_byte not in ProtocolV2.SERVER_FRAME_TYPES:  # Version 1: the length (6 digits).
+                text_start = position + LENGTH_DIGITS
+                if len(buffer) < text_start:
+                    break
+                text_end = text_start + int(buffer[position:text_start])
+                if len(buffer) < text_end:
+                    break
+                self.pending.append(ServerMessage(buffer[text_start:text_end].decode()))
+                position = text_end
+            else:
+                header = ProtocolV2.read_frame_header(buffer, position)
+                if header is None:  # The rest of the frame hasn't been received yet.
+                    break
+                frame_type, flags, payload_start, position = header
+                if frame_type == ProtocolV2.PING:
+                    if self.closed is False:
+                        self.writer.write(ProtocolV2.encode_client_frame(ProtocolV2.PONG))
+                elif frame_type == ProtocolV2.SERVER_TEXT:
+                    self.pending.append(decode_server_message(buffer, flags, payload_start, position))
+                else:
+                    self.update_roster(frame_type, flags, buffer, payload_start, position)
+        return position
+
+    """
+    Receives the type and the flags of a presence frame, the buffer and the positions where its payload starts and 
+    ends, and updates the roster. The pages of a snapshot are collected, and replace the roster when the last one 
+    arrives. A delta that doesn't follow the version of the roster (which shouldn't happen on one connection) makes 
+    the client subscribe again, and the deltas are ignored until the new snapshot arrives. Raises ValueError if the 
+    payload isn't valid.
+    """
+    def update_roster(self, frame_type, flags, buffer, payload_start, payload_end):
+        if frame_type == ProtocolV2.PRESENCE_SNAPSHOT:
+            version, entries = Presence.decode_snapshot(buffer, payload_start, payload_end)
+            if self.snapshot_pages is None or self.snapshot_version != version:  # The first page.
+                self.snapshot_pages = {}
+                self.snapshot_version = version
+            self.snapshot_pages.update(entries)
+            if not flags & Presence.MORE:
+                self.roster = self.snapshot_pages
+                self.roster_version = version
+                self.snapshot_pages = None
+            return
+        version, kind, entry = Presence.decode_delta(buffer, payload_start, payload_end)
+        if self.roster_version is None:
+            return
+        if version != self.roster_version + 1:
+            self.roster_version = None
+            if self.closed is False:
+                self.writer.write(ProtocolV2.encode_client_frame(ProtocolV2.PRESENCE))
+            return
+        self.roster_version = version
+        if kind == Presence.LEFT:
+            self.roster.pop(entry.number, None)
+        else:
+            self.roster[entry.number] = entry
+
+
+"""
+Receives the name of the user, the address of the server (optional), the highest version of the protocol to offer
+(optional, by default version 2) and whether or not to accept compressed messages (optional, by default True - only 
+in version 2). Connects to the server, waits for its choice of the version (the messages the server sends with it 
+are kept for the iterator) and logs in.
+Returns the ChatConnection. Raises OSError if the server can't be reached or closes the connection, and ValueError
+if the name is too long.
+"""
+async def connect(name, address=SERVER_ADDRESS, protocol_version=ProtocolV2.VERSION, compression=True):
+    reader, writer = await asyncio.open_connection(address[0], address[1])
+    connection = ChatConnection(name, reader, writer)
+    if protocol_version > 1:
+        writer.write(ProtocolV2.hello(protocol_version))
+        while connection.hello_answered is False:
+            if await connection.fill() is False:
+                await connection.close()
+                raise ConnectionError("the server closed the connection")
+    if connection.protocol_version == ProtocolV2.VERSION and compression is True:
+        await connection.send(ProtocolV2.COMPRESSION, ProtocolV2.ZLIB)
+    await connection.send(ProtocolV2.LOGIN, name)
+    return connection
+
+
+"""
+Receives a buffer, the flags of a server frame in it and the positions where its payload starts and ends, and returns 
+the message of the frame (ServerMessage), decompressed if the server compressed it. Raises ValueError if the payload 
+isn't valid.
+"""
+def decode_server_message(buffer, flags, payload_start, payload_end):
+    sequence = None
+    if flags & ProtocolV2.SEQUENCE:
+        result = ProtocolV2.decode_varint(buffer, payload_start, payload_end)
+        if result is None:
+            raise ValueError("invalid sequence number")
+        sequence, payload_start = result
+    text = bytes(buffer[payload_start:payload_end])
+    if flags & ProtocolV2.COMPRESSED:
+        text = ProtocolV2.decompress_text(text)
+    return ServerMessage(text.decode(), sequence)
+
+
+"""
+Receives a version of the protocol, a command (its frame type in version 2) and its fields (strings), and returns the
+command encoded in this version (bytes). Raises ValueError if a field is longer than the protocol allows.
+"""
+def encode_command(protocol_version, command, *fields):
+    max_lengths = FIELD_LENGTHS.get(command, ())
+    if len(fields) != len(max_lengths):
+        raise ValueError("wrong number of fields")
+    for field, max_length in zip(fields, max_lengths):
+        if len(field) > max_length:
+            raise ValueError("field too long")
+    if protocol_version == ProtocolV2.VERSION:
+        return ProtocolV2.encode_client_frame(command, *fields)
+    data = BASIC_MESSAGES.get(command, str(command))
+    for field, max_length in zip(fields, max_lengths):
+        data += str(len(field)).zfill(len(str(max_length))) + field
+    return data.encode()
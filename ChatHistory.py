@@ -0,0 +1,259 @@
+# The persistent history of the chat: an append-only log of the messages, divided into segment files.
+# Auther: Gilad Moyal.
+
+import os
+import mmap
+import bisect
+import struct
+import time
+from array import array
+
+"""
+Every message gets a sequence number (starting from 1), and is written to the end of the current segment as a record:
+a header (sequence number, time, kind and length of the text) followed by the text (UTF-8). When the segment gets to
+segment_size bytes, a new segment is started. A segment is named after the sequence number of its first record.
+Next to every segment there is an index file with the position of every record in the segment (8 bytes each, in the
+byte order of the machine), so a record is found without reading the records before it, and the index is loaded
+without reading the segment.
+The messages are kept in memory until commit() writes all of them together and calls fsync once (group commit).
+"""
+
+RECORD_HEADER = struct.Struct("!QdBI")  # Sequence number, time, kind and length of the text.
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024  # The size of a segment file when a new one is started (64 MiB).
+SEGMENT_SUFFIX = ".log"
+INDEX_SUFFIX = ".idx"
+
+# The kinds of the messages in the history.
+CHAT = 1
+MODERATION = 2  # Appointments of managers, removals and silences.
+PRESENCE = 3  # Users that joined or left the chat.
+
+"""
+Represents a segment file of the history.
+Described by:
+first_sequence (int) - the sequence number of the first record in the segment.
+path (string) - the path of the segment file, and index_path of its index file.
+offsets (array of int) - the position of every record in the segment file.
+size (int) - how many bytes of the segment have been written.
+map (mmap) - the segment file mapped to memory for reading, or None. The map of the last segment is renewed when it
+        gets bigger.
+"""
+
+
+class Segment:
+    def __init__(self, directory, first_sequence):
+        self.first_sequence = first_sequence
+        self.path = os.path.join(directory, "%020d" % first_sequence + SEGMENT_SUFFIX)
+        self.index_path = os.path.join(directory, "%020d" % first_sequence + INDEX_SUFFIX)
+        self.offsets = array("Q")
+        self.size = 0
+        self.map = None
+
+    # Returns the segment file mapped to memory, up to the bytes that have been written.
+    def get_map(self):
+        if self.map is not None and len(self.map) < self.size:
+            self.map.close()
+            self.map = None
+        if self.map is None:
+            with open(self.path, "rb") as segment_file:
+                self.map = mmap.mmap(segment_file.fileno(), self.size, access=mmap.ACCESS_READ)
+        return self.map
+
+    # Closes the map of the segment file, if it's mapped.
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+
+"""
+Represents the history of the chat, stored in a directory.
+Described by:
+directory (string) - the directory of the segment files.
+segment_size (int) - the size of a segment file when a new one is started.
+segments (list of Segment) - the segments, by the order of their sequence numbers. The last one is the current segment.
+first_sequences (list of int) - the first sequence number of every segment (to find a segment by binary search).
+pending (bytearray) - the records that haven't been written to the current segment yet.
+pending_offsets (array of int) - the positions the pending records will have in the current segment.
+next_sequence (int) - the sequence number of the next message.
+log_file, index_file - the current segment file and its index file, opened for appending.
+dirty (boolean) - whether or not there are messages that haven't been committed yet.
+"""
+
+
+class ChatHistory:
+    def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.segments = []
+        self.first_sequences = []
+        self.pending = bytearray()
+        self.pending_offsets = array("Q")
+        self.next_sequence = 1
+        self.log_file = None
+        self.index_file = None
+        self.dirty = False
+        self.load()
+
+    # Loads the index of every segment in the directory, and opens the last segment for appending (or a new one, if
+    # the directory is empty).
+    def load(self):
+        first_sequences = sorted(int(file_name[:-len(SEGMENT_SUFFIX)]) for file_name in os.listdir(self.directory)
+                                 if file_name.endswith(SEGMENT_SUFFIX))
+        for first_sequence in first_sequences:
+            segment = Segment(self.directory, first_sequence)
+            segment.size = os.path.getsize(segment.path)
+            if os.path.exists(segment.index_path):
+                with open(segment.index_path, "rb") as index_file:
+                    segment.offsets.frombytes(index_file.read())
+            if len(segment.offsets) == 0 or record_end(segment, segment.offsets[-1]) != segment.size:
+                self.repair_segment(segment)
+            self.segments.append(segment)
+            self.first_sequences.append(first_sequence)
+        if len(self.segments) == 0:
+            self.open_segment(1)
+            return
+        last_segment = self.segments[-1]
+        self.next_sequence = last_segment.first_sequence + len(last_segment.offsets)
+        self.log_file = open(last_segment.path, "ab")
+        self.index_file = open(last_segment.index_path, "ab")
+
+    """
+    Receives a segment whose index doesn't match its records (the server was stopped between writing them), and
+    makes them match: removes the positions of records that weren't written completely, adds the positions of records
+    that were written after the last index update, and cuts a record that was written partly from the end of the
+    segment.
+    """
+    def repair_segment(self, segment):
+        offsets = segment.offsets
+        while len(offsets) != 0 and record_end(segment, offsets[-1]) is None:
+            offsets.pop()
+        position = 0
+        if len(offsets) != 0:
+            position = record_end(segment, offsets[-1])
+        while position < segment.size:
+            end = record_end(segment, position)
+            if end is None:
+                break
+            offsets.append(position)
+            position = end
+        segment.close()
+        if position < segment.size:
+            os.truncate(segment.path, position)
+            segment.size = position
+        with open(segment.index_path, "wb") as index_file:
+            index_file.write(offsets.tobytes())
+
+    # Receives the sequence number of the first message of a new segment. Creates the segment and opens it for
+    # appending.
+    def open_segment(self, first_sequence):
+        segment = Segment(self.directory, first_sequence)
+        self.log_file = open(segment.path, "ab")
+        self.index_file = open(segment.index_path, "ab")
+        self.segments.append(segment)
+        self.first_sequences.append(first_sequence)
+
+    """
+    Receives the kind of a message and its text, and adds it to the history. The message is kept in memory until the
+    next commit, and can be read before it. If the current segment is full, it's committed and a new one is started.
+    Returns the sequence number of the message.
+    """
+    def append(self, kind, text):
+        encoded_text = text.encode()
+        segment = self.segments[-1]
+        position = segment.size + len(self.pending)
+        if position + RECORD_HEADER.size + len(encoded_text) > self.segment_size and position != 0:
+            self.commit()
+            self.log_file.close()
+            self.index_file.close()
+            self.open_segment(self.next_sequence)
+            position = 0
+        sequence = self.next_sequence
+        self.pending += RECORD_HEADER.pack(sequence, time.time(), kind, len(encoded_text))
+        self.pending += encoded_text
+        self.pending_offsets.append(position)
+        self.next_sequence += 1
+        self.dirty = True
+        return sequence
+
+    # Writes the pending records to the current segment and their positions to its index, without waiting for the
+    # disk.
+    def write(self):
+        if len(self.pending) == 0:
+            return
+        segment = self.segments[-1]
+        self.log_file.write(self.pending)
+        self.log_file.flush()
+        self.index_file.write(self.pending_offsets.tobytes())
+        self.index_file.flush()
+        segment.size += len(self.pending)
+        segment.offsets.extend(self.pending_offsets)
+        self.pending.clear()
+        self.pending_offsets = array("Q")
+
+    # Writes the pending records and waits until they are on the disk (one fsync for all of them).
+    def commit(self):
+        if self.dirty is False:
+            return
+        self.write()
+        os.fsync(self.log_file.fileno())
+        self.dirty = False
+
+    # Receives a number of messages, and returns the last messages in the history (up to this number), as returned by
+    # read().
+    def last(self, count):
+        return self.read(max(self.first_sequence(), self.next_sequence - count), self.next_sequence)
+
+    # Receives a sequence number and a number of messages, and returns the messages that came after the sequence
+    # number, from the oldest (up to the number of messages), as returned by read().
+    def since(self, sequence, count):
+        first = max(self.first_sequence(), sequence + 1)
+        return self.read(first, min(self.next_sequence, first + count))
+
+    # Returns the sequence number of the first message in the history.
+    def first_sequence(self):
+        return self.segments[0].first_sequence
+
+    """
+    Receives the sequence numbers of the first message to read and of the message after the last one. Reads the
+    messages from the maps of the segments, found by their index.
+    Returns a list of tuples of the details of every message: sequence number, time, kind and text.
+    """
+    def read(self, first, end):
+        self.write()
+        messages = []
+        segment_number = bisect.bisect_right(self.first_sequences, first) - 1
+        while first < end and segment_number < len(self.segments):
+            segment = self.segments[segment_number]
+            segment_end = min(end, segment.first_sequence + len(segment.offsets))
+            if first < segment_end:
+                segment_map = segment.get_map()
+                for position in segment.offsets[first - segment.first_sequence:segment_end - segment.first_sequence]:
+                    sequence, record_time, kind, length = RECORD_HEADER.unpack_from(segment_map, position)
+                    text_start = position + RECORD_HEADER.size
+                    text = str(segment_map[text_start:text_start + length], "utf-8")
+                    messages.append((sequence, record_time, kind, text))
+                first = segment_end
+            segment_number += 1
+        return messages
+
+    # Commits the pending messages and closes the files of the history.
+    def close(self):
+        self.commit()
+        self.log_file.close()
+        self.index_file.close()
+        for segment in self.segments:
+            segment.close()
+
+
+# Receives a segment and the position of a record in it, and returns the position after the record, or None if the
+# record hasn't been written completely.
+def record_end(segment, position):
+    if position + RECORD_HEADER.size > segment.size:
+        return None
+    segment_map = segment.get_map()
+    end = position + RECORD_HEADER.size + RECORD_HEADER.unpack_from(segment_map, position)[3]
+    if end > segment.size:
+        return None
+    return end
@@ -1,218 +1,273 @@
-# Client for 12.6 chat project from "Gvahim" book.
-# Auther: Gilad Moyal.
-
-import socket
-import select
-import msvcrt
-import time
-
-MAX_BYTES = 100000  # The maximal size of every "chunk" of bytes sent threw the socket (6 digits)
-MAX_NAME_LENGTH = 99  # The maximal length of the user's name (2 digits).
-MAX_MESSAGE_LENGTH = 9999  # The maximal length of a message the user sends (4 digits).
-MANAGER_SYMBOL = "@"  # The character that will be printed at the beginning of the manager's name
-
-# The commands and the strings the user has to enter to use them:
-CHAT_MESSAGE = "chat"
-PRIVATE_MESSAGE = "private"
-VIEW_MANAGERS = "view-managers"
-QUIT_CHAT = "quit"  # The same string which will be sent to the server
-APPOINT_MANAGER = "appoint-manager"  # The same string which will be sent to the server
-REMOVE_FROM_CHAT = "remove"
-SILENCE_USER = "silence"
-# A dictionary of the commands. the key is the command the user will type and the value is the number of the command
-# sent to the server according to the protocol.
-# If the command number in the dictionary is 0 (zero), the command itself will be sent ("quit" for example).
-COMMAND_DICT = {CHAT_MESSAGE: 1, PRIVATE_MESSAGE: 5, VIEW_MANAGERS: 0, QUIT_CHAT: 0, APPOINT_MANAGER: 2,
-                REMOVE_FROM_CHAT: 3, SILENCE_USER: 4}
-my_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # AF_INET refers to ipv4, SOCK_STREAM refers to TCP
-list_to_send = []  # A list that contains the message when its ready to be sent (of type string).
-
-
-def main():
-    user_name = receive_valid_name()
-    my_socket.connect(('127.0.0.1', 1111))  # Connects to the server (127.0.0.1 is on this machine)
-    print_opening_message()
-    message = ""  # the message is of type bytes-string
-    in_chat = True
-    # Messages will be sent only if the last piece of data has been recieved by the server, and a message was sent back,
-    # If not, messages that are sent together, might arrive together, and the message received will be different.
-    can_send_data = True
-
-    while in_chat:
-        rlist, wlist, xlist = select.select([my_socket], [my_socket], [])
-        # In case the socket is readable
-        if my_socket in rlist:
-            in_chat = handle_incoming_data(message)
-            can_send_data = True
-        # If the user types something
-        if msvcrt.kbhit():
-            message = when_key_pressed(message)
-
-        # In case the socket is writeable
-        if my_socket in wlist and len(list_to_send) != 0 and can_send_data:
-            data_to_send = prepare_message_to_send(user_name, list_to_send[0])
-            if data_to_send is not None:
-                my_socket.send(data_to_send.encode())
-                can_send_data = False
-            if list_to_send[0] == "quit":
-                msvcrt.putwch("\r")
-                print(time.strftime("%H:%M", time.localtime()) + " You left the chat")
-                in_chat = False
-            list_to_send.remove(list_to_send[0])
-
-    my_socket.close()
-
-
-# Receives a name from input until received a valid name (which doesn't start with '@') .Finally, returns the name.
-def receive_valid_name():
-    user_name = input("To join the chat, enter your name: ")
-    while user_name == "":
-        user_name = input("Your name has to contain characters.\n")
-    while user_name[0] == MANAGER_SYMBOL or len(user_name) > MAX_NAME_LENGTH or " " in user_name:
-        if user_name[0] == MANAGER_SYMBOL:
-            user_name = input("The name shouldn't start with '" + MANAGER_SYMBOL + "' because this symbol indicates "
-            "the manager. Please enter a different name.\n")
-        if len(user_name) > MAX_NAME_LENGTH:
-            user_name = input("The name shouldn't exceed " + str(MAX_NAME_LENGTH) + " characters. "
-                        "Please enter a different name.\n")
-        if " " in user_name:
-            user_name = input("The name shouldn't contain spaces.\n")
-    return user_name
-
-
-# Prints the opening message when the user is connected. Prints the commands and how to use them.
-def print_opening_message():
-    print("Welcome to the chat! You can use the following commands: "
-        "\nTo send a chat message type: " + CHAT_MESSAGE + " <YOUR MESSAGE>"
-        "\nTo send a private message to a user type: " + PRIVATE_MESSAGE + " <USER NAME> <YOUR MESSAGE>"
-        "\n(A received private message starts with the symbol '!')."
-        "\nTo view the list of managers type: " + VIEW_MANAGERS +
-        "\nTo leave the chat type: " + QUIT_CHAT +
-        "\nFor managers (the '" + MANAGER_SYMBOL + "' symbol will appear before their name): "
-        "\nTo appoint a manager type: " + APPOINT_MANAGER + " <USER NAME>"
-        "\nTo remove a user from the chat type: " + REMOVE_FROM_CHAT + " <USER NAME>"
-        "\nTo silence a user type: " + SILENCE_USER + " <USER NAME>")
-
-
-# Handles cases in which a key press has been detected.
-# Receives the current message (string), receives from the user the new char and adds it to the message.
-# Returns the updated message (string)
-def when_key_pressed(message):
-    char = msvcrt.getwch()  # The key pressed on the keyboard
-    if char == "\b":
-        msvcrt.putwch(char)
-        message = message[:-1]
-        msvcrt.putwch(" ")
-        msvcrt.putwch("\b")
-        return message
-    # When the user finished typing the message and pressed enter.
-    # The curser is at the beginning of the line with the typed message
-    if char == "\r":
-        list_to_send.append(message)
-        return ""
-    msvcrt.putwch(char)
-    message += char
-    return message
-
-
-# Receives a name and returns a string of the length of the name.
-#If necessary, adds 0s at the beginning of the length of the name, to match the number of digits in MAX_NAME_LENGTH.
-def string_name_length(name):
-    return (len(str(MAX_NAME_LENGTH)) - len(str(len(name)))) * "0" + str(len(name))
-
-
-# Receives a message and returns a string of the length of the message.
-# If necessary, adds 0s at the beginning of the length of the message, to match number of digits in MAX_MESSAGE_LENGTH.
-def string_message_length(message):
-    return (len(str(MAX_MESSAGE_LENGTH)) - len(str(len(message)))) * "0" + str(len(message))
-
-
-# Prints the message when one or more of the details the user entered doen't match the commands.
-def invalid_command_message():
-    print("\nInvalid command. Make sure everything is spelled correctly and there are spaces in the right places.")
-
-
-# Receives the user's name and the text he typed to send, creates the data to sent to the server according to
-# the protocol, and returns it.
-# If the command wasn't written properly, there is an exception or the message is empty, returns None.
-def prepare_message_to_send(user_name, to_send):
-    command = to_send.split(" ")[0]
-    if command not in COMMAND_DICT.keys():
-        invalid_command_message()
-        return None
-    if COMMAND_DICT[command] == 0:
-        return to_send
-
-    command_num = COMMAND_DICT[command]
-    str_name_length = string_name_length(user_name)
-    try:
-        details = to_send.split(" ", 1)
-        if command == CHAT_MESSAGE:
-            message = details[1]
-            str_message_length = string_message_length(message)
-            data_to_send = str_name_length + user_name + str(command_num) + str_message_length + message
-            return data_to_send
-
-        second_name = details[1]
-        str_second_name_length = string_name_length(second_name)
-        if command == APPOINT_MANAGER or command == REMOVE_FROM_CHAT or command == SILENCE_USER:
-            data_to_send = str_name_length + user_name + str(command_num) + str_second_name_length + second_name
-            return data_to_send
-
-        details = to_send.split(" ", 2)
-        second_name = details[1]
-        str_second_name_length = string_name_length(second_name)
-        if command == PRIVATE_MESSAGE:
-            message = details[2]
-            str_message_length = string_message_length(message)
-            data_to_send = str_name_length + user_name + str(command_num) + str_second_name_length + second_name \
-                           + str_message_length + message
-            return data_to_send
-    except IndexError:
-        invalid_command_message()
-        return None
-
-
-# Receives the current message that the user has been typing.
-# Receives from the server data, separates it from its length according to the protocol and prints it to the user.
-# Returns whether or not the user should stay in the chat (boolean).
-def handle_incoming_data(curr_message):
-    data = my_socket.recv(len(str(MAX_BYTES))).decode()
-    if data == "":   # When the socket is being closed, an "empty message" is sent.
-        msvcrt.putwch("\r")
-        print(" " * len(curr_message))
-        return False
-    message_from_data_length = int(data)
-    message_from_data = my_socket.recv(message_from_data_length).decode()
-    if len(curr_message) != 0:
-        data_during_message_typing(curr_message, message_from_data)
-        return True
-    else:
-        msvcrt.putwch("\r")
-        print(message_from_data)
-        return True
-
-
-"""
-Receives the current message (it hasn't been sent yet) and the data received from the server, in string.
-If data has been sent, and the message had been partially typed, the function will print the data in the same row,
-and allow the user to continue typing his message from the next line.
-When the function is called and when it finishes, the curser is at the end of the message which is being typed.
-"""
-def data_during_message_typing(curr_message, str_data):
-    msvcrt.putwch("\r")
-
-    # The length difference between the current message and the data. If the message is longer than the data,
-    # spaces are needed to be printed in order to completely "erase" the message in that line.
-    num_spaces_left = 0
-
-    if len(curr_message) > len(str_data):
-        num_spaces_left = len(curr_message) - len(str_data)
-    print(str_data + num_spaces_left*" ")
-    # prints the current message
-    for char in curr_message:
-        msvcrt.putwch(char)
-
-
-if __name__ == '__main__':
-    main()
\ No newline at end of file
+# Client for 12.6 chat project from "Gvahim" book.
+# Auther: Gilad Moyal.
+
+import asyncio
+import sys
+import threading
+import time
+import ChatClient
+import Presence
+import ProtocolV2
+try:
+    import msvcrt  # The keyboard of Windows, which lets the messages of the server be printed while the user types.
+except ImportError:
+    msvcrt = None
+
+"""
+The console of the chat. The connection, the protocol and the commands are handled by ChatClient - this file only
+reads the commands the user types, sends them with the methods of the connection and prints the messages of the server.
+On Windows the keys are read one by one, so a message of the server is printed above the message being typed. On other
+systems the commands are read line by line from the standard input. The input is read by a thread that waits for it,
+so the loop sleeps until the server or the user sends something.
+The messages that arrive together are printed together, with one write to the terminal, and the message being typed is 
+printed again once after all of them - in a busy room the client doesn't fall behind redrawing every message.
+"""
+
+MAX_NAME_LENGTH = ChatClient.MAX_NAME_LENGTH  # The maximal length of the user's name (2 digits).
+MANAGER_SYMBOL = "@"  # The character that will be printed at the beginning of the manager's name
+# The highest version of the protocol the client offers to the server (1 to use only the original text protocol).
+PROTOCOL_VERSION = ProtocolV2.VERSION
+COMPRESSION = True  # Whether or not the server may compress the long messages it sends (version 2 only).
+
+# The commands and the strings the user has to enter to use them:
+CHAT_MESSAGE = "chat"
+PRIVATE_MESSAGE = "private"
+VIEW_MANAGERS = "view-managers"
+QUIT_CHAT = "quit"
+APPOINT_MANAGER = "appoint-manager"
+REMOVE_FROM_CHAT = "remove"
+SILENCE_USER = "silence"
+VIEW_HISTORY = "history"
+JOIN_ROOM = "join-room"
+LEAVE_ROOM = "leave-room"
+VIEW_ROOMS = "view-rooms"
+VIEW_USERS = "view-users"  # Printed from the roster the client keeps, without asking the server.
+# A dictionary of the commands. The key is the command the user will type and the value is the method of the
+# connection that sends it and the number of details typed after the command (the last detail may contain spaces).
+COMMAND_DICT = {CHAT_MESSAGE: (ChatClient.ChatConnection.send_chat, 1),
+                PRIVATE_MESSAGE: (ChatClient.ChatConnection.send_private, 2),
+                VIEW_MANAGERS: (ChatClient.ChatConnection.view_managers, 0),
+                QUIT_CHAT: (ChatClient.ChatConnection.quit, 0),
+                APPOINT_MANAGER: (ChatClient.ChatConnection.appoint, 1),
+                REMOVE_FROM_CHAT: (ChatClient.ChatConnection.remove, 1),
+                SILENCE_USER: (ChatClient.ChatConnection.silence, 1),
+                VIEW_HISTORY: (ChatClient.ChatConnection.view_history, 1),
+                JOIN_ROOM: (ChatClient.ChatConnection.join_room, 1),
+                LEAVE_ROOM: (ChatClient.ChatConnection.leave_room, 0),
+                VIEW_ROOMS: (ChatClient.ChatConnection.view_rooms, 0)}
+curr_message = ""  # The message the user is typing, before he presses enter (Windows).
+
+
+def main():
+    user_name = receive_valid_name()
+    asyncio.run(run_chat(user_name))
+
+
+# Receives the user's name. Connects to the server, then prints the messages of the server and sends the commands of
+# the user until he leaves the chat or the server closes the connection.
+async def run_chat(user_name):
+    try:
+        connection = await ChatClient.connect(user_name, protocol_version=PROTOCOL_VERSION, compression=COMPRESSION)
+    except OSError:
+        print("Can't connect to the server.")
+        return
+    print_opening_message()
+    if connection.protocol_version == ProtocolV2.VERSION:  # The roster is kept up to date for view-users.
+        await connection.subscribe_presence()
+    receiving = asyncio.create_task(print_incoming_messages(connection))
+    typing = asyncio.create_task(send_typed_messages(connection))
+    done, pending = await asyncio.wait([receiving, typing], return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    await connection.close()
+
+
+# Receives a name from input until received a valid name (which doesn't start with '@') .Finally, returns the name.
+def receive_valid_name():
+    user_name = input("To join the chat, enter your name: ")
+    while user_name == "":
+        user_name = input("Your name has to contain characters.\n")
+    while user_name[0] == MANAGER_SYMBOL or len(user_name) > MAX_NAME_LENGTH or " " in user_name:
+        if user_name[0] == MANAGER_SYMBOL:
+            user_name = input("The name shouldn't start with '" + MANAGER_SYMBOL + "' because this symbol indicates "
+            "the manager. Please enter a different name.\n")
+        if len(user_name) > MAX_NAME_LENGTH:
+            user_name = input("The name shouldn't exceed " + str(MAX_NAME_LENGTH) + " characters. "
+                        "Please enter a different name.\n")
+        if " " in user_name:
+            user_name = input("The name shouldn't contain spaces.\n")
+    return user_name
+
+
+# Prints the opening message when the user is connected. Prints the commands and how to use them.
+def print_opening_message():
+    print("Welcome to the chat! You can use the following commands: "
+        "\nTo send a chat message type: " + CHAT_MESSAGE + " <YOUR MESSAGE>"
+        "\nTo send a private message to a user type: " + PRIVATE_MESSAGE + " <USER NAME> <YOUR MESSAGE>"
+        "\n(A received private message starts with the symbol '!')."
+        "\nTo view the list of managers type: " + VIEW_MANAGERS +
+        "\nTo view the last messages of the chat type: " + VIEW_HISTORY + " <NUMBER OF MESSAGES>" +
+        "\nTo join a room (or open a new one) type: " + JOIN_ROOM + " <ROOM NAME>" +
+        "\nTo go back to the main room type: " + LEAVE_ROOM +
+        "\nTo view the list of rooms type: " + VIEW_ROOMS +
+        "\nTo view the users of the chat type: " + VIEW_USERS +
+        "\nTo leave the chat type: " + QUIT_CHAT +
+        "\nFor managers (the '" + MANAGER_SYMBOL + "' symbol will appear before their name): "
+        "\nTo appoint a manager type: " + APPOINT_MANAGER + " <USER NAME>"
+        "\nTo remove a user from the chat type: " + REMOVE_FROM_CHAT + " <USER NAME>"
+        "\nTo silence a user type: " + SILENCE_USER + " <USER NAME>")
+
+
+# Receives the connection, and prints the messages of the server until it closes the connection. All the messages that
+# have been received are printed together.
+async def print_incoming_messages(connection):
+    messages = await connection.receive_available()
+    while len(messages) != 0:
+        print_messages([message.text for message in messages])
+        messages = await connection.receive_available()
+    if msvcrt is not None:  # Erases the message that was being typed.
+        msvcrt.putwch("\r")
+        print(" " * len(curr_message))
+
+
+# Receives the connection, and sends the messages the user types until he leaves the chat (or the standard input ends).
+async def send_typed_messages(connection):
+    inputs = start_input_thread()
+    in_chat = True
+    while in_chat:
+        if msvcrt is None:
+            to_send = await inputs.get()
+        else:
+            to_send = await type_message(inputs)
+        if to_send is None:
+            to_send = QUIT_CHAT
+        in_chat = await send_typed_message(connection, to_send)
+
+
+"""
+Receives the connection and the text the user typed, and sends the command in it with the method of the connection.
+If the command wasn't written properly (or a detail is too long), prints the invalid command message.
+Returns whether or not the user should stay in the chat (boolean).
+"""
+async def send_typed_message(connection, to_send):
+    command = to_send.split(" ")[0]
+    if to_send == VIEW_USERS:
+        print_users(connection)
+        return True
+    if command not in COMMAND_DICT:
+        invalid_command_message()
+        return True
+    method, details_number = COMMAND_DICT[command]
+    details = to_send.split(" ", details_number)[1:]
+    if len(details) != details_number:
+        invalid_command_message()
+        return True
+    try:
+        await method(connection, *details)
+    except ValueError:
+        invalid_command_message()
+        return True
+    if command == QUIT_CHAT:
+        print_messages([time.strftime("%H:%M", time.localtime()) + " You left the chat"])
+        return False
+    return True
+
+
+# Receives the connection, and prints the users of the chat from its roster: their names (with the manager symbol),
+# their rooms and whether or not they're silenced.
+def print_users(connection):
+    to_print = time.strftime("%H:%M", time.localtime()) + " "
+    if connection.roster_version is None:
+        print_messages([to_print + "The list of users isn't available."])
+        return
+    to_print += "The users of the chat are:"
+    for entry in connection.roster.values():
+        to_print += "\n" + (MANAGER_SYMBOL if entry.flags & Presence.MANAGER else "") + entry.name + " (" + entry.room
+        if entry.flags & Presence.SILENCED:
+            to_print += ", silenced"
+        to_print += ")"
+    print_messages([to_print])
+
+
+# Receives the queue of the keys (Windows). Waits until the user finishes typing a message and presses enter, and
+# returns the message. The messages of the server are printed meanwhile.
+async def type_message(keys):
+    global curr_message
+    while True:
+        char = await keys.get()  # The key pressed on the keyboard
+        # When the user finished typing the message and pressed enter.
+        if char == "\r":
+            message = curr_message
+            curr_message = ""
+            return message
+        curr_message = when_key_pressed(curr_message, char)
+
+
+# Handles cases in which a key press has been detected.
+# Receives the current message (string) and the new char, and adds it to the message (or erases the last char).
+# Returns the updated message (string)
+def when_key_pressed(message, char):
+    if char == "\b":
+        msvcrt.putwch(char)
+        message = message[:-1]
+        msvcrt.putwch(" ")
+        msvcrt.putwch("\b")
+        return message
+    msvcrt.putwch(char)
+    message += char
+    return message
+
+
+# Starts a thread that reads the input of the user: the keys of the keyboard of Windows, or the lines of the standard
+# input on other systems. Returns the asyncio queue the thread puts them in - None is put in it when the input ends.
+def start_input_thread():
+    inputs = asyncio.Queue()
+    read_input = read_input_lines if msvcrt is None else read_keys
+    thread = threading.Thread(target=read_input, args=(asyncio.get_running_loop(), inputs), daemon=True)
+    thread.start()
+    return inputs
+
+
+# The thread of the keyboard of Windows: receives the event loop and the queue, and puts every key pressed in the
+# queue (getwch waits until a key is pressed).
+def read_keys(loop, keys):
+    try:
+        while True:
+            loop.call_soon_threadsafe(keys.put_nowait, msvcrt.getwch())
+    except RuntimeError:  # The event loop has been closed - the user left the chat.
+        pass
+
+
+# The thread of the standard input: receives the event loop and the queue, and puts every line in the queue.
+def read_input_lines(loop, lines):
+    try:
+        for line in sys.stdin:
+            loop.call_soon_threadsafe(lines.put_nowait, line.rstrip("\n"))
+        loop.call_soon_threadsafe(lines.put_nowait, None)
+    except RuntimeError:  # The event loop has been closed - the user left the chat.
+        pass
+
+
+# Prints the message when one or more of the details the user entered doen't match the commands.
+def invalid_command_message():
+    print("\nInvalid command. Make sure everything is spelled correctly and there are spaces in the right places.")
+
+
+"""
+Receives the messages of the server that were received together (strings), and prints them with one write to the 
+terminal. On Windows they're printed above the message the user is typing (if he is): the line of the message is 
+overwritten by the first of them (padded with spaces to erase all of it), and the message is printed again once, 
+after the last of them. The cursor stays at the end of the message being typed.
+"""
+def print_messages(texts):
+    output = "\n".join(texts) + "\n"
+    if msvcrt is not None:
+        first_line = output.split("\n", 1)[0]
+        padding = " " * max(0, len(curr_message) - len(first_line))
+        output = "\r" + first_line + padding + output[len(first_line):] + curr_message
+    sys.stdout.write(output)
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+# The state bus of the chat server's multi-process mode.
+# Auther: Gilad Moyal.
+
+import socket
+import selectors
+import collections
+import json
+import os
+import signal
+
+"""
+Every worker process of the server is connected to the hub (the main process) with a Unix domain socket. The workers
+send events (chat messages, private messages, changes of users) to the hub, and the hub passes every event to all the
+other workers, in the same order. An event is a JSON object in one line, ending with a newline.
+"""
+
+"""
+Represents the connection of a worker to the hub, or of the hub to a worker.
+Described by:
+socket - the Unix domain socket (non-blocking).
+outgoing (deque of bytes) - the lines waiting to be sent.
+sent_offset (int) - how many bytes of the first line in the queue have already been sent.
+buffer (bytes) - the received data that doesn't contain a whole line yet.
+"""
+
+
+class BusConnection:
+    def __init__(self, bus_socket):
+        bus_socket.setblocking(False)
+        self.socket = bus_socket
+        self.outgoing = collections.deque()
+        self.sent_offset = 0
+        self.buffer = b""
+
+    # Receives an event (dictionary) and adds it to the queue of lines to send.
+    def send_event(self, event):
+        self.send_line(json.dumps(event, separators=(",", ":")).encode() + b"\n")
+
+    # Receives a line (bytes, ending with a newline) and adds it to the queue of lines to send.
+    def send_line(self, line):
+        self.outgoing.append(line)
+
+    # Sends as much of the queue as the socket accepts. Returns whether or not the whole queue has been sent.
+    def flush(self):
+        while len(self.outgoing) != 0:
+            try:
+                sent = self.socket.send(memoryview(self.outgoing[0])[self.sent_offset:])
+            except BlockingIOError:
+                return False
+            except OSError:  # The other side has exited, so the lines can't be sent.
+                self.outgoing.clear()
+                self.sent_offset = 0
+                return True
+            self.sent_offset += sent
+            if self.sent_offset < len(self.outgoing[0]):
+                return False
+            self.outgoing.popleft()
+            self.sent_offset = 0
+        return True
+
+    # Receives the data waiting in the socket and returns a list of the whole lines in it.
+    # Returns None if the other side has closed the connection.
+    def receive_lines(self):
+        try:
+            data = self.socket.recv(1 << 16)
+        except BlockingIOError:
+            return []
+        except ConnectionError:
+            data = b""
+        if data == b"":
+            return None
+        self.buffer += data
+        lines = self.buffer.split(b"\n")
+        self.buffer = lines.pop()
+        return [line + b"\n" for line in lines]
+
+    # Returns a list of the events (dictionaries) completed by the data waiting in the socket, or None if the other
+    # side has closed the connection.
+    def receive_events(self):
+        lines = self.receive_lines()
+        if lines is None:
+            return None
+        return [json.loads(line) for line in lines]
+
+
+"""
+Starts the worker processes. Receives the number of workers and a function that runs a worker - it receives the
+number of the worker and its BusConnection, and never returns.
+The calling process becomes the hub: it passes the events between the workers until all of them exit.
+"""
+def run_workers(workers_number, run_worker):
+    hub_connections = {}  # The key is the number of the worker and the value is its BusConnection.
+    worker_pids = []
+    for worker_number in range(workers_number):
+        hub_socket, worker_socket = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        pid = os.fork()
+        if pid == 0:  # The worker process.
+            hub_socket.close()
+            for connection in hub_connections.values():
+                connection.socket.close()
+            run_worker(worker_number, BusConnection(worker_socket))
+            os._exit(0)
+        worker_socket.close()
+        hub_connections[worker_number] = BusConnection(hub_socket)
+        worker_pids.append(pid)
+
+    # Stopping the server stops the workers, and the hub keeps passing their events until they have shut down.
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: stop_workers(worker_pids))
+    signal.signal(signal.SIGINT, lambda signal_number, frame: stop_workers(worker_pids))
+    try:
+        run_hub(hub_connections)
+    finally:
+        stop_workers(worker_pids)
+
+
+# Receives the process IDs of the workers, and sends SIGTERM to the ones that are still running.
+def stop_workers(worker_pids):
+    for pid in worker_pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+"""
+Receives a dictionary of the connections to the workers (the key is the number of the worker). Passes every line
+received from a worker to all the other workers. When a worker exits, tells the other workers about it, so they
+forget its users.
+"""
+def run_hub(hub_connections):
+    hub_selector = selectors.DefaultSelector()
+    for worker_number, connection in hub_connections.items():
+        hub_selector.register(connection.socket, selectors.EVENT_READ, worker_number)
+
+    while len(hub_connections) != 0:
+        for key, mask in hub_selector.select():
+            worker_number = key.data
+            connection = hub_connections.get(worker_number)
+            if connection is None:
+                continue
+            if mask & selectors.EVENT_WRITE and connection.flush():
+                hub_selector.modify(connection.socket, selectors.EVENT_READ, worker_number)
+            if not mask & selectors.EVENT_READ:
+                continue
+            lines = connection.receive_lines()
+            if lines is None:  # The worker has exited.
+                hub_selector.unregister(connection.socket)
+                connection.socket.close()
+                del hub_connections[worker_number]
+                down_line = json.dumps({"type": "worker-down", "worker": worker_number}).encode() + b"\n"
+                lines = [down_line]
+            for other_number, other_connection in hub_connections.items():
+                if other_number == worker_number:
+                    continue
+                had_outgoing = len(other_connection.outgoing) != 0
+                for line in lines:
+                    other_connection.send_line(line)
+                if not had_outgoing and not other_connection.flush():
+                    hub_selector.modify(other_connection.socket, selectors.EVENT_READ | selectors.EVENT_WRITE,
+                                        other_number)
@@ -0,0 +1,81 @@
+# The handoff of the chat server to a new process (hot restart): its sockets and its state, over a Unix domain socket.
+# Auther: Gilad Moyal.
+
+import json
+import socket
+import struct
+
+"""
+A running server listens on a Unix domain socket, its handoff socket. A new server started with --takeover connects
+to it, and the running server sends it:
+1. A header - the number of sockets and the length of the snapshot.
+2. The file descriptors of its sockets (the listening socket and the sockets of the clients), with SCM_RIGHTS - the
+kernel copies them into the new process, so the connections stay open when the old process exits. Every message
+carries up to MAX_FDS_PER_MESSAGE descriptors with one byte of data, so the descriptors are never split between reads.
+3. The snapshot of its state (a JSON object).
+The new server answers with ACK after it has restored the state. Only then the old server exits - if the new server
+fails before that, the old one goes on serving.
+"""
+
+HEADER = struct.Struct("!II")  # The number of sockets and the length of the snapshot.
+MAX_FDS_PER_MESSAGE = 250  # Linux accepts up to 253 descriptors in one message.
+FDS_BYTE = b"F"  # The data sent with every message of descriptors.
+ACK = b"A"
+TIMEOUT = 10  # Seconds every step of the handoff may take.
+
+
+# Receives the connection to the new server, a list of sockets and the snapshot (dictionary), and sends them.
+def send_handoff(connection, sockets, snapshot):
+    data = json.dumps(snapshot, separators=(",", ":")).encode()
+    connection.sendall(HEADER.pack(len(sockets), len(data)))
+    fds = [current_socket.fileno() for current_socket in sockets]
+    for start in range(0, len(fds), MAX_FDS_PER_MESSAGE):
+        socket.send_fds(connection, [FDS_BYTE], fds[start:start + MAX_FDS_PER_MESSAGE])
+    connection.sendall(data)
+
+
+"""
+Receives the connection to the old server, and receives its sockets and snapshot.
+Returns a list of the sockets (in the order they were sent) and the snapshot. Raises OSError if the old server closed
+the connection or the descriptors didn't arrive (the sockets received until then are closed).
+"""
+def receive_handoff(connection):
+    sockets_number, snapshot_length = HEADER.unpack(receive_exactly(connection, HEADER.size))
+    sockets = []
+    try:
+        while len(sockets) < sockets_number:
+            data, fds, flags, address = socket.recv_fds(connection, len(FDS_BYTE), MAX_FDS_PER_MESSAGE)
+            sockets.extend(socket.socket(fileno=fd) for fd in fds)
+            if data != FDS_BYTE or len(fds) == 0 or flags & socket.MSG_CTRUNC:
+                raise OSError("the sockets of the old server didn't arrive")
+        snapshot = json.loads(receive_exactly(connection, snapshot_length))
+    except (OSError, ValueError):
+        for current_socket in sockets:
+            current_socket.close()
+        raise OSError("the handoff of the old server failed")
+    return sockets, snapshot
+
+
+# Receives the connection to the old server and tells it that the new server took over.
+def acknowledge(connection):
+    connection.sendall(ACK)
+
+
+# Receives the connection to the new server, and returns whether or not it took over (answered with ACK).
+def wait_for_ack(connection):
+    try:
+        return connection.recv(len(ACK)) == ACK
+    except OSError:
+        return False
+
+
+# Receives a connection and a number of bytes, and returns exactly that many bytes received from it. Raises OSError
+# if the connection is closed before.
+def receive_exactly(connection, length):
+    data = b""
+    while len(data) < length:
+        chunk = connection.recv(length - len(data))
+        if chunk == b"":
+            raise OSError("the connection was closed during the handoff")
+        data += chunk
+    return data
@@ -0,0 +1,374 @@
+# Load generator for the chat server: simulates many users on this machine and measures the server.
+# Auther: Gilad Moyal.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import ChatClient
+import ProtocolV2
+
+"""
+Every simulated user connects to the server, logs in (and joins a room, if the users are divided into rooms) and
+sends messages with ChatClient (like Client2.py), at a random rate around the chosen one. The messages are chat
+messages, private messages to random users and view-managers requests, mixed by the chosen weights.
+Every chat and private message contains a number, so its receivers find the time it was sent and measure the fan-out
+latency (from sending the message until a receiver gets it). The results are printed and can be saved as JSON, to
+compare engines and versions of the server.
+Run it with: python LoadGenerator.py [options]
+"""
+
+SERVER_ADDRESS = ChatClient.SERVER_ADDRESS
+DEFAULT_USERS = 1000
+DEFAULT_DURATION = 10  # Seconds of sending messages, after all the users connected.
+DEFAULT_RATE = 1000  # Messages per second, sent by all the users together.
+DEFAULT_MIX = "chat=80,private=15,view-managers=5"
+DEFAULT_CONNECT_CONCURRENCY = 100  # The number of users that connect at the same time.
+DRAIN_TIME = 2  # Seconds of waiting for the last messages, after the users stop sending.
+LOAD_PREFIX = "load-"  # The beginning of the number of a message, in its text.
+# The text that fills the messages up to the chosen size (like a pasted log), before their number.
+FILLER_LINE = "12:00:01 INFO worker handled the request of the room in 12 ms, 3 messages waiting.\n"
+MESSAGE_KINDS = ["chat", "private", "view-managers"]
+PERCENTILES = {"p50": 0.5, "p99": 0.99, "p999": 0.999}
+
+sent_times = {}  # A dictionary in which the key is the number of a message and the value is the time it was sent.
+latencies = []  # The fan-out latency of every received chat and private message, in seconds.
+counters = {"sent": 0, "received": 0, "errors": 0}
+sent_by_kind = dict.fromkeys(MESSAGE_KINDS, 0)
+message_numbers = iter(range(1, sys.maxsize))
+
+"""
+Represents a simulated user.
+Described by:
+name (string)
+protocol_version (int) - the highest version of the protocol the user offers.
+compression (boolean) - whether or not the user accepts compressed messages (version 2 only).
+connection (ChatClient.ChatConnection) - the connection of the user, or None if it isn't connected.
+"""
+
+
+class SimulatedUser:
+    def __init__(self, name, protocol_version, compression):
+        self.name = name
+        self.protocol_version = protocol_version
+        self.compression = compression
+        self.connection = None
+
+
+def main():
+    arguments = parse_arguments()
+    raise_open_files_limit()
+    server = None
+    server_pid = arguments.server_pid
+    if arguments.start_server is True:
+        server = start_server(arguments.server_arg)
+        server_pid = server.pid
+    try:
+        results = asyncio.run(run_load(arguments, server_pid))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    print_results(results)
+    if arguments.output is not None:
+        with open(arguments.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+# Parses the arguments of the command line and returns them.
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Load generator for the chat server.")
+    parser.add_argument("--users", type=int, default=DEFAULT_USERS, help="the number of simulated users")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION,
+                        help="seconds of sending messages (default: %(default)s)")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE,
+                        help="messages per second, sent by all the users together (default: %(default)s)")
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help="the weights of the kinds of messages (default: %(default)s)")
+    parser.add_argument("--rooms", type=int, default=1,
+                        help="the number of rooms the users are divided into (default: 1, everyone in the main room)")
+    parser.add_argument("--protocol", type=int, choices=[1, ProtocolV2.VERSION], default=ProtocolV2.VERSION,
+                        help="the version of the protocol the users speak (default: %(default)s)")
+    parser.add_argument("--message-size", type=int, default=0,
+                        help="the length of the chat and private messages, filled with text like a pasted log "
+                             "(default: only the number of the message)")
+    parser.add_argument("--no-compression", dest="compression", action="store_false",
+                        help="don't let the server compress the long messages to the users")
+    parser.add_argument("--connect-concurrency", type=int, default=DEFAULT_CONNECT_CONCURRENCY,
+                        help="the number of users that connect at the same time (default: %(default)s)")
+    parser.add_argument("--start-server", action="store_true", help="start Server2.py and stop it at the end")
+    parser.add_argument("--server-arg", action="append", default=[],
+                        help="an argument for the started server, like --server-arg=--engine=asyncio (repeatable)")
+    parser.add_argument("--server-pid", type=int,
+                        help="the process of a running server, to measure its memory and CPU")
+    parser.add_argument("--seed", type=int, help="the seed of the random choices, to repeat a run")
+    parser.add_argument("--output", help="a file to save the results in, as JSON")
+    arguments = parser.parse_args()
+    try:
+        arguments.mix = parse_mix(arguments.mix)
+    except ValueError:
+        parser.error("the mix should look like: " + DEFAULT_MIX)
+    if arguments.users < 2:
+        parser.error("at least 2 users are needed (for private messages)")
+    if arguments.rooms < 1 or arguments.rooms > arguments.users:
+        parser.error("the number of rooms should be between 1 and the number of users")
+    if arguments.message_size > ChatClient.MAX_MESSAGE_LENGTH:
+        parser.error("the messages can't be longer than " + str(ChatClient.MAX_MESSAGE_LENGTH))
+    random.seed(arguments.seed)
+    return arguments
+
+
+# Receives the mix of the messages, like "chat=80,private=20", and returns a dictionary of the weight of every kind of
+# message. Raises ValueError if the mix isn't valid.
+def parse_mix(mix):
+    weights = dict.fromkeys(MESSAGE_KINDS, 0.0)
+    for part in mix.split(","):
+        kind, weight = part.split("=")
+        if kind not in weights:
+            raise ValueError("unknown kind of message")
+        weights[kind] = float(weight)
+    if sum(weights.values()) <= 0:
+        raise ValueError("no messages")
+    return weights
+
+
+# Raises the limit of open files of this process as much as allowed, since every simulated user has a socket.
+def raise_open_files_limit():
+    try:
+        import resource
+    except ImportError:  # Not available on Windows.
+        return
+    soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft_limit != hard_limit:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard_limit, hard_limit))
+
+
+# Receives a list of arguments for the server, starts Server2.py with them and waits until it accepts connections.
+# Returns the process.
+def start_server(server_arguments):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    server = subprocess.Popen([sys.executable, "Server2.py", *server_arguments], cwd=directory,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for i in range(100):
+        if server.poll() is not None:
+            raise SystemExit("The server has exited (is the port already taken?).")
+        try:
+            test_socket = socket.create_connection(SERVER_ADDRESS)
+            test_socket.close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise SystemExit("The server doesn't accept connections.")
+
+
+"""
+Receives the parsed arguments and the process of the server (or None). Connects all the users, lets them send
+messages for the chosen duration, waits for the last messages and returns the results (a dictionary).
+"""
+async def run_load(arguments, server_pid):
+    users = [SimulatedUser("user" + str(i), arguments.protocol, arguments.compression) for i in range(arguments.users)]
+    start_usage = server_usage(server_pid)
+    start = time.perf_counter()
+    semaphore = asyncio.Semaphore(arguments.connect_concurrency)
+    await asyncio.gather(*[connect_user(user, i % arguments.rooms, semaphore) for i, user in enumerate(users)])
+    connect_time = time.perf_counter() - start
+    connected_users = [user for user in users if user.connection is not None]
+    readers = [asyncio.create_task(read_messages(user)) for user in connected_users]
+
+    await asyncio.sleep(0.5)  # The messages about the users who joined are received before the measured part.
+    counters["received"] = 0
+    start_usage = server_usage(server_pid) or start_usage
+    start = time.perf_counter()
+    await asyncio.gather(*[send_messages(user, connected_users, arguments) for user in connected_users])
+    send_time = time.perf_counter() - start
+    await asyncio.sleep(DRAIN_TIME)
+    receive_time = time.perf_counter() - start
+    end_usage = server_usage(server_pid)
+
+    for user in connected_users:
+        await user.connection.close()
+    for reader in readers:
+        reader.cancel()
+    await asyncio.gather(*readers, return_exceptions=True)
+    return build_results(arguments, len(connected_users), connect_time, send_time, receive_time, start_usage,
+                         end_usage)
+
+
+"""
+Receives a simulated user, the number of the room it should join (0 is the main room) and a semaphore that limits
+the connections made at the same time. Connects the user to the server (which logs it in) and joins its room. If the
+connection fails, the error is counted and the user stays without a connection.
+"""
+async def connect_user(user, room_number, semaphore):
+    async with semaphore:
+        try:
+            connection = await ChatClient.connect(user.name, SERVER_ADDRESS, user.protocol_version, user.compression)
+            if room_number != 0:
+                await connection.join_room("room" + str(room_number))
+        except OSError:
+            counters["errors"] += 1
+            return
+        user.connection = connection
+
+
+"""
+Receives a simulated user, the list of all the users and the parsed arguments. Sends messages until the duration
+ends, at random (exponential) times that don't depend on how fast the server answers, so all the users together send
+at the chosen rate.
+"""
+async def send_messages(user, users, arguments):
+    kinds = list(arguments.mix.keys())
+    weights = list(arguments.mix.values())
+    filler = (FILLER_LINE * (arguments.message_size // len(FILLER_LINE) + 1))[:arguments.message_size]
+    user_rate = arguments.rate / len(users)
+    end = time.perf_counter() + arguments.duration
+    send_time = time.perf_counter() + random.random() / user_rate  # So the users don't start together.
+    while send_time < end:
+        await asyncio.sleep(send_time - time.perf_counter())
+        send_time += random.expovariate(user_rate)
+        kind = random.choices(kinds, weights)[0]
+        number = next(message_numbers)
+        text = LOAD_PREFIX + str(number)
+        text = filler[:arguments.message_size - len(text)] + text
+        try:
+            if kind == "chat":
+                await user.connection.send_chat(text)
+            elif kind == "private":
+                target = user
+                while target is user:
+                    target = random.choice(users)
+                await user.connection.send_private(target.name, text)
+            else:
+                await user.connection.view_managers()
+        except (ConnectionError, OSError):
+            counters["errors"] += 1
+            return
+        if kind != "view-managers":
+            sent_times[number] = time.perf_counter()
+        counters["sent"] += 1
+        sent_by_kind[kind] += 1
+
+
+"""
+Receives a simulated user, and reads the messages the server sends to it until the connection is closed. Every
+message that contains the number of a message from another user is counted in the fan-out latency (the copy the
+sender gets, starting with "You", isn't).
+"""
+async def read_messages(user):
+    async for message in user.connection:
+        counters["received"] += 1
+        text = message.text
+        number = text.rpartition(LOAD_PREFIX)[2]
+        if number.isdigit() and text[6:9] != "You":
+            sent_time = sent_times.get(int(number))
+            if sent_time is not None:
+                latencies.append(time.perf_counter() - sent_time)
+
+
+"""
+Receives the process of the server. Returns a dictionary of its memory (RSS, in bytes) and the CPU time it used (in
+seconds), together with the processes it started (the workers of the multi-process mode), or None if the process
+isn't known or can't be measured (the measurement reads /proc, so it works on Linux only).
+"""
+def server_usage(server_pid):
+    if server_pid is None or not os.path.isdir("/proc/" + str(server_pid)):
+        return None
+    pids = [server_pid] + child_processes(server_pid)
+    usage = {"rss_bytes": 0, "cpu_seconds": 0.0}
+    clock_ticks = os.sysconf("SC_CLK_TCK")
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    for pid in pids:
+        try:
+            with open("/proc/" + str(pid) + "/stat") as stat_file:
+                fields = stat_file.read().rpartition(")")[2].split()
+            with open("/proc/" + str(pid) + "/statm") as statm_file:
+                resident_pages = int(statm_file.read().split()[1])
+        except OSError:  # The process has exited.
+            continue
+        # utime and stime are the 14th and 15th fields of the stat file (the fields after the name start at the 3rd).
+        usage["cpu_seconds"] += (int(fields[11]) + int(fields[12])) / clock_ticks
+        usage["rss_bytes"] += resident_pages * page_size
+    return usage
+
+
+# Receives a process and returns a list of the processes it started.
+def child_processes(parent_pid):
+    children = []
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open("/proc/" + name + "/stat") as stat_file:
+                parent = int(stat_file.read().rpartition(")")[2].split()[1])
+        except (OSError, ValueError):
+            continue
+        if parent == parent_pid:
+            children.append(int(name))
+    return children
+
+
+# Receives a list of numbers and returns a dictionary of their percentiles (see PERCENTILES), in milliseconds.
+def percentiles_ms(values):
+    if len(values) == 0:
+        return dict.fromkeys(PERCENTILES)
+    values = sorted(values)
+    result = {}
+    for name, fraction in PERCENTILES.items():
+        result[name] = round(values[min(len(values) - 1, int(fraction * len(values)))] * 1000, 3)
+    result["max"] = round(values[-1] * 1000, 3)
+    return result
+
+
+# Receives the arguments and the measurements of the run, and returns the results as a dictionary.
+def build_results(arguments, connected, connect_time, send_time, receive_time, start_usage, end_usage):
+    results = {
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "config": {"users": arguments.users, "duration": arguments.duration, "rate": arguments.rate,
+                   "mix": arguments.mix, "rooms": arguments.rooms, "protocol": arguments.protocol,
+                   "message_size": arguments.message_size, "compression": arguments.compression,
+                   "server_args": arguments.server_arg},
+        "connect": {"connected": connected, "seconds": round(connect_time, 3),
+                    "per_second": round(connected / connect_time, 1)},
+        "messages": {"sent": counters["sent"], "sent_per_second": round(counters["sent"] / send_time, 1),
+                     "sent_by_kind": sent_by_kind, "received": counters["received"],
+                     "received_per_second": round(counters["received"] / receive_time, 1)},
+        "latency_ms": percentiles_ms(latencies),
+        "latency_samples": len(latencies),
+        "errors": counters["errors"],
+        "server": None,
+    }
+    if start_usage is not None and end_usage is not None:
+        cpu_seconds = end_usage["cpu_seconds"] - start_usage["cpu_seconds"]
+        results["server"] = {"rss_bytes": end_usage["rss_bytes"], "cpu_seconds": round(cpu_seconds, 3),
+                             "cpu_percent": round(cpu_seconds / receive_time * 100, 1)}
+    return results
+
+
+# Receives the results of a run and prints them.
+def print_results(results):
+    connect = results["connect"]
+    messages = results["messages"]
+    latency = results["latency_ms"]
+    print("Connected " + str(connect["connected"]) + " users in " + str(connect["seconds"]) + " seconds (" +
+          str(connect["per_second"]) + " per second)")
+    print("Sent " + str(messages["sent"]) + " messages (" + str(messages["sent_per_second"]) + " per second), " +
+          "received " + str(messages["received"]) + " (" + str(messages["received_per_second"]) + " per second)")
+    print("Fan-out latency (ms): p50 " + str(latency["p50"]) + ", p99 " + str(latency["p99"]) + ", p999 " +
+          str(latency["p999"]) + ", max " + str(latency["max"]) + " (" + str(results["latency_samples"]) +
+          " samples)")
+    if results["server"] is not None:
+        server = results["server"]
+        print("Server: RSS " + str(round(server["rss_bytes"] / (1024 * 1024), 1)) + " MiB, CPU " +
+              str(server["cpu_seconds"]) + " seconds (" + str(server["cpu_percent"]) + "%)")
+    if results["errors"] != 0:
+        print(str(results["errors"]) + " errors")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+# Filters of the chat messages (blocked words and patterns, spam and links), run by the server on a pool of workers.
+# Auther: Gilad Moyal.
+
+import json
+import re
+import signal
+import time
+
+"""
+The filters are read from a JSON file - a list of filters, each of them a dictionary with its kind and its settings:
+
+    [{"kind": "keywords", "words": ["spoiler", "password"]},
+     {"kind": "regex", "patterns": ["\\\\b\\\\d{4}-\\\\d{4}-\\\\d{4}-\\\\d{4}\\\\b"], "timeout": 5},
+     {"kind": "spam", "max_score": 0.7},
+     {"kind": "links", "allowed_domains": ["example.com"], "max_links": 3}]
+
+Every filter may have a "name" (by default its kind), shown in the log and the metrics, and a "timeout" - the budget of
+milliseconds it may take for one message (by default DEFAULT_TIMEOUT). A message goes through the filters in their
+order, and is rejected by the first filter that finds it bad.
+The budget is checked after the filter returns - a filter isn't stopped in the middle. The server stops waiting for a
+message when the budgets of all the filters have passed (and gives it the fallback verdict), but the worker stays busy
+until the filter returns, and the message keeps its place in the pool until then.
+The filters run in a pool of workers, so a slow pattern doesn't stop the loop of the server. A worker gets only the
+text of the message and keeps no state between messages, so the same filters run in a process of the pool (where
+start_worker() builds them once) or in a thread of the server.
+"""
+
+DEFAULT_TIMEOUT = 10  # The default budget of a filter for one message (milliseconds).
+DEFAULT_MAX_SPAM_SCORE = 0.8
+MAX_REPEATED_CHARACTERS = 10  # A longer run of the same character adds to the spam score.
+PASS = "pass"
+REJECT = "reject"
+TIMEOUT = "timeout"
+WORD_PATTERN = re.compile(r"\w+")
+LINK_PATTERN = re.compile(r"(?:https?://|www\.)([^/\s:?#]+)", re.IGNORECASE)
+REPEATED_CHARACTER_PATTERN = re.compile(r"(.)\1{" + str(MAX_REPEATED_CHARACTERS) + ",}")
+pipeline = []  # The filters of this process (a list of MessageFilter), built by configure().
+
+"""
+Represents a filter of the messages.
+Described by:
+kind (string) - one of the keys of CHECKS.
+name (string) - the name of the filter in the log and the metrics.
+timeout (float) - the seconds the filter may take for one message.
+settings - the settings of the kind, prepared for checking (a set of words, a list of compiled patterns, a maximal
+        score, or the allowed and blocked domains and the maximal number of links).
+"""
+
+
+class MessageFilter:
+    def __init__(self, kind, name, timeout, settings):
+        self.kind = kind
+        self.name = name
+        self.timeout = timeout
+        self.settings = settings
+
+
+"""
+Receives the path of a JSON file of filters, and returns the list of their settings (dictionaries). Checks that the
+filters can be built, so a mistake is found when the server starts instead of in the workers.
+Raises ValueError if the file isn't a valid list of filters, and OSError if it can't be read.
+"""
+def load_settings(path):
+    with open(path) as settings_file:
+        try:
+            settings_list = json.load(settings_file)
+        except json.JSONDecodeError as error:
+            raise ValueError("the file isn't valid JSON: " + str(error))
+    if type(settings_list) is not list:
+        raise ValueError("the file should contain a list of filters")
+    build_pipeline(settings_list)
+    return settings_list
+
+
+# Receives the list of the settings of the filters, and builds the filters of this process (called by the server when
+# the filters run in threads of its own process).
+def configure(settings_list):
+    global pipeline
+    pipeline = build_pipeline(settings_list)
+
+
+# Receives the list of the settings of the filters and returns a list of MessageFilter. Raises ValueError if a filter
+# isn't valid.
+def build_pipeline(settings_list):
+    filters = []
+    for settings in settings_list:
+        if type(settings) is not dict or settings.get("kind") not in CHECKS:
+            raise ValueError("every filter should have a kind, one of: " + ", ".join(CHECKS))
+        kind = settings["kind"]
+        timeout = settings.get("timeout", DEFAULT_TIMEOUT)
+        if not isinstance(timeout, (int, float)) or timeout <= 0:
+            raise ValueError("the timeout of a filter should be a positive number of milliseconds")
+        filters.append(MessageFilter(kind, str(settings.get("name", kind)), timeout / 1000,
+                                     PREPARERS[kind](settings)))
+    return filters
+
+
+# The initializer of every process of the pool: receives the list of the settings of the filters and builds them. A
+# process ignores SIGINT - when the server is stopped (Ctrl+C reaches all the processes), it stops the pool itself.
+def start_worker(settings_list):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    configure(settings_list)
+
+
+# Receives a list of filters, and returns the seconds all of them may take for one message together.
+def total_timeout(filters):
+    return sum(message_filter.timeout for message_filter in filters)
+
+
+"""
+Receives the text of a message, and runs the filters of this process on it (in a worker of the pool).
+Returns a tuple of the verdict and a reason: (PASS, None), (REJECT, the reason to tell the sender), or (TIMEOUT, the
+name of the filter) if a filter took longer than its budget - the filters after it aren't run, and the server decides
+what to do with the message. The time of a filter is checked only after it returns (its verdict is ignored if it took
+too long).
+"""
+def run_pipeline(text):
+    for message_filter in pipeline:
+        start = time.perf_counter()
+        reason = CHECKS[message_filter.kind](message_filter.settings, text)
+        if reason is not None:
+            return REJECT, reason
+        if time.perf_counter() - start > message_filter.timeout:
+            return TIMEOUT, message_filter.name
+    return PASS, None
+
+
+# Receives the settings of a keywords filter and returns the set of its words, in lower case.
+def prepare_keywords(settings):
+    words = settings.get("words")
+    if type(words) is not list or not all(type(word) is str for word in words):
+        raise ValueError("a keywords filter should have a list of words")
+    return {word.lower() for word in words}
+
+
+# Receives the blocked words and the text of a message. Returns the reason it's rejected, or None if it doesn't contain
+# any of the words (as a whole word, in any case).
+def check_keywords(words, text):
+    for word in WORD_PATTERN.findall(text.lower()):
+        if word in words:
+            return "it contains a blocked word."
+    return None
+
+
+# Receives the settings of a regex filter and returns the list of its compiled patterns (that ignore the case). Raises
+# ValueError if a pattern isn't valid.
+def prepare_regexes(settings):
+    patterns = settings.get("patterns")
+    if type(patterns) is not list or not all(type(pattern) is str for pattern in patterns):
+        raise ValueError("a regex filter should have a list of patterns")
+    try:
+        return [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+    except re.error as error:
+        raise ValueError("invalid pattern: " + str(error))
+
+
+# Receives the compiled patterns and the text of a message. Returns the reason it's rejected, or None if no pattern is
+# found in it.
+def check_regexes(patterns, text):
+    for pattern in patterns:
+        if pattern.search(text) is not None:
+            return "it matches a blocked pattern."
+    return None
+
+
+# Receives the settings of a spam filter and returns its maximal score.
+def prepare_spam(settings):
+    max_score = settings.get("max_score", DEFAULT_MAX_SPAM_SCORE)
+    if not isinstance(max_score, (int, float)) or not 0 < max_score <= 1:
+        raise ValueError("the maximal spam score should be between 0 and 1")
+    return max_score
+
+
+# Receives the maximal score and the text of a message. Returns the reason it's rejected, or None if its spam score
+# isn't higher than the maximal score.
+def check_spam(max_score, text):
+    if spam_score(text) > max_score:
+        return "it looks like spam."
+    return None
+
+
+"""
+Receives the text of a message and returns its spam score, between 0 and 1. Every sign of spam adds to the score:
+shouting (most of the letters are capital), a long run of the same character, the same word again and again, many
+exclamation marks, and links. A short message is hardly checked - it can't be much of a flood.
+"""
+def spam_score(text):
+    letters = [char for char in text if char.isalpha()]
+    score = 0
+    if len(letters) >= 8 and sum(1 for char in letters if char.isupper()) / len(letters) > 0.7:
+        score += 0.4
+    if REPEATED_CHARACTER_PATTERN.search(text) is not None:
+        score += 0.3
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) >= 6 and len(set(words)) / len(words) < 0.3:
+        score += 0.4
+    if text.count("!") >= 5:
+        score += 0.2
+    score += 0.15 * min(len(LINK_PATTERN.findall(text)), 2)
+    return min(score, 1)
+
+
+# Receives the settings of a links filter, and returns a tuple of the allowed domains (None if all the domains are
+# allowed), the blocked domains and the maximal number of links in a message (None for no limit).
+def prepare_links(settings):
+    allowed_domains = settings.get("allowed_domains")
+    blocked_domains = settings.get("blocked_domains", [])
+    max_links = settings.get("max_links")
+    for domains in (allowed_domains or [], blocked_domains):
+        if type(domains) is not list or not all(type(domain) is str for domain in domains):
+            raise ValueError("the domains of a links filter should be a list of strings")
+    if max_links is not None and (type(max_links) is not int or max_links < 0):
+        raise ValueError("the maximal number of links should be a number that isn't negative")
+    if allowed_domains is not None:
+        allowed_domains = [domain.lower() for domain in allowed_domains]
+    return allowed_domains, [domain.lower() for domain in blocked_domains], max_links
+
+
+# Receives the domains and the maximal number of links, and the text of a message. Returns the reason it's rejected,
+# or None if its links are allowed.
+def check_links(settings, text):
+    allowed_domains, blocked_domains, max_links = settings
+    hosts = [host.lower() for host in LINK_PATTERN.findall(text)]
+    if max_links is not None and len(hosts) > max_links:
+        return "it contains too many links."
+    for host in hosts:
+        if is_in_domains(host, blocked_domains) is True or (allowed_domains is not None and
+                                                             is_in_domains(host, allowed_domains) is False):
+            return "it links to a site that isn't allowed."
+    return None
+
+
+# Receives a host name and a list of domains, and returns whether or not the host is one of the domains or a subdomain
+# of one of them.
+def is_in_domains(host, domains):
+    for domain in domains:
+        if host == domain or host.endswith("." + domain):
+            return True
+    return False
+
+
+# A dictionary of the kinds of filters. The value is the function that checks a message (it receives the prepared
+# settings and the text, and returns the reason the message is rejected or None).
+CHECKS = {"keywords": check_keywords, "regex": check_regexes, "spam": check_spam, "links": check_links}
+# The functions that prepare the settings of every kind (they raise ValueError if the settings aren't valid).
+PREPARERS = {"keywords": prepare_keywords, "regex": prepare_regexes, "spam": prepare_spam, "links": prepare_links}
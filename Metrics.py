@@ -0,0 +1,153 @@
+# Counters and histograms of the chat server, exposed in the text format of Prometheus.
+# Auther: Gilad Moyal.
+
+import bisect
+
+"""
+Every metric has a name, a description and an optional label (one label per metric is enough for the server, like
+the command of a frame). The values are kept per value of the label, and rendered only when they are read, so
+updating a metric costs a dictionary lookup and an addition.
+"""
+
+# The default buckets of the histograms of durations, in seconds (from 10 microseconds to 1 second).
+DURATION_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                    0.25, 0.5, 1.0)
+# The default buckets of the histograms of sizes (numbers of recipients, messages or bytes).
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+"""
+Represents a counter - a number that only grows (frames, bytes).
+Described by:
+name, description (strings)
+label_name (string) - the name of the label, or None if the counter has no label.
+values (dictionary) - the key is the value of the label (None without a label) and the value is the count.
+"""
+
+
+class Counter:
+    def __init__(self, name, description, label_name=None):
+        self.name = name
+        self.description = description
+        self.label_name = label_name
+        self.values = {}
+
+    # Receives the amount to add (optional, by default 1) and the value of the label (optional), and adds it.
+    def inc(self, amount=1, label=None):
+        self.values[label] = self.values.get(label, 0) + amount
+
+    # Returns a list of the lines of the counter in the text format.
+    def render(self):
+        lines = header_lines(self, "counter")
+        for label, value in sorted(self.values.items(), key=label_key):
+            lines.append(self.name + label_text(self.label_name, label) + " " + str(value))
+        return lines
+
+
+"""
+Represents a histogram - the distribution of measured values (durations, sizes).
+Described by:
+name, description (strings)
+buckets (tuple of numbers) - the upper bounds of the buckets, from the lowest.
+label_name (string) - the name of the label, or None if the histogram has no label.
+series (dictionary) - the key is the value of the label and the value is a list: the count of every bucket (not
+        cumulative, the last one is for the values above all the bounds), the sum and the count of the values.
+"""
+
+
+class Histogram:
+    def __init__(self, name, description, buckets=DURATION_BUCKETS, label_name=None):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.label_name = label_name
+        self.series = {}
+
+    # Receives a measured value and the value of the label (optional), and adds it to the histogram.
+    def observe(self, value, label=None):
+        series = self.series.get(label)
+        if series is None:
+            series = [[0] * (len(self.buckets) + 1), 0, 0]
+            self.series[label] = series
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    # Returns a list of the lines of the histogram in the text format (the buckets are cumulative there).
+    def render(self):
+        lines = header_lines(self, "histogram")
+        for label, (counts, total, count) in sorted(self.series.items(), key=label_key):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(self.name + "_bucket" + label_text(self.label_name, label, ("le", bound)) + " " +
+                             str(cumulative))
+            lines.append(self.name + "_sum" + label_text(self.label_name, label) + " " + repr(float(total)))
+            lines.append(self.name + "_count" + label_text(self.label_name, label) + " " + str(count))
+        return lines
+
+
+"""
+Represents a gauge that is measured only when the metrics are read (like the number of users), so it costs nothing
+between the reads.
+Described by:
+name, description (strings)
+function - returns the current value when it's called.
+"""
+
+
+class Gauge:
+    def __init__(self, name, description, function):
+        self.name = name
+        self.description = description
+        self.function = function
+
+    # Returns a list of the lines of the gauge in the text format.
+    def render(self):
+        return header_lines(self, "gauge") + [self.name + " " + str(self.function())]
+
+
+"""
+Represents a collection of metrics.
+Described by:
+metrics (list) - the metrics, in the order they are rendered.
+"""
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    # Receives a metric, adds it to the registry and returns it.
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    # Returns the text of all the metrics, in the text format of Prometheus.
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Receives a metric and its type, and returns a list of the lines that describe it.
+def header_lines(metric, metric_type):
+    return ["# HELP " + metric.name + " " + metric.description, "# TYPE " + metric.name + " " + metric_type]
+
+
+# Receives the name of a label, its value and another label (name and value, optional). Returns the labels as they are
+# written after the name of the metric ("" if there are none).
+def label_text(label_name, label, extra_label=None):
+    labels = []
+    if label_name is not None:
+        labels.append(label_name + '="' + str(label) + '"')
+    if extra_label is not None:
+        labels.append(extra_label[0] + '="' + str(extra_label[1]) + '"')
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join(labels) + "}"
+
+
+# Receives an item of the values of a metric (the value of the label first), and returns a key to sort it by.
+def label_key(item):
+    return str(item[0])
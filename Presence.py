@@ -0,0 +1,206 @@
+# The presence of the users of the chat: a versioned roster and its frames, shared by the client and the server.
+# Auther: Gilad Moyal.
+
+import ProtocolV2
+
+"""
+The roster lists the users who logged in. Every entry has a number (given when the user logs in, and never reused on
+the same server), the name of the user, the name of his room and his flags in that room (MANAGER, SILENCED). Every
+change of the roster increases its version by one.
+A client of version 2 subscribes with PRESENCE, and gets the whole roster in PRESENCE_SNAPSHOT frames, followed by a
+PRESENCE_DELTA frame for every change, in the order of the versions - so the roster traffic depends on the changes,
+not on the number of users:
+PRESENCE_SNAPSHOT: a page of the roster - the version, the number of entries in the page and every entry: its number,
+flags, name and room. Every page but the last has the MORE flag (in the header of the frame), so a big roster is sent
+in frames of up to PAGE_SIZE bytes, which the server adds to the queue of the subscriber as it's written.
+PRESENCE_DELTA: the version, the kind of the change (JOINED, CHANGED or LEFT) and the number of the entry. A JOINED or
+CHANGED delta is followed by the flags, name and room of the entry.
+The version, the numbers and the count are varints, the flags and the kind are one byte each, and the name and the
+room are fields (a varint length followed by UTF-8 text), as in the client frames.
+"""
+
+PAGE_SIZE = 32768  # The maximal length of the payload of a page of the snapshot (bytes).
+MORE = 1  # The flag of a page of the snapshot that isn't the last one.
+MANAGER = 1  # The flag of a manager of his room.
+SILENCED = 2  # The flag of a user who is silenced in his room.
+JOINED = 1
+CHANGED = 2
+LEFT = 3
+
+"""
+Represents a user in the roster.
+Described by:
+number (int) - the number of the entry, which identifies it in the deltas (names aren't unique).
+name (string) - the name of the user.
+room (string) - the name of his room.
+flags (int) - MANAGER and SILENCED, or 0.
+"""
+
+
+class RosterEntry:
+    __slots__ = ("number", "name", "room", "flags")
+
+    def __init__(self, number, name, room, flags):
+        self.number = number
+        self.name = name
+        self.room = room
+        self.flags = flags
+
+
+"""
+Represents the roster of the server.
+Described by:
+version (int) - the number of changes since the roster was created.
+entries (dictionary) - the key is the key of a user in the server (his socket), the value is his RosterEntry.
+next_number (int) - the number of the next entry.
+snapshot_frames (list of bytes) - the PRESENCE_SNAPSHOT frames (pages) of the current version, or None until they're
+        asked for. All the subscribers of the same version share them.
+"""
+
+
+class Roster:
+    def __init__(self):
+        self.version = 0
+        self.entries = {}
+        self.next_number = 0
+        self.snapshot_frames = None
+
+    # Receives the key of a user and his name, room and flags. Adds him to the roster or updates his entry, and returns
+    # the PRESENCE_DELTA frame of the change, or None if nothing changed.
+    def update(self, key, name, room, flags):
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = RosterEntry(self.next_number, name, room, flags)
+            self.next_number += 1
+            self.entries[key] = entry
+            return self.changed(JOINED, entry)
+        if entry.name == name and entry.room == room and entry.flags == flags:
+            return None
+        entry.name = name
+        entry.room = room
+        entry.flags = flags
+        return self.changed(CHANGED, entry)
+
+    # Receives the key of a user who left, and returns the PRESENCE_DELTA frame of his removal, or None if he wasn't in
+    # the roster.
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        return self.changed(LEFT, entry)
+
+    # Receives the kind of a change and the entry, starts the next version and returns the PRESENCE_DELTA frame.
+    def changed(self, kind, entry):
+        self.version += 1
+        self.snapshot_frames = None
+        return encode_delta(self.version, kind, entry)
+
+    # Returns the list of the PRESENCE_SNAPSHOT frames of the current version (encoded once for all the subscribers of
+    # the version).
+    def snapshot(self):
+        if self.snapshot_frames is None:
+            self.snapshot_frames = encode_snapshot(self.version, self.entries.values())
+        return self.snapshot_frames
+
+
+# Receives a string and returns it encoded as a field (its length as a varint, followed by its UTF-8 bytes).
+def encode_field(text):
+    data = text.encode()
+    return ProtocolV2.encode_varint(len(data)) + data
+
+
+# Receives a RosterEntry and returns its flags, name and room, encoded.
+def encode_entry_details(entry):
+    return bytes((entry.flags,)) + encode_field(entry.name) + encode_field(entry.room)
+
+
+# Receives the version of the roster and its entries, and returns the list of the PRESENCE_SNAPSHOT frames (pages of up
+# to PAGE_SIZE bytes). An empty roster is sent in one empty page.
+def encode_snapshot(version, entries):
+    pages = []
+    encoded_entries = []
+    length = 0
+    for entry in entries:
+        encoded_entry = ProtocolV2.encode_varint(entry.number) + encode_entry_details(entry)
+        if length + len(encoded_entry) > PAGE_SIZE:
+            pages.append(encoded_entries)
+            encoded_entries = []
+            length = 0
+        encoded_entries.append(encoded_entry)
+        length += len(encoded_entry)
+    pages.append(encoded_entries)
+    encoded_version = ProtocolV2.encode_varint(version)
+    return [ProtocolV2.encode_frame(ProtocolV2.PRESENCE_SNAPSHOT,
+                                    b"".join([encoded_version, ProtocolV2.encode_varint(len(page)), *page]),
+                                    MORE if page_number < len(pages) - 1 else 0)
+            for page_number, page in enumerate(pages)]
+
+
+# Receives the version of the roster, the kind of the change and the entry, and returns the PRESENCE_DELTA frame.
+def encode_delta(version, kind, entry):
+    payload = ProtocolV2.encode_varint(version) + bytes((kind,)) + ProtocolV2.encode_varint(entry.number)
+    if kind != LEFT:
+        payload += encode_entry_details(entry)
+    return ProtocolV2.encode_frame(ProtocolV2.PRESENCE_DELTA, payload)
+
+
+"""
+Receives a buffer, and the positions where the payload of a PRESENCE_SNAPSHOT frame (a page) starts and ends.
+Returns the version and a dictionary of the entries of the page (the key is the number of the entry, the value is the
+RosterEntry). Raises ValueError if the payload isn't valid.
+"""
+def decode_snapshot(buffer, position, end):
+    version, position = read_varint(buffer, position, end)
+    entries_number, position = read_varint(buffer, position, end)
+    entries = {}
+    for i in range(entries_number):
+        number, position = read_varint(buffer, position, end)
+        entry, position = read_entry_details(buffer, position, end, number)
+        entries[number] = entry
+    return version, entries
+
+
+"""
+Receives a buffer, and the positions where the payload of a PRESENCE_DELTA frame starts and ends.
+Returns the version, the kind of the change and the entry (RosterEntry - only its number is set for LEFT). Raises
+ValueError if the payload isn't valid.
+"""
+def decode_delta(buffer, position, end):
+    version, position = read_varint(buffer, position, end)
+    if position >= end or buffer[position] not in (JOINED, CHANGED, LEFT):
+        raise ValueError("invalid presence delta")
+    kind = buffer[position]
+    number, position = read_varint(buffer, position + 1, end)
+    if kind == LEFT:
+        return version, kind, RosterEntry(number, None, None, 0)
+    entry, position = read_entry_details(buffer, position, end, number)
+    return version, kind, entry
+
+
+# Receives a buffer, the position of a varint and the end of the payload. Returns the number and the position after it.
+# Raises ValueError if the varint isn't complete.
+def read_varint(buffer, position, end):
+    result = ProtocolV2.decode_varint(buffer, position, end)
+    if result is None:
+        raise ValueError("invalid presence frame")
+    return result
+
+
+# Receives a buffer, the position of a field and the end of the payload. Returns the text of the field and the
+# position after it. Raises ValueError if the field isn't complete.
+def read_field(buffer, position, end):
+    length, position = read_varint(buffer, position, end)
+    if position + length > end:
+        raise ValueError("invalid presence frame")
+    return bytes(buffer[position:position + length]).decode(), position + length
+
+
+# Receives a buffer, the position of the details of an entry, the end of the payload and the number of the entry.
+# Returns the RosterEntry and the position after it. Raises ValueError if the details aren't complete.
+def read_entry_details(buffer, position, end, number):
+    if position >= end:
+        raise ValueError("invalid presence frame")
+    flags = buffer[position]
+    name, position = read_field(buffer, position + 1, end)
+    room, position = read_field(buffer, position, end)
+    return RosterEntry(number, name, room, flags), position
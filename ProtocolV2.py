@@ -0,0 +1,220 @@
+# The binary protocol (version 2) of the chat, shared by the client and the server.
+# Auther: Gilad Moyal.
+
+import struct
+import zlib
+
+"""
+Negotiation: right after connecting, a client that supports version 2 sends HELLO_BYTE followed by the highest version
+it supports (one byte). The server answers with HELLO_BYTE followed by the version it chose (it can be 1). From that
+point every frame in both directions is sent in the chosen version. Messages the server sends before it receives the
+whole hello message are in version 1 and arrive before its answer.
+Data of version 1 never starts with HELLO_BYTE - it starts with digits or letters.
+
+Every frame of version 2 starts with a header of two bytes (type and flags), followed by the length of the payload as
+a varint (7 bits in every byte, the highest bit tells if another byte follows), and the payload itself.
+The payload of a client frame is a list of fields - each of them is a varint length followed by UTF-8 text. The first
+frame of the client is LOGIN, which registers its name once - the commands after it don't contain the name. The fields
+of every frame type are:
+LOGIN: name
+CHAT_MESSAGE: message
+APPOINT_MANAGER, REMOVE_FROM_CHAT, SILENCE_USER: target name
+PRIVATE_MESSAGE: target name, message
+HISTORY: number of messages, sequence number (empty for the last messages, see Server2.handle_history)
+JOIN_ROOM: room name
+COMPRESSION: the name of the compression the client accepts (ZLIB)
+VIEW_MANAGERS, QUIT, LEAVE_ROOM, VIEW_ROOMS, PONG, PRESENCE: no fields
+The payload of a server frame (SERVER_TEXT) is the UTF-8 text to print. If the SEQUENCE flag is set, the text is a
+message from the history of the chat, and its sequence number (a varint) comes before it.
+Compression: a client that can decompress zlib sends COMPRESSION (it may send it before LOGIN). From then on, the
+server may compress the text of long messages to it - the COMPRESSED flag is set, and the text (after the sequence
+number, if there is one) is compressed with zlib. A client that doesn't send COMPRESSION never gets compressed frames.
+Heartbeats: the server sends PING (a server frame without a payload) to a client that has been quiet for a while, and
+the client answers with PONG right away, so the server knows the connection is still alive.
+Presence: a client that sends PRESENCE gets the roster of the chat (PRESENCE_SNAPSHOT), and then every change of it
+(PRESENCE_DELTA) - see Presence.py.
+"""
+
+HELLO_BYTE = 0
+VERSION = 2
+HEADER = struct.Struct("!BB")  # Type and flags.
+MAX_PAYLOAD_LENGTH = 1 << 20  # The maximal length of the payload of a frame (1 MiB).
+
+# Frame types. The numbers of the commands are the same as in version 1.
+CHAT_MESSAGE = 1
+APPOINT_MANAGER = 2
+REMOVE_FROM_CHAT = 3
+SILENCE_USER = 4
+PRIVATE_MESSAGE = 5
+VIEW_MANAGERS = 6
+QUIT = 7
+LOGIN = 8
+HISTORY = 9
+JOIN_ROOM = 10
+LEAVE_ROOM = 11
+VIEW_ROOMS = 12
+PONG = 13
+COMPRESSION = 14
+PRESENCE = 15
+SERVER_TEXT = 128
+PING = 129
+PRESENCE_SNAPSHOT = 130
+PRESENCE_DELTA = 131
+SERVER_FRAME_TYPES = (SERVER_TEXT, PING, PRESENCE_SNAPSHOT, PRESENCE_DELTA)
+
+SEQUENCE = 1  # The flag of a server frame that starts with a sequence number.
+COMPRESSED = 2  # The flag of a server frame whose text is compressed.
+ZLIB = "zlib"  # The name of the compression (the field of COMPRESSION).
+
+FIELDS_NUMBER = {CHAT_MESSAGE: 1, APPOINT_MANAGER: 1, REMOVE_FROM_CHAT: 1, SILENCE_USER: 1, PRIVATE_MESSAGE: 2,
+                 VIEW_MANAGERS: 0, QUIT: 0, LOGIN: 1, HISTORY: 2, JOIN_ROOM: 1, LEAVE_ROOM: 0, VIEW_ROOMS: 0,
+                 PONG: 0, COMPRESSION: 1, PRESENCE: 0}
+# The parts of the frames that are the same in many frames, encoded in advance: the varints of one byte (0 to 127), and
+# the headers of the server text frames, without and with a sequence number.
+SMALL_VARINTS = [bytes((number,)) for number in range(0x80)]
+SERVER_TEXT_HEADER = HEADER.pack(SERVER_TEXT, 0)
+SEQUENCE_TEXT_HEADER = HEADER.pack(SERVER_TEXT, SEQUENCE)
+
+
+# Receives the highest version the client supports and returns the hello message of the client (or the answer of the
+# server, with the chosen version).
+def hello(version):
+    return bytes((HELLO_BYTE, version))
+
+
+# Receives a non-negative number and returns it encoded as a varint.
+def encode_varint(number):
+    if number < 0x80:
+        return SMALL_VARINTS[number]
+    encoded = bytearray()
+    while number >= 0x80:
+        encoded.append((number & 0x7f) | 0x80)
+        number >>= 7
+    encoded.append(number)
+    return bytes(encoded)
+
+
+"""
+Receives a buffer (bytes, bytearray or memoryview), the position of a varint in it and the position where the data
+ends. Returns the number and the position after it, or None if the data doesn't contain the whole varint yet.
+Raises ValueError if the varint is longer than 9 bytes (more than any valid length or sequence number).
+"""
+def decode_varint(buffer, position, end):
+    number = 0
+    shift = 0
+    while position < end:
+        byte = buffer[position]
+        position += 1
+        number |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return number, position
+        shift += 7
+        if shift > 56:
+            raise ValueError("varint too long")
+    return None
+
+
+# Receives the type of a frame, its flags and its payload (bytes), and returns the encoded frame.
+def encode_frame(frame_type, payload, flags=0):
+    return HEADER.pack(frame_type, flags) + encode_varint(len(payload)) + payload
+
+
+# Receives a command (frame type) and its fields (strings), and returns the encoded client frame.
+def encode_client_frame(command, *fields):
+    payload = b""
+    for field in fields:
+        encoded_field = field.encode()
+        payload += encode_varint(len(encoded_field)) + encoded_field
+    return encode_frame(command, payload)
+
+
+# Receives the text of a message of the server and its sequence number in the history (optional), and returns the
+# encoded server frame. The header is built from the parts encoded in advance.
+def encode_server_frame(text, sequence=None):
+    data = text.encode()
+    if sequence is None:
+        return SERVER_TEXT_HEADER + encode_varint(len(data)) + data
+    encoded_sequence = encode_varint(sequence)
+    return b"".join((SEQUENCE_TEXT_HEADER, encode_varint(len(encoded_sequence) + len(data)), encoded_sequence, data))
+
+
+
+"""
+Receives the text of a message of the server, its sequence number in the history (None if it isn't from there) and 
+the level of the compression (1 to 9, zlib). Returns the server frame with the text compressed, or None if the 
+compressed text isn't shorter.
+"""
+def encode_compressed_server_frame(text, sequence, level):
+    data = text.encode()
+    compressed = zlib.compress(data, level)
+    if len(compressed) >= len(data):
+        return None
+    if sequence is None:
+        return encode_frame(SERVER_TEXT, compressed, COMPRESSED)
+    return encode_frame(SERVER_TEXT, encode_varint(sequence) + compressed, COMPRESSED | SEQUENCE)
+
+
+# Receives the compressed text of a server frame and returns it decompressed (bytes). Raises ValueError if it isn't
+# valid, or if it's longer than MAX_PAYLOAD_LENGTH after decompressing.
+def decompress_text(data):
+    decompressor = zlib.decompressobj()
+    try:
+        text = decompressor.decompress(data, MAX_PAYLOAD_LENGTH)
+    except zlib.error:
+        raise ValueError("invalid compressed text")
+    if decompressor.eof is False:
+        raise ValueError("compressed text too long or cut")
+    return text
+
+
+"""
+Receives a buffer and the position of a frame in it. Reads the header of the frame without copying the data.
+Returns the type, the flags, the position where the payload starts and the position where it ends, or None if the
+buffer doesn't contain the whole frame yet. Raises ValueError if the payload is too long.
+"""
+def read_frame_header(buffer, position):
+    end = len(buffer)
+    if end - position < HEADER.size:
+        return None
+    frame_type, flags = HEADER.unpack_from(buffer, position)
+    result = decode_varint(buffer, position + HEADER.size, end)
+    if result is None:
+        return None
+    payload_length, payload_start = result
+    if payload_length > MAX_PAYLOAD_LENGTH:
+        raise ValueError("payload too long")
+    payload_end = payload_start + payload_length
+    if payload_end > end:
+        return None
+    return frame_type, flags, payload_start, payload_end
+
+
+"""
+Receives a memoryview of the received data and the position of a client frame in it. The fields are decoded directly
+from the memoryview, without copying the rest of the data.
+Returns the command, a list of the fields (strings) and the position after the frame, or None if the data doesn't
+contain the whole frame yet. Raises ValueError if the frame doesn't match the protocol.
+"""
+def parse_client_frame(view, position):
+    header = read_frame_header(view, position)
+    if header is None:
+        return None
+    command, flags, field_position, payload_end = header
+    fields_number = FIELDS_NUMBER.get(command)
+    if fields_number is None:
+        raise ValueError("invalid command")
+    fields = []
+    for i in range(fields_number):
+        if field_position < payload_end and view[field_position] < 0x80:  # Most of the lengths fit in one byte.
+            field_length = view[field_position]
+            field_start = field_position + 1
+        else:
+            result = decode_varint(view, field_position, payload_end)
+            if result is None:
+                raise ValueError("invalid field")
+            field_length, field_start = result
+        field_position = field_start + field_length
+        if field_position > payload_end:
+            raise ValueError("invalid field")
+        fields.append(str(view[field_start:field_position], "utf-8"))
+    return command, fields, payload_end
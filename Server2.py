@@ -1,468 +1,2930 @@
-# Server for 12.6 chat project from "Gvahim" book.
-# Auther: Gilad Moyal.
-
-import socket
-import select
-import time
-import ctypes
-
-"""Represents every user (client) that joins the chat.
-Described by:
-name (string)
-is_manager (boolean)
-is_silenced (boolean)
-"""
-
-
-class User:
-    def __init__(self, name=None, is_manager=False, is_silenced=False):
-        self.name = name
-        self.is_manager = is_manager
-        self.is_silenced = is_silenced
-
-
-"""
-Represents every message that needs to be sent
-Described by:
-message (string)
-recv_sockets (list of sockets) - the sockets that the message will be sent to them.
-remove_recipient (boolean) - whether or not the message is a remove message (a message sent to the user after a manager 
-        had removed him from the chat or if the user decided to quit).
-"""
-
-
-class Message:
-    def __init__(self, message, recv_sockets, remove_recipient=False):
-        self.message = message
-        self.recv_sockets = recv_sockets
-        self.remove_recipient = remove_recipient
-
-
-MAX_BYTES = 100000  # The maximal size of every "chunk" of bytes sent threw the socket (6 digits)
-MAX_NAME_LENGTH = 99  # The maximal length of the user's name (2 digits).
-MAX_MESSAGE_LENGTH = 9999  # The maximal length of a message the user sends (4 digits).
-MANAGER_SYMBOL = "@"  # The character that will be printed at the beginning of the manager's name
-
-# Commands and their numbers:
-CHAT_MESSAGE = 1
-APPOINT_MANAGER = 2  # for managers only
-REMOVE_FROM_CHAT = 3  # for managers only
-SILENCE_USER = 4  # for managers only
-PRIVATE_MESSAGE = 5
-# Without a number and added data (only letters):
-VIEW_MANAGERS = "view-managers"
-QUIT = "quit"
-
-users_dict = {}  # A dictionary in which the key is the id of the connected socket, and the value is a User object.
-connected_client_sockets = []  # A list of sockets connected to the server.
-messages_to_send = []  # A list of type Message - contains all the messages that need to be sent.
-managers_names = []  # A list of the managers names.
-server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # AF_INET refers to ipv4, SOCK_STREAM refers to TCP
-
-
-def main():
-    server_socket.bind(('127.0.0.1', 1111))  # Binds the socket to address (ip, port).
-    server_socket.listen(5)  # Waits for incoming connection requests
-
-    while True:
-        rlist, wlist, xlist = select.select([server_socket] + connected_client_sockets, connected_client_sockets, [])
-        # Receives messages by readable sockets.
-        # It can be a connection request, a regular message or disconnection request.
-        for current_socket in rlist:
-            handle_incoming_data(current_socket)
-            # If there are no managers (if the chat just opened or if the last manager left the chat).
-            if len(managers_names) == 0:
-                automatic_manager_appointment()
-
-        # Sends the messages to the writable sockets, that are recipients of the message. Removes the sockets and the
-        # users that received a remove message.
-        for message in messages_to_send:
-            send_and_remove(wlist, message)
-
-
-"""
-Receives data that was sent by the client that contains a command number, and separates from it the user/s name/s, 
-command and message (suitable to the command), according to the protocol.
-Returns a tuple of these details, in the same order they appeared in the data.
-If the data is without a command number (like "quit" and "view-managers"), returns just it.
-"""
-def extract_details_from_data(data):
-    # Commands 1-5
-    name_length = int(data[:len(str(MAX_NAME_LENGTH))])
-    data = data[len(str(MAX_NAME_LENGTH)):]
-    user_name = data[:name_length]
-    data = data[name_length:]
-    command = int(data[0])
-    data = data[1:]
-
-    if command == CHAT_MESSAGE:  # Command 1 - chat message
-        message_length = int(data[:len(str(MAX_MESSAGE_LENGTH))])
-        data = data[len(str(MAX_MESSAGE_LENGTH)):]
-        message = data[:message_length]
-        return user_name, command, message
-
-    # Commands 2,3,4,5 - in all of them there is a name of another user
-    second_name_length = int(data[:len(str(MAX_NAME_LENGTH))])
-    data = data[len(str(MAX_NAME_LENGTH)):]
-    second_name = data[:second_name_length]
-    data = data[second_name_length:]
-    if command != PRIVATE_MESSAGE:  # For commands 2,3,4 - they don't contain a message.
-        return user_name, command, second_name
-
-    # Command 5 - private message between users
-    message_length = int(data[:len(str(MAX_MESSAGE_LENGTH))])
-    data = data[len(str(MAX_MESSAGE_LENGTH)):]
-    message = data[:message_length]
-    return user_name, command, second_name, message
-
-
-"""
-Handles situations in which a message is sent to client/s.
-Receives a list of writable sockets and a message (Message object), and sends it to those who are recipients of the message.
-Removes from the list of users and sockets those that received a remove message (have been removed by a manager).
-"""
-def send_and_remove(wlist, message):
-    for current_socket in message.recv_sockets:
-        if current_socket in wlist:
-            try:
-                current_socket.send(message.message.encode())
-            except OSError:
-                pass
-            message.recv_sockets.remove(current_socket)
-            if message.remove_recipient is True:
-                current_socket.close()
-                connected_client_sockets.remove(current_socket)
-                user_to_remove = users_dict[id(current_socket)]
-                del users_dict[id(current_socket)]
-                if user_to_remove.name in managers_names:
-                    managers_names.remove(user_to_remove.name)
-
-    if len(message.recv_sockets) == 0:
-        messages_to_send.remove(message)
-
-
-# Returns a string of the time in format: hours:minuts, and a space after it.
-def str_time():
-    t = time.localtime()
-    current_time = time.strftime("%H:%M", t)
-    return current_time + " "
-
-"""
-Handles situations in which a certain type of data is received. It can be a connection request, a regular message 
-or disconnection request.
-Receives the socket of the client, executes the requested command, if needed (for example, adds a user to the managers).
-According to the protocol, prepares the message to be sent to the recipients.
-"""
-def handle_incoming_data(send_socket):
-    # Connection request, received by the server's socket.
-    if send_socket is server_socket:
-        handle_connection_request()
-        return
-    # Regular or Disconnection message, received with the client's socket.
-    try:
-        data = send_socket.recv(MAX_BYTES).decode()
-    except ConnectionResetError:  # If the user closes the program of the client.
-        handle_disconnection(send_socket)
-        return
-    # Basic messages, without name and other details.
-    if data == "quit":
-        handle_disconnection(send_socket)
-        return
-    if data == "view-managers":
-        prepare_managers_message(send_socket)
-        return
-
-    # Commands 1-5 - data with more details.
-    details = extract_details_from_data(data)
-    send_name = details[0]
-    command = details[1]
-    # Adds the name of the user if it's the first time he's sending data.
-    if users_dict[id(send_socket)].name is None:
-        users_dict[id(send_socket)].name = send_name
-
-    # Command 1 - a chat message (checks the message isn't empty. If it is - the users won't get any message)
-    if command == CHAT_MESSAGE:
-        handle_chat_message(send_socket, send_name, details[2])
-
-    # Commands 2-5 - involves two sockets.
-    target_name = details[2]
-    target_socket = socket_by_name(send_socket, send_name, target_name)
-    if command == APPOINT_MANAGER:  # Command 2 - appoint manager
-        handle_appoint_manager(send_socket, send_name, target_socket, target_name)
-        return
-    if command == REMOVE_FROM_CHAT:  # Command 3 - remove (disconnect) a user from the chat
-        handle_remove(send_socket, send_name, target_socket, target_name)
-        return
-    if command == SILENCE_USER:  # Command 4 - silence a user.
-        handle_silence_user(send_socket, send_name, target_socket, target_name)
-        return
-    if command == PRIVATE_MESSAGE:  # Command 5 - a private message
-        message = details[3]
-        handle_private_message(send_socket, send_name, target_socket, target_name, message)
-
-
-# Receives the sending socket and prepares a message of the list of managers for this socket.
-# Adds it to the list of messages to send.
-def prepare_managers_message(send_socket):
-    if len(managers_names) == 0:
-        to_send = str_time() + " No managers yet"
-        prepare_message_for_sending(to_send, [send_socket])
-        return
-
-    to_send = str_time() + "The manager/s of the chat is/are: "
-    for name in managers_names:
-        # In case the user that sent view-managers is a manager.
-        if users_dict[id(send_socket)].name == name:
-            to_send = to_send + "\nYou"
-        else:
-            to_send += "\n" + name
-    prepare_message_for_sending(to_send, [send_socket])
-
-
-"""
-Receives the message to send, a list of sockets that should receive the message, and a boolean argument - 
-whether or not the message is a removal message, and the recipient should be removed after the message has sent 
-(optional, by default False). Prepares the message to the format it should be sent in according to the protocol, 
-and adds it to the list of messages. 
-"""
-def prepare_message_for_sending(to_send, recv_sockets, remove_recipient=False):
-    str_to_send_length = (len(str(MAX_BYTES)) - len(str(len(to_send)))) * "0" + str(len(to_send))
-    to_send = str_to_send_length + to_send
-    message = Message(to_send, recv_sockets, remove_recipient)
-    messages_to_send.append(message)
-
-
-"""
-Handles situations in which the incoming data is a connection request.
-Accepts the new socket, adds the user to the dictionary, creates the message to send to all the other users and
-adds it to the list of messages to send.
-"""
-def handle_connection_request():
-    print("Accepting a client.")
-    (new_socket, address) = server_socket.accept()
-    connected_client_sockets.append(new_socket)
-    users_dict[id(new_socket)] = User()
-    recv_sockets = connected_client_sockets.copy()
-    recv_sockets.remove(new_socket)
-    to_send = str_time() + "Someone joined the chat"
-    print(to_send)
-    prepare_message_for_sending(to_send, recv_sockets)
-
-
-"""
-Handles situations in which the incoming data is a disconnection request, or when the clients socket forcibly closed.
-Receives the sending socke. Disconnects it and removes it.
-Creates the message to send to all the other users and adds it to the list of messages to send.
-"""
-def handle_disconnection(send_socket):
-    user_name = users_dict[id(send_socket)].name
-    to_send = ""
-    if user_name is None:
-        to_send = str_time() + "Someone left the chat"
-        print(to_send)
-    else:
-        if users_dict[id(send_socket)].is_manager is True:
-            managers_names.remove(user_name)
-            to_send = str_time() + MANAGER_SYMBOL + user_name + " left the chat"
-            print(to_send)
-        else:
-            to_send = str_time() + user_name + " left the chat"
-            print(to_send)
-    send_socket.close()
-    connected_client_sockets.remove(send_socket)
-    recv_sockets = connected_client_sockets.copy()
-    prepare_message_for_sending(to_send, recv_sockets)
-    del users_dict[id(send_socket)]
-
-
-"""
-Receives the socket and the name of the sending user, and the name of the target user and returns his socket.
-If there is a user with that name, returns his socket, if not returns None.
-***If the target user and the sending user has the same name, compares between the sockets and if they'r not the same,
-returns the socket. If there is only one socket related to the common name, returns that socket (the socket of the 
-sending user). 
-"""
-def socket_by_name(send_socket, send_name, target_name):
-    if send_name == target_name:
-        for socket_id in users_dict.keys():
-            if users_dict[socket_id].name == target_name:
-                curr_socket = ctypes.cast(socket_id, ctypes.py_object).value  # Get the socket by its id
-                if curr_socket is not send_socket:
-                    return curr_socket
-        return send_socket
-
-    for socket_id in users_dict.keys():
-        if users_dict[socket_id].name == target_name:
-            return ctypes.cast(socket_id, ctypes.py_object).value  # Get the socket by its id
-    return None
-
-
-"""In case there are no managers (if the chat just opened or if the manager quit the chat), a new manager will
-will automatically be appointed. Appoints as a manager the user related to the first socket in the list of connected
-sockets, that has a name.
-"""
-def automatic_manager_appointment():
-    for curr_socket in connected_client_sockets:
-        curr_user = users_dict[id(curr_socket)]
-        if curr_user.name is not None:
-            curr_user.is_manager = True
-            managers_names.append(curr_user.name)
-            # Send manager appointment message.
-            to_send1 = str_time() + "You've been appointed  as a manager now!"
-            prepare_message_for_sending(to_send1, [curr_socket])
-            to_send2 = str_time() + curr_user.name + " has been appointed as a manager."
-            recv_sockets = connected_client_sockets.copy()
-            recv_sockets.remove(curr_socket)
-            prepare_message_for_sending(to_send2, recv_sockets)
-            print(str_time() + curr_user.name + " has been automatically apointed as a manager")
-            break
-
-
-# A function that receives the socket and the name of the sending user. If the user related to the socket is silenced,
-# returns true, sends him a suitable message, and prints a description in the console.
-def notify_silenced(send_socket, send_name):
-    if users_dict[id(send_socket)].is_silenced is True:
-        to_send = "You cannot speak here!"
-        prepare_message_for_sending(to_send, [send_socket])
-        print(str_time() + send_name + " tried to send something but he's silenced.")
-        return True
-    return False
-
-
-"""A function that receives the socket and name of the sending user and the socket and name of the user the message is
-sent to him, or that a command is activated on him.
-If the target socket is None, or if the target socket is the same as the sending socket,
-the function returns true, sends the user a suitable message, and prints a description in the console.
-"""
-def notify_ivalid_name(send_socket, send_name, target_socket, target_name):
-    if target_socket is None:
-        to_send = "Invalid user name. No user with name '" + target_name + "' in the chat."
-        print(str_time() + send_name + " entered an invalid name (" + target_name + ")")
-        prepare_message_for_sending(to_send, [send_socket])
-        return True
-    if target_socket is send_socket:
-        to_send1 = "You cannot use this command on yourself."
-        prepare_message_for_sending(to_send1, [send_socket])
-        print(str_time() + send_name + " tried to use a command on himself.")
-        return True
-    return False
-
-
-"""Called in case a user wants to use a command for managers only.
-The function receives the socket and name of the sending user. If he's not a manager, returns true,
-sends him a suitable message and prints a description in the console.
-"""
-def notify_not_manager(send_socket, send_name):
-    if users_dict[id(send_socket)].is_manager is False:
-        to_send = "You'r not allowed to use this command because you'r not a manager."
-        prepare_message_for_sending(to_send, [send_socket])
-        print(str_time() + users_dict[id(send_socket)].name + " tried to use a command available only for managers, "
-        "although he's not a manager")
-        return True
-    return False
-
-
-# Handles cases in which the data sent from the user is a chat message.
-# Receives the sending socket, the name of the sending user and the message.
-def handle_chat_message(send_socket, send_name, message):
-    if notify_silenced(send_socket, send_name) is False:
-        to_send1 = str_time() + "You: " + message
-        prepare_message_for_sending(to_send1, [send_socket])
-        to_send2 = ""
-        if users_dict[id(send_socket)].is_manager is True:
-            to_send2 = str_time() + MANAGER_SYMBOL + send_name + ": " + message
-        else:
-            to_send2 = str_time() + send_name + ": " + message
-        recv_sockets = connected_client_sockets.copy()
-        recv_sockets.remove(send_socket)
-        prepare_message_for_sending(to_send2, recv_sockets)
-        print(to_send2)
-
-
-# Handles situations in which the data sent from the user is an appointment of a user as a manager.
-# Receives the socket and the name of the sending user, the socket and the name of the target (the potential receiving
-# socket).
-def handle_appoint_manager(send_socket, send_name, target_socket, target_name):
-    if notify_not_manager(send_socket, send_name) is False:
-        if notify_ivalid_name(send_socket, send_name, target_socket, target_name) is False:
-            if users_dict[id(target_socket)].is_manager is True:  # If the other user is already a manager
-                to_send = target_name + " is already a manager."
-                prepare_message_for_sending(to_send, [send_socket])
-                print(str_time() + send_name + "tried to appoint " + target_name + " as a manager but he's already a manager.")
-            else:
-                users_dict[id(target_socket)].is_manager = True
-                managers_names.append(target_name)
-                to_send1 = str_time() + MANAGER_SYMBOL + send_name + " appointed you as a manager!"
-                prepare_message_for_sending(to_send1, [target_socket])
-                to_send2 = str_time() + "You appointed " + target_name + " as a manager."
-                prepare_message_for_sending(to_send2, [send_socket])
-                to_send3 = str_time() + MANAGER_SYMBOL + send_name + " appointed " + target_name + " as a manager. "
-                recv_sockets = connected_client_sockets.copy()
-                recv_sockets.remove(target_socket)
-                recv_sockets.remove(send_socket)
-                prepare_message_for_sending(to_send3, recv_sockets)
-                print(to_send3)
-
-
-# Handles situations in which the data sent from the user is a command to remove one of the users.
-# Receives the socket and the name of the sending user, the socket and the name of the target (the potential receiving
-# socket).
-def handle_remove(send_socket, send_name, target_socket, target_name):
-    if notify_not_manager(send_socket, send_name) is False:
-        if notify_ivalid_name(send_socket, send_name, target_socket, target_name) is False:
-            to_send1 = str_time() + MANAGER_SYMBOL + send_name + " removed you from the chat."
-            prepare_message_for_sending(to_send1, [target_socket], True)
-            to_send2 = str_time() + "You removed " + target_name + " from the chat."
-            prepare_message_for_sending(to_send2, [send_socket])
-            to_send3 = str_time() + MANAGER_SYMBOL + send_name + " removed " + target_name + " from the chat."
-            recv_sockets = connected_client_sockets.copy()
-            recv_sockets.remove(target_socket)
-            recv_sockets.remove(send_socket)
-            prepare_message_for_sending(to_send3, recv_sockets)
-            print(to_send3)
-
-
-# Handles situations in which the data sent from the user is a command to silence one of the users.
-# Receives the socket and the name of the sending user, the socket and the name of the target (the potential receiving
-# socket).
-def handle_silence_user(send_socket, send_name, target_socket, target_name):
-    if notify_not_manager(send_socket, send_name) is False:
-        if notify_ivalid_name(send_socket, send_name, target_socket, target_name) is False:
-            if users_dict[id(target_socket)].is_silenced is True:
-                to_send = target_name + " is already silenced"
-                prepare_message_for_sending(to_send, [send_socket])
-                print(str_time() + send_name + "tried to silence " + target_name + " although he's already silenced.")
-            else:
-                users_dict[id(target_socket)].is_silenced = True
-                to_send1 = str_time() + MANAGER_SYMBOL + send_name + " silenced you. You can't send messages any more."
-                prepare_message_for_sending(to_send1, [target_socket])
-                to_send2 = str_time() + "You silenced " + target_name
-                prepare_message_for_sending(to_send2, [send_socket])
-                to_send3 = str_time() + MANAGER_SYMBOL + send_name + " silenced " + target_name
-                recv_sockets = connected_client_sockets.copy()
-                recv_sockets.remove(target_socket)
-                recv_sockets.remove(send_socket)
-                prepare_message_for_sending(to_send3, recv_sockets)
-                print(to_send3)
-
-
-# Handles cases in which the data sent from the user is a private message.
-# Receives the socket and the name of the sending user, the socket and the name of the target (the potential receiving
-# socket), and the message itself.
-def handle_private_message(send_socket, send_name, target_socket, target_name, message):
-    if notify_silenced(send_socket, send_name) is False:
-        if notify_ivalid_name(send_socket, send_name, target_socket, target_name) is False:
-            to_send1 = ""
-            if users_dict[id(send_socket)].is_manager is True:
-                to_send1 = str_time() + "!" + MANAGER_SYMBOL + send_name + ": " + message
-                print(str_time() + MANAGER_SYMBOL + send_name + " sent a private message to " + target_name + ".")
-            else:
-                to_send1 = str_time() + "!" + send_name + ": " + message
-                print(str_time() + send_name + " sent a private message to " + target_name + ".")
-            prepare_message_for_sending(to_send1, [target_socket])
-            to_send2 = str_time() + "You (private message to " + target_name + "): " + message
-            prepare_message_for_sending(to_send2, [send_socket])
-
-
-if __name__ == '__main__':
+# Server for 12.6 chat project from "Gvahim" book.
+# Auther: Gilad Moyal.
+
+import socket
+import selectors
+import asyncio
+import argparse
+import base64
+import codecs
+import collections
+import itertools
+import time
+import os
+import signal
+import multiprocessing
+import multiprocessing.pool
+import ClusterBus
+import HotRestart
+import ProtocolV2
+import ChatHistory
+import Metrics
+import MessageFilters
+import Presence
+import ServerLog
+import TimerWheel
+
+"""Represents every user (client) that joins the chat.
+Described by:
+name (string)
+room (Room) - the room the user is in. Every user is in exactly one room, starting with the main room.
+is_manager (boolean) - whether or not the user is a manager of his room.
+is_silenced (boolean) - whether or not the user is silenced in his room.
+silenced_rooms (frozenset of Room) - the rooms the user has been silenced in (he stays silenced there after leaving).
+frame_reader (FrameReader) - collects the data received from the user's client into frames.
+protocol_version (int) - the version of the protocol of the messages sent to the user (see ProtocolV2.py).
+outgoing (deque of bytes) - the encoded messages waiting to be sent to the user. A message sent to several users is 
+        encoded once, and the same bytes object is shared by all their queues. While the queue is empty it's the 
+        shared NO_MESSAGES, and a deque is created only for the messages that are waiting.
+sent_offset (int) - how many bytes of the first message in the queue have already been sent.
+queued_bytes (int) - how many bytes in the queue haven't been sent yet.
+input_paused (boolean) - whether or not the server stopped reading from the user's client until his queue gets shorter.
+overflowed (boolean) - whether or not the queue got too long, and the user is going to be disconnected.
+remove_after_sending (boolean) - whether or not the user should be removed after his queue is sent (he has been 
+        removed from the chat by a manager).
+rate_buckets (tuple of TokenBucket) - the rate limits of the user's connection, of messages and of bytes (None for a 
+        limit that isn't set), or None until the user sends his first message.
+rate_limit_notified (boolean) - whether or not the user has been told that his messages are dropped (he's told once, 
+        until one of his messages is sent).
+connected_at, last_received (float) - the time (of time.monotonic) the user's client connected, and the last time it 
+        sent data.
+ping_sent (boolean) - whether or not the user's client has been sent a ping since it last sent data.
+check_deadline (float) - the time the connection of the user is checked at next (see check_connection), or None if 
+        it isn't checked.
+compression (boolean) - whether or not the user's client accepts compressed frames (see ProtocolV2.py).
+held_frames (deque) - the frames of the user that wait for the filters: his message that is being checked (a 
+        FilteredMessage) and the frames he sent after it. While it's empty it's the shared NO_MESSAGES.
+The users, the frame readers and the other objects the server keeps many of have __slots__ instead of a dictionary of 
+attributes, and the empty containers of an idle user are shared, so an idle logged in user takes about 0.9 KB, 
+including his entries in the dictionaries and the rooms of the server (see "Benchmark.py memory").
+"""
+
+
+class User:
+    __slots__ = ("name", "is_manager", "is_silenced", "room", "silenced_rooms", "frame_reader", "protocol_version",
+                 "outgoing", "sent_offset", "queued_bytes", "input_paused", "overflowed", "remove_after_sending",
+                 "rate_buckets", "rate_limit_notified", "connected_at", "last_received", "ping_sent", "check_deadline",
+                 "compression", "held_frames")
+
+    def __init__(self, name=None, is_manager=False, is_silenced=False):
+        self.name = name
+        self.is_manager = is_manager
+        self.is_silenced = is_silenced
+        self.room = None
+        self.silenced_rooms = NO_ROOMS
+        self.frame_reader = FrameReader()
+        self.protocol_version = 1
+        self.outgoing = NO_MESSAGES
+        self.sent_offset = 0
+        self.queued_bytes = 0
+        self.input_paused = False
+        self.overflowed = False
+        self.remove_after_sending = False
+        self.rate_buckets = None
+        self.rate_limit_notified = False
+        self.connected_at = time.monotonic()
+        self.last_received = self.connected_at
+        self.ping_sent = False
+        self.check_deadline = None
+        self.compression = False
+        self.held_frames = NO_MESSAGES
+
+
+"""
+Collects the data received from a client, that may contain several frames (commands) or parts of them, and separates 
+it into frames according to the protocol.
+Described by:
+protocol_version (int) - the version of the protocol the client uses, or None before its first data is received.
+decoder - decodes the received bytes, including characters that were split between two pieces of data (version 1, 
+        None until the client chooses it).
+buffer (string) - the received data that hasn't been separated into frames yet (the beginning of a partial frame).
+binary_buffer (bytearray) - the same as buffer, for version 2 (and for the hello message).
+logged_in (boolean) - whether or not the client registered its name (with a login message, or in its first command).
+names_in_frames (boolean) - whether or not the client repeats its name in every command (the original frames of 
+        version 1, without a login message). Only the name in the first command is used.
+invalid (boolean) - whether or not the client sent data that doesn't match the protocol.
+"""
+
+
+class FrameReader:
+    __slots__ = ("protocol_version", "decoder", "buffer", "binary_buffer", "logged_in", "names_in_frames", "invalid")
+
+    def __init__(self):
+        self.protocol_version = None
+        self.decoder = None
+        self.buffer = ""
+        self.binary_buffer = bytearray()
+        self.logged_in = False
+        self.names_in_frames = False
+        self.invalid = False
+
+    # Receives a piece of data (bytes) received from the client and returns a list of all the frames completed by it
+    # (each of them as returned by extract_details_from_data). The beginning of a partial frame is kept for the next time.
+    # If the data starts with a hello message, the version is chosen and HELLO is returned as the first frame.
+    def feed(self, data):
+        frames = []
+        if self.protocol_version is None:
+            self.binary_buffer += data
+            if self.binary_buffer[0] != ProtocolV2.HELLO_BYTE:
+                self.protocol_version = 1
+            elif len(self.binary_buffer) < 2:
+                return frames
+            else:
+                self.protocol_version = min(self.binary_buffer[1], max_protocol_version)
+                if self.protocol_version < 1:
+                    self.invalid = True
+                    return frames
+                del self.binary_buffer[:2]
+                frames.append(HELLO)
+            if self.protocol_version == 1:
+                data = bytes(self.binary_buffer)
+                self.binary_buffer.clear()
+                self.decoder = codecs.getincrementaldecoder("utf-8")()
+        elif self.protocol_version != 1:
+            self.binary_buffer += data
+        if self.protocol_version != 1:
+            self.feed_binary(frames)
+            return frames
+
+        try:
+            self.buffer += self.decoder.decode(data)
+        except UnicodeDecodeError:
+            self.invalid = True
+            return frames
+        position = 0
+        while position < len(self.buffer):
+            with_name = self.logged_in is False or self.names_in_frames is True
+            try:
+                result = extract_details_from_data(self.buffer, position, with_name)
+                if result is None:  # The rest of the frame hasn't been received yet.
+                    break
+                details, position = result
+                # A command that starts with the name of the user.
+                if with_name is True and type(details) is tuple and len(details) > 2:
+                    if self.logged_in is False:
+                        self.names_in_frames = True
+                        self.log_in(frames, details[0])
+                    details = details[1:]
+                self.add_frame(frames, details)
+            except ValueError:
+                self.invalid = True
+                break
+        self.buffer = self.buffer[position:]
+        return frames
+
+    # Receives the list of frames, and adds to it the frames of version 2 in the binary buffer. The frames are read
+    # from a memoryview of the buffer, and the buffer is cut once, after all of them.
+    def feed_binary(self, frames):
+        view = memoryview(self.binary_buffer)
+        position = 0
+        try:
+            while position < len(view):
+                result = ProtocolV2.parse_client_frame(view, position)
+                if result is None:  # The rest of the frame hasn't been received yet.
+                    break
+                command, fields, position = result
+                check_field_lengths(command, fields)
+                basic_message = BASIC_FRAME_TYPES.get(command)
+                if basic_message is None:
+                    self.add_frame(frames, (command, *fields))
+                elif len(fields) == 0:
+                    self.add_frame(frames, basic_message)
+                else:
+                    self.add_frame(frames, (basic_message, fields[0]))
+        except (ValueError, UnicodeDecodeError):
+            self.invalid = True
+        finally:
+            view.release()
+        del self.binary_buffer[:position]
+
+    # Receives the list of frames and the details of a frame without the name of the user, and adds them to the list.
+    # A login message registers the name of the user. Raises ValueError if the client logs in twice (so it can't change
+    # its name), or sends a command before logging in.
+    def add_frame(self, frames, details):
+        if type(details) is str:  # Basic messages, without details.
+            frames.append(details)
+        elif details[0] == LOGIN:
+            if self.logged_in is True:
+                raise ValueError("logged in twice")
+            self.log_in(frames, details[1])
+        elif self.logged_in is False and details[0] != COMPRESSION:  # Compression may be chosen before the login.
+            raise ValueError("command before login")
+        else:
+            frames.append(details)
+
+    # Receives the list of frames and the name of the user. Checks the name and adds a login frame to the list.
+    # Raises ValueError if the name is invalid.
+    def log_in(self, frames, name):
+        if is_valid_name(name) is False:
+            raise ValueError("invalid name")
+        self.logged_in = True
+        frames.append((LOGIN, name))
+
+
+"""
+Represents a message of the server that is sent to one or more users. The message is encoded once for every version
+of the protocol used by its recipients, and the same bytes object is shared by all of them.
+Described by:
+text (string) - the message.
+sequence (int) - the sequence number of the message in the history of the chat, or None if it isn't saved there. It's
+        sent only in version 2 of the protocol.
+frames (dictionary) - the encoded messages, the key is the version of the protocol (or COMPRESSED_FRAME, for the 
+        compressed frame of version 2).
+"""
+
+
+class EncodedMessage:
+    __slots__ = ("text", "sequence", "frames")
+
+    def __init__(self, text, sequence=None):
+        self.text = text
+        self.sequence = sequence
+        self.frames = {}
+
+    # Receives a version of the protocol and whether or not the recipient accepts compressed frames (optional), and
+    # returns the message encoded in it. A long message is compressed once, for all the recipients that accept it.
+    def frame(self, protocol_version, compression=False):
+        key = protocol_version
+        if compression is True and 0 < compression_threshold <= len(self.text):
+            key = COMPRESSED_FRAME
+        frame = self.frames.get(key)
+        if frame is None:
+            if key == COMPRESSED_FRAME:
+                frame = ProtocolV2.encode_compressed_server_frame(self.text, self.sequence, compression_level)
+                if frame is None:  # The message doesn't get shorter.
+                    frame = self.frame(protocol_version)
+                elif metrics is not None:
+                    metrics.compressed_messages.inc()
+            elif protocol_version == 1:
+                frame = encode_message(self.text)
+            else:
+                frame = ProtocolV2.encode_server_frame(self.text, self.sequence)
+            self.frames[key] = frame
+        return frame
+
+
+"""
+Represents a client connected to the asyncio engine. It's used by the handle_* functions in the same way as a client 
+socket (it's the key in users_dict and in the names index), so the same functions serve both engines.
+Described by:
+reader, writer (asyncio streams) - the streams of the connection.
+output_ready (asyncio.Event) - set when messages are added to the queue of the user, to wake the writer coroutine.
+input_resumed (asyncio.Event) - cleared while the server doesn't read from the client (its queue is too long).
+closed (boolean) - whether or not the connection has been closed.
+"""
+
+
+class AsyncClient:
+    __slots__ = ("reader", "writer", "output_ready", "input_resumed", "closed", "writer_task")
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.output_ready = asyncio.Event()
+        self.input_resumed = asyncio.Event()
+        self.input_resumed.set()
+        self.closed = False
+        self.writer_task = None
+
+    # Writes the messages in the queue of the user to the stream until the connection is closed. All the waiting
+    # messages are passed to the stream together (with a flush delay, the messages that arrive during the delay too),
+    # and the coroutine waits until the stream's buffer is drained.
+    # If the user has been removed from the chat, he's removed after his queue has been written.
+    async def write_messages(self):
+        user = users_dict[self]
+        try:
+            while True:
+                await self.output_ready.wait()
+                if flush_delay > 0:
+                    await asyncio.sleep(flush_delay)
+                self.output_ready.clear()
+                self.writer.writelines(user.outgoing)
+                if metrics is not None:
+                    metrics.bytes_out.inc(user.queued_bytes)
+                user.outgoing = NO_MESSAGES
+                user.queued_bytes = 0
+                if user.input_paused is True:
+                    resume_reading(self)
+                await self.writer.drain()
+                if user.remove_after_sending is True:
+                    remove_client(self)
+                    return
+                if len(presence_subscribers.get(self, NO_MESSAGES)) != 0:
+                    feed_presence(self)
+        except (ConnectionError, OSError):
+            pass
+
+    # Closes the connection. Messages which haven't been written yet are dropped.
+    def close(self):
+        if self.closed is True:
+            return
+        self.closed = True
+        self.input_resumed.set()  # So the reader coroutine won't wait forever.
+        if self.writer_task is not None and self.writer_task is not asyncio.current_task():
+            self.writer_task.cancel()
+        self.writer.close()
+
+
+"""
+Represents a user connected to another worker process of the server (in the multi-process mode). It's used by the 
+handle_* functions in the same way as a client socket, but the messages to it are passed to its worker over the bus.
+Described by:
+key (string) - the key of the connection, "<worker number>:<connection number>".
+"""
+
+
+class RemoteConnection:
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+
+"""
+Represents a room of the chat. The chat messages, the managers and the silenced users belong to a room, so a message 
+is sent only to the members of its room. A room is created when the first user joins it, and removed when the last 
+user leaves it (except the main room, which every user starts in). A removed room that has silenced users is kept 
+aside until they leave the chat (see removed_rooms), so they're still silenced if it's created again.
+Described by:
+name (string)
+members (dictionary) - the keys are the sockets of the users in the room, in the order they joined (the values are
+        None).
+managers (set) - the sockets of the managers of the room.
+silenced (set) - the sockets of the users that have been silenced in the room.
+"""
+
+
+class Room:
+    __slots__ = ("name", "members", "managers", "silenced")
+
+    def __init__(self, name):
+        self.name = name
+        self.members = {}
+        self.managers = set()
+        self.silenced = set()
+
+
+"""
+Represents a rate limit (a token bucket): tokens are added at a constant rate, up to the capacity of the bucket, and 
+every message takes tokens (one, or its size in bytes). The tokens are added only when the bucket is checked, by the 
+time since the last check, so a bucket needs no timer and its state is two numbers.
+Described by:
+rate (float) - the tokens added every second.
+capacity (float) - the maximal number of tokens (the burst allowed after a quiet period).
+tokens (float) - the tokens in the bucket at the last check. It may be negative after a message bigger than the 
+        capacity, which is allowed when the bucket is full.
+updated (float) - the time of the last check (of time.monotonic).
+"""
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    # Receives the amount of tokens a message needs and the current time, adds the tokens of the time since the last
+    # check and returns whether or not the message is allowed (without taking the tokens).
+    def allows(self, amount, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens >= amount or self.tokens >= self.capacity
+
+    # Receives the amount of tokens a message needs, and takes them.
+    def take(self, amount):
+        self.tokens -= amount
+
+
+"""
+Represents a chat or private message that is checked by the filters (see MessageFilters.py) before it's handled.
+Described by:
+send_socket - the socket of the sending user.
+details (tuple) - the details of the frame of the message (as returned by FrameReader.feed).
+result (AsyncResult) - the result of the filters in the pool, or None if the message wasn't sent to the pool.
+submitted_at (float) - the time (of time.monotonic) the message was sent to the pool.
+verdict (string) - MessageFilters.PASS or MessageFilters.REJECT (or THROTTLED), or None until it's decided.
+reason (string) - the reason the message was rejected, as the sender is told.
+"""
+
+
+class FilteredMessage:
+    __slots__ = ("send_socket", "details", "result", "submitted_at", "verdict", "reason")
+
+    def __init__(self, send_socket, details):
+        self.send_socket = send_socket
+        self.details = details
+        self.result = None
+        self.submitted_at = time.monotonic()
+        self.verdict = None
+        self.reason = None
+
+
+"""
+The metrics of the server, exposed on the metrics port (see Metrics.py). They are created only when the metrics are 
+enabled - otherwise every measured place checks only that the global metrics is None.
+Described by:
+registry (Metrics.Registry) - all the metrics, in the order they are rendered.
+frames_in (Counter) - the frames received from the clients, by command.
+frames_out (Counter) - the messages added to the queues of the clients. The messages to several users are counted 
+        once for every message (by the number of recipients), not in add_to_queue, so it costs nothing per recipient.
+bytes_in, bytes_out (Counter) - the bytes received from the clients and sent to them.
+send_calls (Counter) - the sendmsg() calls to the clients (selectors engine), each of them a system call.
+throttled (Counter) - the chat and private messages that were dropped because of the rate limits.
+expired_connections (Counter) - the clients that were disconnected by a timeout, by the timeout.
+compressed_messages (Counter) - the messages that were compressed (once for all their recipients).
+filtered_messages (Counter) - the messages checked by the filters, by result: their verdict, or why they got the 
+        fallback verdict (timeout, overflow or error).
+filter_time (Histogram) - the time from sending a message to the filters until its verdict.
+connections (Counter) - the clients that connected.
+loop_time (Histogram) - the time of handling the events of one iteration of the loop (selectors engine), or of one 
+        event (asyncio engine).
+handle_time (Histogram) - the time of handling a frame (the handle_* function of its command), by command.
+fan_out (Histogram) - the number of recipients of every broadcast message (on this worker).
+"""
+
+
+class ServerMetrics:
+    def __init__(self):
+        self.registry = Metrics.Registry()
+        add = self.registry.add
+        self.frames_in = add(Metrics.Counter("chat_frames_in_total", "Frames received from clients.", "command"))
+        self.frames_out = add(Metrics.Counter("chat_frames_out_total", "Messages queued to clients."))
+        self.bytes_in = add(Metrics.Counter("chat_bytes_in_total", "Bytes received from clients."))
+        self.bytes_out = add(Metrics.Counter("chat_bytes_out_total", "Bytes sent to clients."))
+        self.send_calls = add(Metrics.Counter("chat_send_calls_total", "sendmsg() calls to clients."))
+        self.throttled = add(Metrics.Counter("chat_throttled_messages_total", "Messages dropped by the rate limits."))
+        self.expired_connections = add(Metrics.Counter("chat_expired_connections_total",
+                                                       "Clients disconnected by a timeout.", "timeout"))
+        self.compressed_messages = add(Metrics.Counter("chat_compressed_messages_total",
+                                                       "Messages compressed for the clients that accept it."))
+        self.filtered_messages = add(Metrics.Counter("chat_filtered_messages_total",
+                                                     "Messages checked by the filters, by result.", "result"))
+        self.filter_time = add(Metrics.Histogram("chat_filter_seconds",
+                                                 "Time from sending a message to the filters until its verdict."))
+        self.connections = add(Metrics.Counter("chat_connections_total", "Clients that connected."))
+        self.loop_time = add(Metrics.Histogram("chat_loop_iteration_seconds",
+                                               "Time of handling the events of one loop iteration."))
+        self.handle_time = add(Metrics.Histogram("chat_handle_seconds", "Time of handling a frame.",
+                                                 label_name="command"))
+        self.fan_out = add(Metrics.Histogram("chat_broadcast_fanout", "Recipients of a broadcast message on this "
+                                             "worker.", Metrics.SIZE_BUCKETS))
+        add(Metrics.Gauge("chat_users", "Connected users (of all the workers).", lambda: len(users_dict)))
+        add(Metrics.Gauge("chat_rooms", "Rooms of the chat.", lambda: len(rooms)))
+        add(Metrics.Gauge("chat_queued_messages", "Messages waiting to be sent to the clients of this worker.",
+                          lambda: sum(len(user.outgoing) for user in users_dict.values())))
+        add(Metrics.Gauge("chat_queued_bytes", "Bytes waiting to be sent to the clients of this worker.",
+                          lambda: sum(user.queued_bytes for user in users_dict.values())))
+        add(Metrics.Gauge("chat_max_queued_bytes", "Bytes waiting to be sent to the slowest client.",
+                          lambda: max([user.queued_bytes for user in users_dict.values()], default=0)))
+
+
+MAX_BYTES = 100000  # The maximal size of every "chunk" of bytes sent threw the socket (6 digits)
+LENGTH_DIGITS = len(str(MAX_BYTES))  # The number of digits of the length at the beginning of a message of version 1.
+MAX_NAME_LENGTH = 99  # The maximal length of the user's name (2 digits).
+MAX_MESSAGE_LENGTH = 9999  # The maximal length of a message the user sends (4 digits).
+MANAGER_SYMBOL = "@"  # The character that will be printed at the beginning of the manager's name
+SERVER_ADDRESS = ('127.0.0.1', 1111)
+MAX_GATHERED_MESSAGES = 64  # The maximal number of queued messages passed to a single sendmsg() call.
+DEFAULT_HIGH_WATER_MARK = 1024 * 1024  # The default maximal number of bytes waiting to be sent to one client.
+MAX_HISTORY_MESSAGES = 1000  # The maximal number of messages from the history sent for one request.
+MAX_LISTED_ROOMS = 100  # The maximal number of rooms listed in an answer to view-rooms.
+MAX_LISTED_MANAGERS = 100  # The maximal number of managers listed in an answer to view-managers.
+MAIN_ROOM = "main"  # The name of the room every user starts in.
+METRICS_HOST = "127.0.0.1"  # The metrics are exposed on this machine only.
+METRICS_TIMEOUT = 1  # The seconds a connection to the metrics port may take to send its request and get the metrics.
+DEFAULT_RATE_BURST = 2  # The default number of seconds of the rate limits a user can send at once, after a pause.
+DEFAULT_HEARTBEAT_INTERVAL = 30  # Seconds a client of version 2 may be quiet before it's sent a ping.
+DEFAULT_IDLE_TIMEOUT = 90  # Seconds a client of version 2 may be quiet (not answering pings) before it's disconnected.
+DEFAULT_SHUTDOWN_TIMEOUT = 5  # Seconds the server keeps sending the queued messages when it shuts down.
+DEFAULT_COMPRESSION_THRESHOLD = 1024  # The length of the shortest message that is compressed (characters).
+DEFAULT_COMPRESSION_LEVEL = 1  # The level of zlib (1 is the fastest, see "Benchmark.py compression").
+COMPRESSED_FRAME = 0  # The key of the compressed frame in the frames of an EncodedMessage (no version is 0).
+DEFAULT_FILTER_WORKERS = 2  # The default number of processes (or threads) that run the filters of the messages.
+DEFAULT_FILTER_MAX_PENDING = 1000  # The default maximal number of messages checked by the filters at once.
+FILTERS_BUSY = "the server is too busy to check it. Please try again."  # Why a message got the fallback verdict.
+THROTTLED = "throttled"  # The verdict of a message that was dropped by the rate limits before the filters.
+SHUTDOWN_POLL_INTERVAL = 0.05  # Seconds between the checks of the asyncio engine that the clients have been closed.
+
+# Commands and their numbers:
+CHAT_MESSAGE = 1
+APPOINT_MANAGER = 2  # for managers only
+REMOVE_FROM_CHAT = 3  # for managers only
+SILENCE_USER = 4  # for managers only
+PRIVATE_MESSAGE = 5
+HISTORY = 9  # The same number as the frame type in version 2 of the protocol.
+# Without a number and added data (only letters):
+VIEW_MANAGERS = "view-managers"
+QUIT = "quit"
+JOIN_ROOM = "join-room"  # Followed by the name of the room.
+LEAVE_ROOM = "leave-room"  # Goes back to the main room.
+VIEW_ROOMS = "view-rooms"
+HELLO = "hello"  # The hello message of a client that supports version 2 of the protocol (see ProtocolV2.py).
+PONG = "pong"  # The answer to a ping. Only keeps the connection alive.
+COMPRESSION = "compression"  # Followed by the name of the compression the client accepts (version 2 only).
+LOGIN = "login"  # The login message, followed by the name of the user. Sent once, before the commands.
+PRESENCE = "presence"  # A subscription to the roster of the chat (version 2 only, see Presence.py).
+FILTERED_COMMANDS = (CHAT_MESSAGE, PRIVATE_MESSAGE)  # The commands whose messages are checked by the filters.
+# The names of the commands in the metrics.
+COMMAND_NAMES = {CHAT_MESSAGE: "chat", APPOINT_MANAGER: "appoint-manager", REMOVE_FROM_CHAT: "remove",
+                 SILENCE_USER: "silence", PRIVATE_MESSAGE: "private", HISTORY: "history"}
+
+# A dictionary in which the key is a connected socket, and the value is a User object. The sockets are kept in the
+# order they connected, so it's also the list of sockets connected to the server.
+users_dict = {}
+# The empty queue and the empty set of silenced rooms, shared by all the users that have none (most of them).
+NO_MESSAGES = ()
+NO_ROOMS = frozenset()
+# A dictionary in which the key is a user name, and the value is a list of the sockets of the users with that name
+# (usually only one), in the order they got the name.
+sockets_by_name = {}
+# The roster of the users who logged in (see Presence.py), and the sockets subscribed to it. A subscriber gets the
+# snapshot once, and then a small delta for every change, shared by all the subscribers. The value is the deque of the
+# frames waiting to be added to the queue of the subscriber (see feed_presence), or NO_MESSAGES.
+roster = Presence.Roster()
+presence_subscribers = {}
+main_room = Room(MAIN_ROOM)
+rooms = {MAIN_ROOM: main_room}  # A dictionary in which the key is a name of a room and the value is the Room.
+# The rooms that were removed while users that are still in the chat were silenced in them (the key is the name of the
+# room). Such a room is restored when a user joins a room with its name, so a silenced user can't leave a room and
+# create it again to speak there. It's dropped when the last of its silenced users leaves the chat.
+removed_rooms = {}
+# The rooms that may have no managers (the last manager left them, or a user with a name joined them), so a manager is
+# appointed automatically only in them, without checking all the rooms.
+unmanaged_rooms = set()
+overflowed_clients = []  # A list of the sockets whose queue got too long (their clients don't read their messages).
+# When the queue of a client passes the high water mark, the server disconnects the client (the "disconnect" policy), or
+# stops reading from it until the queue is back under half of the mark (the "pause" policy). A paused client whose
+# queue passes twice the mark is disconnected too, so the memory of a slow client's queue is always bounded.
+high_water_mark = DEFAULT_HIGH_WATER_MARK
+slow_client_policy = "disconnect"
+max_protocol_version = ProtocolV2.VERSION  # The highest version of the protocol the server agrees to use.
+# The messages queued for a client during an iteration of the loop are written together at its end, in a single
+# sendmsg() call (the "tick" policy), and the socket is watched for writing only if the kernel doesn't accept all of
+# them. The "writable" policy waits until the selector reports that the socket is writable, which costs two more
+# system calls for every client that gets a message (starting and stopping to watch it for writing) and another
+# iteration of the loop. With a flush delay (in seconds), the messages of several iterations (or events of the asyncio
+# engine) are written together, but none of them waits longer than the delay.
+flush_policy = "tick"
+flush_delay = 0
+pending_flush = {}  # The sockets whose new messages haven't been written yet (the values are None).
+flush_deadline = None  # The time (of time.monotonic) the pending sockets are written at, when there's a flush delay.
+# The TCP options of the clients' sockets: TCP_NODELAY sends small frames right away, instead of waiting until the
+# client acknowledges the previous ones (Nagle's algorithm). TCP_CORK (Linux) holds the data of a queue that takes
+# several sendmsg() calls until it's all written, so it's sent in full packets.
+tcp_nodelay = True
+tcp_cork = False
+# The rate limits of the chat and private messages (the messages that are sent to other users): the messages and the
+# bytes every connection may send in a second, the same for all the connections of a name together (of this worker),
+# and the number of seconds of the limits that can be sent at once. 0 means no limit. The message of a user who sends
+# too fast is dropped, and he's told about it.
+rate_limits = {"messages": 0, "bytes": 0, "name_messages": 0, "name_bytes": 0}
+rate_burst = DEFAULT_RATE_BURST
+rate_limited = False  # Whether or not any rate limit is set.
+# Whether or not the message that is being handled has already been checked by the rate limits (a message for the
+# filters is checked before it's sent to the pool, so a user who sends too fast doesn't fill the pool).
+rate_checked = False
+# A dictionary in which the key is a user name, and the value is the rate limits of all his connections together (a
+# tuple of the TokenBucket of the messages and of the bytes). Removed when the last socket with the name leaves.
+name_buckets = {}
+# The lifecycle of the connections: a client of version 2 that has been quiet for the heartbeat interval is sent a ping,
+# and one that has been quiet for the idle timeout (it didn't answer) is disconnected, so clients that vanished without
+# closing their connection don't stay in the chat. Clients of version 1 can't answer pings, so they are never sent
+# pings and never idle. A client that doesn't log in within the handshake timeout is disconnected (0 means never - the
+# original clients of version 1 send their name with their first message). When the server is stopped (SIGTERM or
+# SIGINT), it keeps sending the queued messages for the shutdown timeout before it exits.
+heartbeat_interval = DEFAULT_HEARTBEAT_INTERVAL
+idle_timeout = DEFAULT_IDLE_TIMEOUT
+handshake_timeout = 0
+shutdown_timeout = DEFAULT_SHUTDOWN_TIMEOUT
+# The deadlines of the connections. Every connection has at most one deadline in the wheel, and receiving data only
+# updates the time of the user's last data - when the deadline passes, the connection is checked and gets a new one.
+timers = TimerWheel.TimerWheel()
+# Clients of version 2 that ask for it get the long messages compressed (see ProtocolV2.py). A message is compressed 
+# once, and the same compressed frame is sent to all of its recipients that accept it. 0 means no compression.
+compression_threshold = DEFAULT_COMPRESSION_THRESHOLD
+compression_level = DEFAULT_COMPRESSION_LEVEL
+PING_FRAME = ProtocolV2.encode_frame(ProtocolV2.PING, b"")
+# The filters of the chat and private messages (see MessageFilters.py): the list of their settings, or None if there
+# are no filters. They run in a pool of processes (or threads), so the loop goes on while a message is checked. The
+# frames a client sends after a message that is being checked are held until the filters finish, so the frames of
+# every client are handled in the order it sent them. A message gets the fallback verdict (pass or reject) if its
+# filters don't finish within their timeouts, or if filter_max_pending messages are already in the pool - including
+# the ones whose filters took too long and still run (a filter can't be stopped in the middle, see run_pipeline).
+filter_settings = None
+filter_pool_kind = "process"
+filter_workers = DEFAULT_FILTER_WORKERS
+filter_max_pending = DEFAULT_FILTER_MAX_PENDING
+filter_fallback = MessageFilters.PASS
+filter_timeout = 0  # The seconds all the filters of a message may take together, since it's sent to the pool.
+filter_pool = None  # The pool (of multiprocessing) that runs the filters, or None if there are no filters.
+filtering = collections.deque()  # The messages sent to the pool (FilteredMessage), in the order they were sent.
+finished_filters = collections.deque()  # The messages whose filters finished, added by the threads of the pool.
+filters_in_flight = 0  # The number of messages sent to the pool whose filters haven't finished yet.
+filter_wakeup = None  # The function that wakes the loop when filters finish (called in the threads of the pool).
+async_loop = None  # The event loop of the asyncio engine, or None for the selectors engine.
+shutdown_requested = False
+# A pair of connected sockets: the signals are written to the second one (signal.set_wakeup_fd), and the first one is
+# watched by the selector, so a signal wakes the loop.
+wakeup_socket = None
+wakeup_writer = None
+# The history of the chat (a ChatHistory), or None if it isn't saved. The chat messages, the moderation messages and
+# the users who joined or left are saved, and the clients can ask for the messages they missed.
+history = None
+history_dir = None
+# The metrics of the server (a ServerMetrics), or None if they are disabled. They are served in the text format of
+# Prometheus to every connection to the metrics port (in the multi-process mode, every worker adds its number to it).
+metrics = None
+metrics_port = None
+metrics_socket = None
+# The connections to the metrics port (watched in the selector, like the clients): the key is the connection, the value
+# is the rest of the response to send to it (bytes), or None until its request is read.
+metrics_connections = {}
+# The event engine (epoll on Linux). Every client socket is registered for reading, and for writing only while it has
+# pending messages, so the loop waits when nothing happens, and its cost depends on the active sockets only.
+selector = selectors.DefaultSelector()
+server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # AF_INET refers to ipv4, SOCK_STREAM refers to TCP
+# The multi-process mode: every worker process accepts clients on the same port (SO_REUSEPORT), and the events that
+# concern users of other workers are passed over the bus (see ClusterBus.py). The users of the other workers are
+# represented by RemoteConnection objects, so every worker knows all the users, rooms, managers and silenced users.
+bus = None  # The BusConnection of this worker to the hub, or None if the server runs in a single process.
+worker_number = 0
+connection_keys = {}  # A dictionary in which the key is a socket of this worker and the value is its key.
+connections_by_key = {}  # A dictionary in which the key is a connection key and the value is its socket (or remote).
+connection_numbers = itertools.count()
+# The log of the server (see ServerLog.py): the path of the log file (None for the standard output), the lowest level
+# written, and the size and number of the rotated log files. In the multi-process mode every worker has its own file.
+log_file = None
+log_level = ServerLog.INFO
+log_max_bytes = ServerLog.DEFAULT_MAX_BYTES
+log_backups = ServerLog.DEFAULT_BACKUPS
+time_string_second = None  # The second the cached time string (see str_time) was made in.
+time_string = ""
+# The hot restart (see HotRestart.py): the server listens on a Unix domain socket, and a new server started with
+# --takeover gets through it the listening socket, the sockets of the clients and a snapshot of the users, the rooms
+# and the queued messages. The clients stay connected, and the old server exits.
+handoff_path = None
+handoff_socket = None
+takeover = False  # Whether or not this server takes over from the server on the handoff path when it starts.
+handed_off = False  # Whether or not a new server took over from this one.
+restored_frames = []  # The frames that waited for the filters of the old server: tuples of the socket and details.
+
+
+def main():
+    global high_water_mark, slow_client_policy, max_protocol_version, history, metrics, metrics_port
+    global log_file, log_level, log_max_bytes, log_backups, flush_policy, flush_delay, tcp_nodelay, tcp_cork
+    global rate_burst, rate_limited, heartbeat_interval, idle_timeout, handshake_timeout, shutdown_timeout
+    global compression_threshold, compression_level, filter_settings, filter_pool_kind, filter_workers
+    global filter_max_pending, filter_fallback, filter_timeout, history_dir, handoff_path, takeover
+    arguments = parse_arguments()
+    high_water_mark = arguments.high_water_mark
+    flush_policy = arguments.flush_policy
+    flush_delay = arguments.flush_delay / 1000
+    tcp_nodelay = arguments.tcp_nodelay == "on"
+    tcp_cork = arguments.tcp_cork
+    rate_limits["messages"] = arguments.max_messages_per_second
+    rate_limits["bytes"] = arguments.max_bytes_per_second
+    rate_limits["name_messages"] = arguments.max_name_messages_per_second
+    rate_limits["name_bytes"] = arguments.max_name_bytes_per_second
+    rate_burst = arguments.rate_burst
+    rate_limited = any(limit > 0 for limit in rate_limits.values())
+    heartbeat_interval = arguments.heartbeat_interval
+    idle_timeout = arguments.idle_timeout
+    handshake_timeout = arguments.handshake_timeout
+    shutdown_timeout = arguments.shutdown_timeout
+    compression_threshold = arguments.compression_threshold
+    compression_level = arguments.compression_level
+    filter_settings = arguments.filter_settings
+    if filter_settings is not None:
+        filter_timeout = MessageFilters.total_timeout(MessageFilters.build_pipeline(filter_settings))
+    filter_pool_kind = arguments.filter_pool
+    filter_workers = arguments.filter_workers
+    filter_max_pending = arguments.filter_max_pending
+    filter_fallback = arguments.filter_fallback
+    slow_client_policy = arguments.slow_client_policy
+    max_protocol_version = arguments.max_protocol
+    history_dir = arguments.history_dir
+    # A server that takes over opens the history after the old server saved it (see take_over).
+    if history_dir is not None and arguments.takeover is False:
+        history = ChatHistory.ChatHistory(history_dir)
+    handoff_path = arguments.handoff_socket
+    takeover = arguments.takeover
+    if arguments.metrics_port is not None:
+        metrics = ServerMetrics()
+        metrics_port = arguments.metrics_port
+    log_file = arguments.log_file
+    log_level = ServerLog.LEVELS[arguments.log_level]
+    log_max_bytes = arguments.log_max_bytes
+    log_backups = arguments.log_backups
+    if arguments.workers > 1:
+        ClusterBus.run_workers(arguments.workers, run_worker)
+        return
+    start_log()
+    if arguments.engine == "asyncio":
+        asyncio.run(run_asyncio_engine())
+    else:
+        run_selectors_engine()
+
+
+# Starts the background thread of the log. In the multi-process mode, the number of the worker is added to the name of
+# its log file (server.log becomes server-1.log).
+def start_log():
+    path = log_file
+    if path is not None and bus is not None:
+        root, extension = os.path.splitext(path)
+        path = root + "-" + str(worker_number) + extension
+    ServerLog.start(path, log_level, log_max_bytes, log_backups)
+
+
+# Parses the command line arguments of the server and returns them.
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Server for the chat.")
+    parser.add_argument("--engine", choices=["selectors", "asyncio"], default="selectors",
+                        help="the event engine that runs the server (default: selectors)")
+    parser.add_argument("--high-water-mark", type=int, default=DEFAULT_HIGH_WATER_MARK,
+                        help="the maximal number of bytes waiting to be sent to one client (default: %(default)s)")
+    parser.add_argument("--slow-client-policy", choices=["disconnect", "pause"], default="disconnect",
+                        help="what to do with a client whose waiting bytes pass the high water mark "
+                             "(default: disconnect)")
+    parser.add_argument("--max-protocol", type=int, choices=[1, ProtocolV2.VERSION], default=ProtocolV2.VERSION,
+                        help="the highest version of the protocol offered to clients (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="the number of worker processes that accept clients on the same port (default: 1)")
+    parser.add_argument("--history-dir",
+                        help="the directory the history of the chat is saved in (by default it isn't saved)")
+    parser.add_argument("--metrics-port", type=int,
+                        help="the port the metrics are served on, on this machine only (by default they are "
+                             "disabled). In the multi-process mode, every worker adds its number to the port")
+    parser.add_argument("--log-file", help="the file the log is written to (by default the standard output)")
+    parser.add_argument("--log-level", choices=list(ServerLog.LEVELS), default="info",
+                        help="the lowest level of the records written to the log (default: info)")
+    parser.add_argument("--log-max-bytes", type=int, default=ServerLog.DEFAULT_MAX_BYTES,
+                        help="the size of the log file when it's rotated (default: %(default)s)")
+    parser.add_argument("--log-backups", type=int, default=ServerLog.DEFAULT_BACKUPS,
+                        help="the number of rotated log files that are kept (default: %(default)s)")
+    parser.add_argument("--flush-policy", choices=["tick", "writable"], default="tick",
+                        help="when the queued messages are written (selectors engine): at the end of every iteration "
+                             "of the loop, or when the socket is reported writable (default: tick)")
+    parser.add_argument("--flush-delay", type=float, default=0,
+                        help="the longest time in milliseconds a message waits, so the messages of several "
+                             "iterations are written together (default: 0, every iteration)")
+    parser.add_argument("--tcp-nodelay", choices=["on", "off"], default="on",
+                        help="whether or not TCP_NODELAY is set on the clients' sockets (default: on)")
+    parser.add_argument("--tcp-cork", action="store_true",
+                        help="cork the socket while a long queue is written in several calls (Linux, selectors "
+                             "engine)")
+    parser.add_argument("--max-messages-per-second", type=float, default=0,
+                        help="the chat and private messages a connection may send in a second (default: no limit)")
+    parser.add_argument("--max-bytes-per-second", type=float, default=0,
+                        help="the bytes of chat and private messages a connection may send in a second (default: no "
+                             "limit)")
+    parser.add_argument("--max-name-messages-per-second", type=float, default=0,
+                        help="the same as --max-messages-per-second, for all the connections of a name together")
+    parser.add_argument("--max-name-bytes-per-second", type=float, default=0,
+                        help="the same as --max-bytes-per-second, for all the connections of a name together")
+    parser.add_argument("--rate-burst", type=float, default=DEFAULT_RATE_BURST,
+                        help="the number of seconds of the rate limits that can be sent at once (default: "
+                             "%(default)s)")
+    parser.add_argument("--heartbeat-interval", type=float, default=DEFAULT_HEARTBEAT_INTERVAL,
+                        help="seconds a client of version 2 may be quiet before it's sent a ping (default: "
+                             "%(default)s, 0 for no pings)")
+    parser.add_argument("--idle-timeout", type=float, default=DEFAULT_IDLE_TIMEOUT,
+                        help="seconds a client of version 2 may be quiet before it's disconnected (default: "
+                             "%(default)s, 0 for no timeout)")
+    parser.add_argument("--handshake-timeout", type=float, default=0,
+                        help="seconds a client may stay without logging in before it's disconnected (default: no "
+                             "timeout)")
+    parser.add_argument("--shutdown-timeout", type=float, default=DEFAULT_SHUTDOWN_TIMEOUT,
+                        help="seconds the queued messages are sent for when the server is stopped (default: "
+                             "%(default)s)")
+    parser.add_argument("--compression-threshold", type=int, default=DEFAULT_COMPRESSION_THRESHOLD,
+                        help="the length of the shortest message compressed for the clients that accept it "
+                             "(default: %(default)s, 0 for no compression)")
+    parser.add_argument("--compression-level", type=int, choices=range(1, 10), default=DEFAULT_COMPRESSION_LEVEL,
+                        metavar="{1-9}", help="the level of the compression, 1 is the fastest and 9 compresses the "
+                                              "most (default: %(default)s)")
+    parser.add_argument("--filters", help="the JSON file of the filters of the chat and private messages (see "
+                                          "MessageFilters.py, by default there are no filters)")
+    parser.add_argument("--filter-pool", choices=["process", "thread"], default="process",
+                        help="run the filters in a pool of processes, or of threads - which share the interpreter "
+                             "with the loop, so they suit light filters only (default: process)")
+    parser.add_argument("--filter-workers", type=int, default=DEFAULT_FILTER_WORKERS,
+                        help="the number of processes or threads that run the filters (default: %(default)s)")
+    parser.add_argument("--filter-max-pending", type=int, default=DEFAULT_FILTER_MAX_PENDING,
+                        help="the maximal number of messages checked by the filters at once, the next messages get "
+                             "the fallback verdict (default: %(default)s)")
+    parser.add_argument("--filter-fallback", choices=[MessageFilters.PASS, MessageFilters.REJECT],
+                        default=MessageFilters.PASS,
+                        help="what happens to a message the filters didn't check in time, or because too many "
+                             "messages were waiting (default: pass)")
+    parser.add_argument("--handoff-socket",
+                        help="the path of a Unix domain socket a new server can take this server's place through, "
+                             "without disconnecting the clients (by default there's none)")
+    parser.add_argument("--takeover", action="store_true",
+                        help="take the place of the server running with the same --handoff-socket: get its clients "
+                             "and state, and make it exit")
+    arguments = parser.parse_args()
+    if min(arguments.heartbeat_interval, arguments.idle_timeout, arguments.handshake_timeout,
+           arguments.shutdown_timeout) < 0:
+        parser.error("the timeouts can't be negative")
+    if 0 < arguments.idle_timeout <= arguments.heartbeat_interval:
+        parser.error("the idle timeout should be longer than the heartbeat interval")
+    if arguments.compression_threshold < 0:
+        parser.error("the compression threshold can't be negative")
+    if arguments.filter_workers < 1 or arguments.filter_max_pending < 1:
+        parser.error("the filters need at least one worker and one pending message")
+    arguments.filter_settings = None
+    if arguments.filters is not None:
+        try:
+            arguments.filter_settings = MessageFilters.load_settings(arguments.filters)
+        except (OSError, ValueError) as error:
+            parser.error("can't load the filters: " + str(error))
+    if arguments.rate_burst <= 0:
+        parser.error("the rate burst should be positive")
+    if arguments.flush_delay < 0:
+        parser.error("the flush delay can't be negative")
+    if arguments.tcp_cork is True and (not hasattr(socket, "TCP_CORK") or arguments.engine != "selectors"):
+        parser.error("TCP_CORK is supported on Linux, by the selectors engine only")
+    if arguments.workers > 1 and arguments.engine != "selectors":
+        parser.error("the multi-process mode runs on the selectors engine only")
+    if arguments.workers > 1 and arguments.history_dir is not None:
+        parser.error("the history of the chat can't be saved in the multi-process mode")
+    if arguments.takeover is True and arguments.handoff_socket is None:
+        parser.error("--takeover needs the --handoff-socket of the running server")
+    if arguments.handoff_socket is not None and (not hasattr(socket, "AF_UNIX") or arguments.engine != "selectors" or
+                                                 arguments.workers > 1):
+        parser.error("the hot restart is supported on Unix, by the selectors engine in a single process only")
+    return arguments
+
+
+# Receives the number of this worker process and its connection to the hub, and runs the worker.
+def run_worker(number, bus_connection):
+    global bus, worker_number, server_socket, selector
+    bus = bus_connection
+    worker_number = number
+    # The socket and the selector were created by the main process, every worker creates its own.
+    server_socket.close()
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    selector.close()
+    selector = selectors.DefaultSelector()
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)  # The kernel divides the clients between workers.
+    selector.register(bus.socket, selectors.EVENT_READ)
+    start_log()
+    run_selectors_engine()
+    ServerLog.stop()  # The worker process exits without the handlers of atexit.
+
+
+# Runs the server on the selectors engine: a single loop that waits for events of all the sockets. A server that takes
+# over gets the listening socket and the clients of the old server instead of binding.
+def run_selectors_engine():
+    if takeover is True:
+        take_over()
+    else:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Allows restarting the server right away.
+        server_socket.bind(SERVER_ADDRESS)  # Binds the socket to address (ip, port).
+        server_socket.listen(socket.SOMAXCONN)  # Waits for incoming connection requests
+    selector.register(server_socket, selectors.EVENT_READ)
+    if metrics is not None and metrics_socket is None:
+        start_metrics_socket()
+    watch_shutdown_signals()
+    start_filters()
+    if handoff_path is not None:
+        start_handoff_socket()
+    replay_restored_frames()
+
+    while shutdown_requested is False:
+        handle_selector_events(selector.select(loop_timeout()))
+    if handed_off is True:
+        finish_handoff()
+    else:
+        shut_down()
+
+
+# Receives the events of an iteration of the selectors engine, and handles them. Finally, writes the messages that were
+# queued during the iteration (or since the flush delay started).
+def handle_selector_events(events):
+    if metrics is not None:
+        iteration_start = time.perf_counter()
+    writable_sockets = []
+    for key, mask in events:
+        # Receives messages by readable sockets.
+        # It can be a connection request, a regular message or disconnection request.
+        if mask & selectors.EVENT_READ:
+            handle_incoming_data(key.fileobj)
+            if handed_off is True:  # The sockets belong to the new server now.
+                return
+            # If there are rooms without managers (if the chat just opened or if the last manager left a room).
+            if len(unmanaged_rooms) != 0:
+                appoint_managers()
+        if mask & selectors.EVENT_WRITE:
+            writable_sockets.append(key.fileobj)
+    if len(filtering) != 0 or len(finished_filters) != 0:
+        handle_filter_results()
+    run_timers()
+    if len(unmanaged_rooms) != 0:  # A manager may have been disconnected by a timeout.
+        appoint_managers()
+    # The messages of this iteration are saved together, before they're sent.
+    if history is not None:
+        history.commit()
+
+    # Sends the waiting messages to the writable sockets. Removes the sockets and the users that received a remove
+    # message.
+    for current_socket in writable_sockets:
+        if current_socket in users_dict:  # The socket may have been closed while handling the readable sockets.
+            send_and_remove(current_socket)
+        elif current_socket in metrics_connections:
+            send_metrics(current_socket)
+        elif bus is not None and current_socket is bus.socket and bus.flush():
+            selector.modify(bus.socket, selectors.EVENT_READ)
+    if len(pending_flush) != 0 and (flush_deadline is None or time.monotonic() >= flush_deadline):
+        flush_pending()
+    disconnect_overflowed_clients()
+    if metrics is not None:
+        metrics.loop_time.observe(time.perf_counter() - iteration_start)
+
+
+# Returns the time the selector may wait for events: until the pending messages should be written, the next tick of
+# the timers or the deadline of the filters of the first message in the pool, or None (until an event happens) if
+# there's nothing to wait for.
+def loop_timeout():
+    deadlines = [timers.next_tick()]
+    if len(pending_flush) != 0:
+        deadlines.append(flush_deadline)
+    if len(filtering) != 0:
+        deadlines.append(filtering[0].submitted_at + filter_timeout)
+    deadlines = [deadline for deadline in deadlines if deadline is not None]
+    if len(deadlines) == 0:
+        return None
+    return max(0, min(deadlines) - time.monotonic())
+
+
+# Makes SIGTERM and SIGINT shut the server down gracefully (see shut_down). The signal handler only marks that the
+# server should shut down, and the signal wakes the selector through the wakeup socket.
+def watch_shutdown_signals():
+    global wakeup_socket, wakeup_writer
+    wakeup_socket, wakeup_writer = socket.socketpair()
+    wakeup_socket.setblocking(False)
+    wakeup_writer.setblocking(False)
+    signal.set_wakeup_fd(wakeup_writer.fileno())
+    selector.register(wakeup_socket, selectors.EVENT_READ)
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+
+
+# Called when the server receives SIGTERM or SIGINT. Marks that the server should shut down.
+def request_shutdown(signal_number, frame):
+    global shutdown_requested
+    shutdown_requested = True
+
+
+"""
+Shuts the selectors engine down gracefully: stops accepting clients, tells every user that the server is shutting 
+down, and keeps running the loop until the queues of all the clients have been sent (every client is closed after its 
+queue), or until the shutdown timeout passes.
+"""
+def shut_down():
+    ServerLog.log(str_time() + "The server is shutting down.")
+    stop_filters()
+    selector.unregister(server_socket)
+    server_socket.close()
+    if handoff_socket is not None:
+        handoff_socket.close()
+        remove_handoff_path()
+    local_sockets = [current_socket for current_socket in users_dict
+                     if not isinstance(current_socket, RemoteConnection)]
+    prepare_message_for_sending(str_time() + "The server is shutting down.", local_sockets, True)
+    flush_pending()
+    deadline = time.monotonic() + shutdown_timeout
+    while time.monotonic() < deadline and any(current_socket in users_dict for current_socket in local_sockets):
+        handle_selector_events(selector.select(max(0, deadline - time.monotonic())))
+    close_remaining_clients(local_sockets)
+
+
+# Receives the clients of this process when the server shut down, and closes the ones whose queue hasn't been sent in
+# the shutdown timeout.
+def close_remaining_clients(clients):
+    remaining_clients = [client for client in clients if client in users_dict]
+    if len(remaining_clients) != 0:
+        ServerLog.log(str_time() + str(len(remaining_clients)) + " clients were closed before all their messages were "
+                      "sent.", ServerLog.WARNING)
+    for client in remaining_clients:
+        remove_client(client)
+    if history is not None:
+        history.close()
+
+
+# Opens the handoff socket, which a new server connects to when it takes over (see hand_off). A file left on the path
+# by a server that didn't shut down gracefully is replaced. Only the user of the server may connect to it.
+def start_handoff_socket():
+    global handoff_socket
+    remove_handoff_path()
+    handoff_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    handoff_socket.bind(handoff_path)
+    os.chmod(handoff_path, 0o600)
+    handoff_socket.listen()
+    selector.register(handoff_socket, selectors.EVENT_READ)
+
+
+# Removes the file of the handoff socket, if it exists.
+def remove_handoff_path():
+    try:
+        os.unlink(handoff_path)
+    except FileNotFoundError:
+        pass
+
+
+"""
+Accepts the connection of a new server that takes over. Writes what can be written to the clients, saves the history, 
+and sends the new server the sockets (the listening socket, the metrics socket and the clients) and the snapshot of 
+the state. Nothing is read from the clients meanwhile, so the new server gets every byte they send after it.
+When the new server answers that it took over, the loop stops and this server exits without closing the connections 
+(see finish_handoff). If it fails, this server goes on serving.
+"""
+def hand_off():
+    global handed_off, shutdown_requested
+    successor, address = handoff_socket.accept()
+    ServerLog.log(str_time() + "A new server is taking over.")
+    start = time.perf_counter()
+    disconnect_overflowed_clients()
+    flush_pending()
+    if history is not None:
+        history.commit()
+    handed_sockets = [server_socket]
+    if metrics_socket is not None:
+        handed_sockets.append(metrics_socket)
+    clients = list(users_dict)
+    try:
+        successor.settimeout(HotRestart.TIMEOUT)
+        HotRestart.send_handoff(successor, handed_sockets + clients, build_snapshot(clients))
+        handed_off = HotRestart.wait_for_ack(successor)
+    except OSError:
+        pass
+    successor.close()
+    if handed_off is False:
+        ServerLog.log(str_time() + "The new server failed to take over, this server goes on.", ServerLog.WARNING)
+        return
+    ServerLog.log(str_time() + "Handed " + str(len(clients)) + " clients over in " +
+                  str(round((time.perf_counter() - start) * 1000, 1)) + " ms.")
+    shutdown_requested = True
+
+
+"""
+Receives the sockets of the clients, and returns the snapshot of the state of the server (a dictionary that is sent as 
+JSON): every client with its user, the partial frame it's sending, its queue and its frames that wait for the filters, 
+and every room with its members, managers and silenced users (by the positions of the clients in the list). A message 
+queued to several clients is in the snapshot once. The rate limits and the metrics start over in the new server.
+"""
+def build_snapshot(clients):
+    positions = {current_socket: position for position, current_socket in enumerate(clients)}
+    messages = []
+    message_positions = {}  # The key is the id of a queued message (bytes), the value is its position in messages.
+    clients_state = []
+    for current_socket in clients:
+        user = users_dict[current_socket]
+        queue = []
+        for data in user.outgoing:
+            if id(data) not in message_positions:
+                message_positions[id(data)] = len(messages)
+                messages.append(base64.b64encode(data).decode())
+            queue.append(message_positions[id(data)])
+        held_frames = [details.details if type(details) is FilteredMessage else details for details in user.held_frames]
+        clients_state.append({"name": user.name, "protocol_version": user.protocol_version,
+                              "compression": user.compression, "reader": frame_reader_state(user.frame_reader),
+                              "queue": queue, "sent_offset": user.sent_offset, "input_paused": user.input_paused,
+                              "remove_after_sending": user.remove_after_sending, "connected_at": user.connected_at,
+                              "last_received": user.last_received, "ping_sent": user.ping_sent,
+                              "presence": current_socket in presence_subscribers, "held_frames": held_frames})
+    rooms_state = [{"name": room.name, "members": [positions[member] for member in room.members],
+                    "managers": [positions[manager] for manager in room.managers],
+                    "silenced": [positions[silenced] for silenced in room.silenced]}
+                   for room in itertools.chain(rooms.values(), removed_rooms.values())]
+    return {"clients": clients_state, "rooms": rooms_state, "messages": messages,
+            "metrics_socket": metrics_socket is not None}
+
+
+# Receives a FrameReader and returns its state as a list: the version, the partial frame and the bytes of a character
+# that was split (version 1) or the partial binary frame (version 2), and the login flags.
+def frame_reader_state(frame_reader):
+    split_character = b"" if frame_reader.decoder is None else frame_reader.decoder.getstate()[0]
+    return [frame_reader.protocol_version, frame_reader.buffer, base64.b64encode(split_character).decode(),
+            base64.b64encode(frame_reader.binary_buffer).decode(), frame_reader.logged_in, frame_reader.names_in_frames]
+
+
+"""
+Takes over from the server running on the handoff socket (see hand_off): receives its sockets and the snapshot of its 
+state, restores the state and tells the old server to exit. Exits if the handoff fails - the old server goes on.
+"""
+def take_over():
+    global server_socket, metrics_socket, history
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(HotRestart.TIMEOUT)
+    try:
+        connection.connect(handoff_path)
+        handed_sockets, snapshot = HotRestart.receive_handoff(connection)
+    except OSError as error:
+        raise SystemExit("Can't take over from the running server: " + str(error))
+    server_socket.close()
+    server_socket = handed_sockets.pop(0)
+    if snapshot["metrics_socket"] is True:
+        handed_metrics_socket = handed_sockets.pop(0)
+        # The metrics port of the new server may be different (or the metrics disabled).
+        if metrics is not None and handed_metrics_socket.getsockname()[1] == metrics_port + worker_number:
+            metrics_socket = handed_metrics_socket
+            selector.register(metrics_socket, selectors.EVENT_READ)
+        else:
+            handed_metrics_socket.close()
+    if history_dir is not None:  # The old server saved its history before the handoff, and doesn't write to it.
+        history = ChatHistory.ChatHistory(history_dir)
+    restore_snapshot(handed_sockets, snapshot)
+    try:
+        HotRestart.acknowledge(connection)
+    except OSError:  # The old server has exited already.
+        pass
+    connection.close()
+    ServerLog.log(str_time() + "Took over " + str(len(handed_sockets)) + " clients from the old server.")
+
+
+"""
+Receives the sockets of the clients of the old server and the snapshot of its state (see build_snapshot). Restores the 
+users, their queues (written at the end of the first iteration of the loop), the rooms and the roster, and watches the 
+sockets in the selector. The frames that waited for the filters are handled after the filters start (see 
+replay_restored_frames).
+"""
+def restore_snapshot(client_sockets, snapshot):
+    messages = [base64.b64decode(message) for message in snapshot["messages"]]
+    subscribers = []  # The subscribers of the presence, subscribed again after the roster is rebuilt.
+    for client_socket, state in zip(client_sockets, snapshot["clients"]):
+        client_socket.setblocking(False)
+        user = User(state["name"])
+        user.protocol_version = state["protocol_version"]
+        user.compression = state["compression"]
+        restore_frame_reader(user.frame_reader, state["reader"])
+        user.input_paused = state["input_paused"]
+        user.remove_after_sending = state["remove_after_sending"]
+        user.connected_at = state["connected_at"]  # The monotonic clock is the same in every process.
+        user.last_received = state["last_received"]
+        user.ping_sent = state["ping_sent"]
+        users_dict[client_socket] = user
+        if user.name is not None:
+            sockets_by_name.setdefault(user.name, []).append(client_socket)
+        selector.register(client_socket, selectors.EVENT_READ)
+        if len(state["queue"]) != 0:
+            user.outgoing = collections.deque(messages[position] for position in state["queue"])
+            user.sent_offset = state["sent_offset"]
+            user.queued_bytes = sum(len(data) for data in user.outgoing) - user.sent_offset
+            schedule_flush(client_socket)
+        if user.input_paused is True:
+            update_selector(client_socket, user)
+        for details in state["held_frames"]:
+            restored_frames.append((client_socket, details if type(details) is str else tuple(details)))
+        if state.get("presence") is True:  # Older servers don't hand the subscriptions over.
+            subscribers.append(client_socket)
+    for room_state in snapshot["rooms"]:
+        room = get_room(room_state["name"])
+        for position in room_state["members"]:
+            users_dict[client_sockets[position]].room = room
+            room.members[client_sockets[position]] = None
+        for position in room_state["managers"]:
+            room.managers.add(client_sockets[position])
+            users_dict[client_sockets[position]].is_manager = True
+        for position in room_state["silenced"]:
+            user = users_dict[client_sockets[position]]
+            room.silenced.add(client_sockets[position])
+            user.silenced_rooms = user.silenced_rooms | {room}
+        if len(room.members) == 0 and room is not main_room:  # A room the old server kept for its silenced users.
+            remove_room(room)
+        elif len(room.managers) == 0 and any(users_dict[member].name is not None for member in room.members):
+            unmanaged_rooms.add(room)
+    for client_socket, user in users_dict.items():
+        user.is_silenced = client_socket in user.room.silenced
+        update_presence(client_socket)
+        schedule_connection_check(client_socket, user)
+    # The roster of this server has its own numbers and versions, so the subscribers get a new snapshot.
+    for client_socket in subscribers:
+        subscribe_presence(client_socket)
+
+
+# Receives a new FrameReader and the state of a reader of the old server (see frame_reader_state), and restores it.
+def restore_frame_reader(frame_reader, state):
+    protocol_version, buffer, split_character, binary_buffer, logged_in, names_in_frames = state
+    frame_reader.protocol_version = protocol_version
+    frame_reader.buffer = buffer
+    if protocol_version == 1:
+        frame_reader.decoder = codecs.getincrementaldecoder("utf-8")()
+        frame_reader.decoder.setstate((base64.b64decode(split_character), 0))
+    frame_reader.binary_buffer = bytearray(base64.b64decode(binary_buffer))
+    frame_reader.logged_in = logged_in
+    frame_reader.names_in_frames = names_in_frames
+
+
+# Handles the frames that waited for the filters of the old server, in the order they were sent (they're checked by
+# the filters of this server).
+def replay_restored_frames():
+    while len(restored_frames) != 0:
+        client_socket, details = restored_frames.pop(0)
+        if client_socket in users_dict:  # A frame before it may have removed the user.
+            receive_frame(client_socket, users_dict[client_socket], details)
+
+
+# Finishes the old server after a new server took over. The sockets are closed in this process only (the new server
+# has its own copies), so the clients stay connected. The frames that waited for the filters were handed over.
+def finish_handoff():
+    for user in users_dict.values():
+        user.held_frames = NO_MESSAGES
+    stop_filters()
+    if history is not None:
+        history.close()
+    selector.close()
+    ServerLog.log(str_time() + "A new server took over, this server exits.")
+
+
+# Handles the connections whose deadline passed (see check_connection), and closes the connections to the metrics port
+# that didn't get the metrics in time.
+def run_timers():
+    now = time.monotonic()
+    for current_socket, deadline in timers.advance(now):
+        if current_socket in metrics_connections:
+            close_metrics_connection(current_socket)
+            continue
+        user = users_dict.get(current_socket)
+        # The connection may have been closed, or got an earlier deadline, since the deadline was added.
+        if user is not None and user.check_deadline == deadline:
+            user.check_deadline = None
+            check_connection(current_socket, user, now)
+
+
+"""
+Receives the socket of a client whose deadline passed, its user and the current time. Disconnects the client if it 
+didn't log in within the handshake timeout, or if it has been quiet for the idle timeout (clients of version 2, which 
+answer pings). Sends a ping to a client of version 2 that has been quiet for the heartbeat interval. Finally, adds 
+the next deadline of the connection to the timers.
+"""
+def check_connection(current_socket, user, now):
+    heartbeats = user.protocol_version == ProtocolV2.VERSION
+    quiet_time = now - user.last_received
+    if handshake_timeout > 0 and user.name is None and now - user.connected_at >= handshake_timeout:
+        disconnect_expired_client(current_socket, "handshake", "didn't log in in time")
+        return
+    if heartbeats is True and idle_timeout > 0 and quiet_time >= idle_timeout:
+        disconnect_expired_client(current_socket, "idle", "stopped answering")
+        return
+    if heartbeats is True and heartbeat_interval > 0 and quiet_time >= heartbeat_interval and user.ping_sent is False:
+        user.ping_sent = True
+        add_to_queue(current_socket, PING_FRAME)
+    schedule_connection_check(current_socket, user)
+
+
+# Receives the socket of a client and its user, and adds the next time the connection should be checked to the timers
+# (unless it's already checked earlier, or doesn't need to be checked).
+def schedule_connection_check(current_socket, user):
+    deadlines = []
+    if handshake_timeout > 0 and user.name is None:
+        deadlines.append(user.connected_at + handshake_timeout)
+    if user.protocol_version == ProtocolV2.VERSION:
+        if idle_timeout > 0:
+            deadlines.append(user.last_received + idle_timeout)
+        if heartbeat_interval > 0 and user.ping_sent is False:
+            deadlines.append(user.last_received + heartbeat_interval)
+    if len(deadlines) == 0:
+        return
+    deadline = min(deadlines)
+    if user.check_deadline is not None and user.check_deadline <= deadline:
+        return
+    user.check_deadline = deadline
+    timers.add(deadline, (current_socket, deadline))
+
+
+# Receives the socket of a client that passed a timeout, the name of the timeout and the reason, and disconnects it.
+def disconnect_expired_client(current_socket, timeout_name, reason):
+    ServerLog.log(str_time() + "A client has been disconnected because it " + reason + ".", ServerLog.WARNING)
+    if metrics is not None:
+        metrics.expired_connections.inc(1, timeout_name)
+    handle_disconnection(current_socket)
+
+
+# Opens the socket of the metrics port, and watches it in the selector.
+def start_metrics_socket():
+    global metrics_socket
+    metrics_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    metrics_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    metrics_socket.bind((METRICS_HOST, metrics_port + worker_number))
+    metrics_socket.listen()
+    metrics_socket.setblocking(False)
+    selector.register(metrics_socket, selectors.EVENT_READ)
+
+
+"""
+Accepts a connection to the metrics port, which is answered with the metrics as an HTTP response (so any path can be 
+scraped, like /metrics). The connection is watched in the selector like the clients, so a slow scraper doesn't stop 
+the loop, and it's closed if it doesn't get the metrics within METRICS_TIMEOUT.
+"""
+def serve_metrics():
+    try:
+        connection, address = metrics_socket.accept()
+    except BlockingIOError:
+        return
+    connection.setblocking(False)
+    metrics_connections[connection] = None
+    selector.register(connection, selectors.EVENT_READ)
+    deadline = time.monotonic() + METRICS_TIMEOUT
+    timers.add(deadline, (connection, deadline))
+
+
+# Receives a connection to the metrics port that sent its request (or closed), and answers it with the metrics. The
+# request itself isn't needed.
+def read_metrics_request(connection):
+    try:
+        data = connection.recv(MAX_BYTES)
+    except BlockingIOError:
+        return
+    except OSError:
+        data = b""
+    if data == b"":
+        close_metrics_connection(connection)
+        return
+    if metrics_connections[connection] is None:
+        metrics_connections[connection] = metrics_response()
+        send_metrics(connection)
+
+
+# Receives a connection to the metrics port, and sends it as much of its response as it accepts. The connection is
+# closed when the whole response is sent, and watched for writing until then.
+def send_metrics(connection):
+    response = metrics_connections[connection]
+    try:
+        sent = connection.send(response)
+    except BlockingIOError:
+        sent = 0
+    except OSError:
+        close_metrics_connection(connection)
+        return
+    if sent == len(response):
+        close_metrics_connection(connection)
+        return
+    metrics_connections[connection] = response[sent:]
+    if selector.get_key(connection).events != selectors.EVENT_WRITE:
+        selector.modify(connection, selectors.EVENT_WRITE)
+
+
+# Receives a connection to the metrics port, and closes it.
+def close_metrics_connection(connection):
+    del metrics_connections[connection]
+    selector.unregister(connection)
+    connection.close()
+
+
+# Returns the HTTP response with the current metrics (bytes).
+def metrics_response():
+    body = metrics.registry.render().encode()
+    return (b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: " +
+            str(len(body)).encode() + b"\r\n\r\n" + body)
+
+
+# Runs the server on the asyncio engine: every client has a reader coroutine and a writer coroutine, and one coroutine
+# handles the timers of all of them. SIGTERM and SIGINT shut the server down gracefully.
+async def run_asyncio_engine():
+    server = await asyncio.start_server(handle_async_client, SERVER_ADDRESS[0], SERVER_ADDRESS[1],
+                                        backlog=socket.SOMAXCONN)
+    if metrics is not None:
+        await asyncio.start_server(handle_async_metrics, METRICS_HOST, metrics_port)
+    start_filters(asyncio.get_running_loop())
+    stopping = asyncio.Event()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        asyncio.get_running_loop().add_signal_handler(signal_number, stopping.set)
+    timers_task = asyncio.create_task(run_async_timers())
+    await stopping.wait()
+    server.close()
+    timers_task.cancel()
+    await shut_down_async()
+
+
+# Advances the timers of the asyncio engine every tick (see run_timers).
+async def run_async_timers():
+    while True:
+        await asyncio.sleep(timers.resolution)
+        run_timers()
+        after_async_event()
+
+
+# Shuts the asyncio engine down gracefully, like shut_down: the writer coroutine of every client closes it after
+# writing its queue.
+async def shut_down_async():
+    ServerLog.log(str_time() + "The server is shutting down.")
+    stop_filters()
+    clients = list(users_dict)
+    prepare_message_for_sending(str_time() + "The server is shutting down.", clients, True)
+    deadline = time.monotonic() + shutdown_timeout
+    while time.monotonic() < deadline and any(client in users_dict for client in clients):
+        await asyncio.sleep(SHUTDOWN_POLL_INTERVAL)
+    close_remaining_clients(clients)
+
+
+"""
+The reader coroutine of a client in the asyncio engine. Receives the streams of the new connection, adds the client
+and handles every piece of data it sends until it disconnects.
+"""
+async def handle_async_client(reader, writer):
+    client = AsyncClient(reader, writer)
+    ServerLog.log("Accepting a client.")
+    set_socket_options(writer.get_extra_info("socket"))
+    add_client(client)
+    client.writer_task = asyncio.create_task(client.write_messages())
+    after_async_event()
+    while client.closed is False:
+        await client.input_resumed.wait()
+        try:
+            data = await reader.read(MAX_BYTES)
+        except ConnectionError:  # If the user closes the program of the client.
+            data = b""
+        if client.closed is True:  # The client has been removed while waiting for data.
+            break
+        if metrics is not None:
+            event_start = time.perf_counter()
+        if data == b"":
+            handle_disconnection(client)
+        else:
+            handle_received_bytes(client, data)
+        after_async_event()
+        if metrics is not None:
+            metrics.loop_time.observe(time.perf_counter() - event_start)
+
+
+# Answers a connection to the metrics port in the asyncio engine with the metrics (see serve_metrics).
+async def handle_async_metrics(reader, writer):
+    try:
+        await asyncio.wait_for(reader.read(MAX_BYTES), 1)
+        writer.write(metrics_response())
+        await writer.drain()
+    except (OSError, asyncio.TimeoutError):
+        pass
+    writer.close()
+
+
+# Called after every event of the asyncio engine, like the end of every iteration of the selectors engine.
+def after_async_event():
+    # If there are rooms without managers (if the chat just opened or if the last manager left a room).
+    if len(unmanaged_rooms) != 0:
+        appoint_managers()
+    disconnect_overflowed_clients()
+
+
+# Disconnects the clients whose queue got too long - they don't read their messages fast enough.
+def disconnect_overflowed_clients():
+    while len(overflowed_clients) != 0:
+        current_socket = overflowed_clients.pop()
+        if current_socket in users_dict:
+            ServerLog.log(str_time() + "A client has been disconnected because it doesn't read its messages.",
+                          ServerLog.WARNING)
+            handle_disconnection(current_socket)
+
+
+NAME_LENGTH_DIGITS = len(str(MAX_NAME_LENGTH))
+MESSAGE_LENGTH_DIGITS = len(str(MAX_MESSAGE_LENGTH))
+# The messages without a command number. Login and join-room are followed by a name (of the user or of the room).
+BASIC_MESSAGES = (QUIT, VIEW_MANAGERS, LOGIN, JOIN_ROOM, LEAVE_ROOM, VIEW_ROOMS, PONG)
+BASIC_MESSAGES_WITH_NAME = (LOGIN, JOIN_ROOM)
+# Receives a command of version 2 and its fields, and checks they aren't longer than version 1 allows: the message of a
+# chat or private message up to MAX_MESSAGE_LENGTH, the other fields (names, rooms and numbers) up to MAX_NAME_LENGTH.
+# So every frame can be sent on to the clients of version 1, and its length fits in the length of their messages.
+# Raises ValueError if a field is too long.
+def check_field_lengths(command, fields):
+    for i, field in enumerate(fields):
+        if command in FILTERED_COMMANDS and i == len(fields) - 1:
+            max_length = MAX_MESSAGE_LENGTH
+        else:
+            max_length = MAX_NAME_LENGTH
+        if len(field) > max_length:
+            raise ValueError("field too long")
+
+
+# A dictionary in which the key is a frame type of version 2 of the protocol, and the value is the same basic message
+# in version 1.
+BASIC_FRAME_TYPES = {ProtocolV2.QUIT: QUIT, ProtocolV2.VIEW_MANAGERS: VIEW_MANAGERS, ProtocolV2.LOGIN: LOGIN,
+                     ProtocolV2.JOIN_ROOM: JOIN_ROOM, ProtocolV2.LEAVE_ROOM: LEAVE_ROOM,
+                     ProtocolV2.VIEW_ROOMS: VIEW_ROOMS, ProtocolV2.PONG: PONG,
+                     ProtocolV2.COMPRESSION: COMPRESSION, ProtocolV2.PRESENCE: PRESENCE}
+
+
+"""
+Receives the data that was sent by the client, the position in it where a frame begins and whether or not the 
+commands start with the name of the user (the original frames, before the login message). If the frame contains a 
+command number, separates from it the user/s name/s, command and message (suitable to the command), according to 
+the protocol. The data isn't cut while reading it - every detail is read from its position.
+Returns a tuple of the details (in the same order they appeared in the data), (LOGIN, name) for a login message, 
+(JOIN_ROOM, room name) for a join-room message, or the frame itself if it's without a command number (like "quit" and 
+"view-managers"), together with the position where the frame ends.
+If the data doesn't contain the whole frame yet, returns None. If the data doesn't match the protocol, raises 
+ValueError.
+"""
+def extract_details_from_data(data, position=0, with_name=True):
+    # Basic messages, without name and other details (the commands start with a digit).
+    if not data[position].isdigit():
+        for basic_message in BASIC_MESSAGES:
+            if data.startswith(basic_message, position):
+                if basic_message not in BASIC_MESSAGES_WITH_NAME:
+                    return basic_message, position + len(basic_message)
+                name, position = read_field(data, position + len(basic_message), NAME_LENGTH_DIGITS)
+                if name is None:
+                    return None
+                return (basic_message, name), position
+            if basic_message.startswith(data[position:position + len(basic_message)]):
+                return None
+        raise ValueError("invalid frame")
+
+    # Commands 1-5
+    user_name = None
+    if with_name is True:
+        user_name, position = read_field(data, position, NAME_LENGTH_DIGITS)
+        if user_name is None:
+            return None
+    if position >= len(data):
+        return None
+    command = int(data[position])
+    position += 1
+
+    if command == CHAT_MESSAGE:  # Command 1 - chat message
+        message, position = read_field(data, position, MESSAGE_LENGTH_DIGITS)
+        if message is None:
+            return None
+        return details_with_name(user_name, (command, message)), position
+    if command == HISTORY:  # Command 9 - a request for messages from the history
+        count, position = read_field(data, position, NAME_LENGTH_DIGITS)
+        if count is None:
+            return None
+        since, position = read_field(data, position, NAME_LENGTH_DIGITS)
+        if since is None:
+            return None
+        return details_with_name(user_name, (command, count, since)), position
+    if command not in (APPOINT_MANAGER, REMOVE_FROM_CHAT, SILENCE_USER, PRIVATE_MESSAGE):
+        raise ValueError("invalid command")
+
+    # Commands 2,3,4,5 - in all of them there is a name of another user
+    second_name, position = read_field(data, position, NAME_LENGTH_DIGITS)
+    if second_name is None:
+        return None
+    if command != PRIVATE_MESSAGE:  # For commands 2,3,4 - they don't contain a message.
+        return details_with_name(user_name, (command, second_name)), position
+
+    # Command 5 - private message between users
+    message, position = read_field(data, position, MESSAGE_LENGTH_DIGITS)
+    if message is None:
+        return None
+    return details_with_name(user_name, (command, second_name, message)), position
+
+
+# Receives the name of the user (None if the frame doesn't contain it) and the details of a command, and returns the
+# details, starting with the name if it's not None.
+def details_with_name(user_name, details):
+    if user_name is None:
+        return details
+    return (user_name,) + details
+
+
+# Receives the data, the position of a field in it (a length of digits_number digits followed by the field itself)
+# and the number of digits of the length. Returns the field and the position after it, or None and the position if
+# the data doesn't contain the whole field yet. If the length isn't a number, raises ValueError.
+def read_field(data, position, digits_number):
+    field_start = position + digits_number
+    if field_start > len(data):
+        return None, position
+    field_length = data[position:field_start]
+    if not field_length.isdigit():
+        raise ValueError("invalid length")
+    field_end = field_start + int(field_length)
+    if field_end > len(data):
+        return None, position
+    return data[field_start:field_end], field_end
+
+
+"""
+Handles situations in which messages are sent to a client.
+Receives a writable socket and sends it the messages in the queue of its user, several messages in every sendmsg() 
+call. The socket doesn't block, so the kernel may accept only a part of the data - the messages that were sent are 
+removed from the queue, and a message that was only partly sent stays at its beginning, with the number of bytes 
+that were sent, until the socket is writable again. With TCP_CORK, a queue that takes several calls is corked until 
+it's written.
+When the queue is empty, the socket is watched for reading only. If the user received a remove message (has been 
+removed by a manager), removes the socket and the user.
+"""
+def send_and_remove(current_socket):
+    user = users_dict[current_socket]
+    corked = tcp_cork is True and len(user.outgoing) > MAX_GATHERED_MESSAGES
+    if corked is True:
+        current_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+    while len(user.outgoing) != 0:
+        buffers = [memoryview(user.outgoing[0])[user.sent_offset:]]
+        buffers.extend(itertools.islice(user.outgoing, 1, MAX_GATHERED_MESSAGES))
+        if metrics is not None:
+            metrics.send_calls.inc()
+        try:
+            sent = current_socket.sendmsg(buffers)
+        except BlockingIOError:
+            break
+        except OSError:  # The client has disconnected, it will be noticed when reading from the socket.
+            user.outgoing = NO_MESSAGES
+            user.sent_offset = 0
+            user.queued_bytes = 0
+            break
+        user.queued_bytes -= sent
+        if metrics is not None:
+            metrics.bytes_out.inc(sent)
+        sent += user.sent_offset
+        while len(user.outgoing) != 0 and sent >= len(user.outgoing[0]):
+            sent -= len(user.outgoing.popleft())
+        user.sent_offset = sent
+        if len(user.outgoing) == 0:
+            user.outgoing = NO_MESSAGES
+        if sent != 0:  # The kernel's buffer is full.
+            break
+    if corked is True:
+        current_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+    if len(presence_subscribers.get(current_socket, NO_MESSAGES)) != 0:
+        feed_presence(current_socket)
+
+    if user.input_paused is True and user.queued_bytes <= high_water_mark // 2:
+        user.input_paused = False
+    if len(user.outgoing) == 0 and user.remove_after_sending is True:
+        remove_client(current_socket)
+    else:
+        update_selector(current_socket, user)
+
+
+# Receives a socket that got its first queued message, and adds it to the sockets written at the end of the iteration
+# of the loop (or when the flush delay passes).
+def schedule_flush(current_socket):
+    global flush_deadline
+    if len(pending_flush) == 0 and flush_delay > 0:
+        flush_deadline = time.monotonic() + flush_delay
+    pending_flush[current_socket] = None
+
+
+# Writes the queues of the sockets that got messages since the last flush, each of them in as few sendmsg() calls as
+# possible. The sockets whose queue isn't fully written are watched for writing.
+def flush_pending():
+    global flush_deadline
+    flush_deadline = None
+    while len(pending_flush) != 0:  # Removing a client while flushing may queue messages to other clients.
+        current_socket = pending_flush.popitem()[0]
+        if current_socket in users_dict:
+            send_and_remove(current_socket)
+
+
+# Receives the socket of a new client (or the socket of its asyncio transport), and sets its TCP options.
+def set_socket_options(client_socket):
+    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 if tcp_nodelay is True else 0)
+
+
+# Receives a socket and its user, and watches the socket for reading unless reading from it is paused, and for writing
+# if there are messages waiting to be sent to it.
+def update_selector(current_socket, user):
+    events = 0
+    if user.input_paused is False:
+        events |= selectors.EVENT_READ
+    if len(user.outgoing) != 0:
+        events |= selectors.EVENT_WRITE
+    selector.modify(current_socket, events)
+
+
+# Receives the socket of a client that received a remove message, closes it and removes the client from the lists of
+# users and sockets.
+def remove_client(current_socket):
+    close_client_socket(current_socket)
+    unregister_user(current_socket)
+
+
+"""
+Receives a socket (or an AsyncClient) and an encoded message (bytes, or an EncodedMessage that is encoded in the 
+protocol version of the user), and adds the message to the end of the queue of the user. When the queue gets its 
+first message, the socket is added to the sockets written at the end of the iteration (or, with the "writable" flush 
+policy, registered for writing too - a socket is writable almost all the time, so it's watched for writing only while 
+it has something to send), or the writer coroutine is woken.
+When the queue passes the high water mark, handles the client according to the slow client policy.
+Messages to a user that is being removed from the chat or disconnected are dropped.
+"""
+def add_to_queue(current_socket, data):
+    user = users_dict[current_socket]
+    if user.remove_after_sending is True or user.overflowed is True:
+        return
+    if isinstance(data, EncodedMessage):
+        data = data.frame(user.protocol_version, user.compression)
+    if len(user.outgoing) == 0:
+        user.outgoing = collections.deque()
+    user.outgoing.append(data)
+    user.queued_bytes += len(data)
+    if user.queued_bytes > high_water_mark:
+        if slow_client_policy == "disconnect" or user.queued_bytes > 2 * high_water_mark:
+            user.overflowed = True
+            overflowed_clients.append(current_socket)
+        elif user.input_paused is False:
+            pause_reading(current_socket, user)
+    if isinstance(current_socket, AsyncClient):
+        current_socket.output_ready.set()
+    elif len(user.outgoing) == 1:
+        if flush_policy == "tick":
+            schedule_flush(current_socket)
+        else:
+            update_selector(current_socket, user)
+
+
+# Receives a socket (or an AsyncClient) and its user, and stops reading from the client until its queue gets shorter.
+def pause_reading(current_socket, user):
+    user.input_paused = True
+    if isinstance(current_socket, AsyncClient):
+        current_socket.input_resumed.clear()
+    else:
+        update_selector(current_socket, user)
+
+
+# Receives an AsyncClient whose queue has been written, and continues reading from it.
+def resume_reading(client):
+    users_dict[client].input_paused = False
+    client.input_resumed.set()
+
+
+# Receives a client socket, stops watching it in the selector (if it's watched there) and closes it.
+def close_client_socket(current_socket):
+    if not isinstance(current_socket, AsyncClient):
+        selector.unregister(current_socket)
+    current_socket.close()
+
+
+# Returns a string of the time in format: hours:minuts, and a space after it. The string is made once per second and
+# reused by all the messages of that second.
+def str_time():
+    global time_string_second, time_string
+    second = int(time.time())
+    if second != time_string_second:
+        time_string_second = second
+        time_string = time.strftime("%H:%M", time.localtime(second)) + " "
+    return time_string
+
+"""
+Handles situations in which a certain type of data is received. It can be a connection request, a regular message 
+or disconnection request.
+Receives the socket of the client, receives the data from it and handles it.
+"""
+def handle_incoming_data(send_socket):
+    # Connection request, received by the server's socket.
+    if send_socket is server_socket:
+        handle_connection_request()
+        return
+    # A signal, received by the wakeup socket.
+    if send_socket is wakeup_socket:
+        wakeup_socket.recv(MAX_BYTES)
+        return
+    # Events of other workers, received by the bus socket.
+    if bus is not None and send_socket is bus.socket:
+        handle_bus_events()
+        return
+    # A connection to the metrics port, or its request.
+    if send_socket is metrics_socket:
+        serve_metrics()
+        return
+    if send_socket in metrics_connections:
+        read_metrics_request(send_socket)
+        return
+    # A new server that takes over.
+    if send_socket is handoff_socket:
+        hand_off()
+        return
+    # Regular or Disconnection message, received with the client's socket.
+    try:
+        data = send_socket.recv(MAX_BYTES)
+    except BlockingIOError:
+        return
+    except ConnectionResetError:  # If the user closes the program of the client.
+        handle_disconnection(send_socket)
+        return
+    if data == b"":  # When the socket of the client is being closed, an "empty message" is received.
+        handle_disconnection(send_socket)
+        return
+    handle_received_bytes(send_socket, data)
+
+
+"""
+Receives the socket of the client and a piece of data (bytes) it sent. Handles every frame completed by the data, in 
+the order they were sent (a client may send several commands without waiting for an answer).
+If the data doesn't match the protocol, the client is disconnected.
+"""
+def handle_received_bytes(send_socket, data):
+    user = users_dict[send_socket]
+    user.last_received = time.monotonic()
+    user.ping_sent = False
+    frame_reader = user.frame_reader
+    if metrics is not None:
+        metrics.bytes_in.inc(len(data))
+    for details in frame_reader.feed(data):
+        receive_frame(send_socket, user, details)
+        if send_socket not in users_dict:  # The user has left the chat.
+            return
+    if frame_reader.invalid is True:
+        ServerLog.log(str_time() + "A client sent data that doesn't match the protocol.", ServerLog.WARNING)
+        handle_disconnection(send_socket)
+
+
+# Receives the socket of the client, its user and the details of a frame it sent. A message for the filters, and every
+# frame after it, waits until the filters finish - the other frames are handled right away.
+def receive_frame(send_socket, user, details):
+    if len(user.held_frames) != 0 or is_filtered(user, details) is True:
+        hold_frame(send_socket, user, details)
+    else:
+        handle_frame(send_socket, details)
+
+
+# Receives the socket of the client and the details of a frame it sent, and handles the frame (measured in the
+# metrics, if they are enabled).
+def handle_frame(send_socket, details):
+    if metrics is None:
+        handle_data(send_socket, details)
+    else:
+        handle_measured_data(send_socket, details)
+    # If there are rooms without managers (if the chat just opened or if the last manager left a room). A client that
+    # repeats its name in every command is appointed after its first command, which comes right after its login.
+    if (len(unmanaged_rooms) != 0 and send_socket in users_dict and
+            (users_dict[send_socket].frame_reader.names_in_frames is False or details[0] != LOGIN)):
+        appoint_managers()
+
+
+"""
+Receives the socket of the client and the details of a frame it sent (as returned by FrameReader.feed), executes 
+the requested command, if needed (for example, adds a user to the managers).
+According to the protocol, prepares the message to be sent to the recipients.
+"""
+def handle_data(send_socket, details):
+    # Basic messages, without name and other details.
+    if details == HELLO:
+        handle_hello(send_socket)
+        return
+    if details == QUIT:
+        handle_disconnection(send_socket)
+        return
+    if details == PONG:  # The time the data was received has already been saved.
+        return
+    if details == VIEW_MANAGERS:
+        prepare_managers_message(send_socket)
+        return
+    if details == LEAVE_ROOM:
+        handle_leave_room(send_socket)
+        return
+    if details == VIEW_ROOMS:
+        prepare_rooms_message(send_socket)
+        return
+    if details == PRESENCE:
+        subscribe_presence(send_socket)
+        return
+
+    # Registers the name of the user, once. The commands after it don't contain the name.
+    if details[0] == LOGIN:
+        set_user_name(send_socket, details[1])
+        return
+    if details[0] == JOIN_ROOM:
+        handle_join_room(send_socket, details[1])
+        return
+    if details[0] == COMPRESSION:
+        users_dict[send_socket].compression = details[1] == ProtocolV2.ZLIB
+        return
+
+    # Commands 1-5 - data with more details.
+    send_name = users_dict[send_socket].name
+    command = details[0]
+
+    # Command 1 - a chat message (checks the message isn't empty. If it is - the users won't get any message)
+    if command == CHAT_MESSAGE:
+        handle_chat_message(send_socket, send_name, details[1])
+        return
+    if command == HISTORY:  # Command 9 - a request for messages from the history
+        handle_history(send_socket, details[1], details[2])
+        return
+
+    # Commands 2-5 - involves two sockets.
+    target_name = details[1]
+    target_socket = socket_by_name(send_socket, send_name, target_name)
+    if command == APPOINT_MANAGER:  # Command 2 - appoint manager
+        handle_appoint_manager(send_socket, send_name, target_socket, target_name)
+        return
+    if command == REMOVE_FROM_CHAT:  # Command 3 - remove (disconnect) a user from the chat
+        handle_remove(send_socket, send_name, target_socket, target_name)
+        return
+    if command == SILENCE_USER:  # Command 4 - silence a user.
+        handle_silence_user(send_socket, send_name, target_socket, target_name)
+        return
+    if command == PRIVATE_MESSAGE:  # Command 5 - a private message
+        message = details[2]
+        handle_private_message(send_socket, send_name, target_socket, target_name, message)
+
+
+# Receives the socket of the client and the details of a frame it sent, handles the frame and measures it in the
+# metrics (the number of frames and the time of handling them, by command).
+def handle_measured_data(send_socket, details):
+    if type(details) is str:  # Basic messages, without details.
+        command_name = details
+    elif type(details[0]) is str:  # Login and join-room.
+        command_name = details[0]
+    else:
+        command_name = COMMAND_NAMES[details[0]]
+    start = time.perf_counter()
+    handle_data(send_socket, details)
+    metrics.handle_time.observe(time.perf_counter() - start, command_name)
+    metrics.frames_in.inc(1, command_name)
+
+
+# Starts the pool of the filters, if there are filters. Receives the event loop of the asyncio engine (None for the
+# selectors engine), which is woken when the filters of a message finish.
+def start_filters(loop=None):
+    global filter_pool, filter_wakeup, async_loop
+    if filter_settings is None:
+        return
+    if filter_pool_kind == "process":
+        # The processes are spawned (started as new interpreters), since a forked process would get a copy of every
+        # socket of the server, and a client socket closed by the server would stay open in it.
+        filter_pool = multiprocessing.get_context("spawn").Pool(filter_workers, MessageFilters.start_worker,
+                                                                (filter_settings,))
+    else:
+        MessageFilters.configure(filter_settings)
+        filter_pool = multiprocessing.pool.ThreadPool(filter_workers)
+    async_loop = loop
+    filter_wakeup = wake_selector if loop is None else wake_async_loop
+
+
+# Stops the pool of the filters when the server shuts down (its processes are terminated, even in the middle of a slow
+# filter). The messages that are being checked are dropped, with the frames their senders sent after them.
+def stop_filters():
+    global filter_pool, filters_in_flight
+    if filter_pool is None:
+        return
+    held_frames = sum(len(user.held_frames) for user in users_dict.values())
+    if held_frames != 0:
+        ServerLog.log(str_time() + str(held_frames) + " frames that waited for the filters were dropped.",
+                      ServerLog.WARNING)
+    for user in users_dict.values():
+        user.held_frames = NO_MESSAGES
+    filtering.clear()
+    filter_pool.terminate()
+    filter_pool = None
+    finished_filters.clear()
+    filters_in_flight = 0
+
+
+# Receives a user and the details of a frame he sent, and returns whether or not the frame should be checked by the
+# filters: a chat or private message, while there are filters (the messages of a silenced user are dropped anyway).
+def is_filtered(user, details):
+    return (filter_pool is not None and type(details) is tuple and details[0] in FILTERED_COMMANDS and
+            user.is_silenced is False and (details[0] != PRIVATE_MESSAGE or is_silenced_in_chat(user) is False))
+
+
+# Receives the socket of a client, its user and the details of a frame that can't be handled yet - a message for the
+# filters (which is sent to the pool), or a frame sent after one. Holds the frame until the frames before it are done.
+def hold_frame(send_socket, user, details):
+    if user.held_frames is NO_MESSAGES:
+        user.held_frames = collections.deque()
+    if is_filtered(user, details) is True:
+        details = submit_filtered(send_socket, user, details)
+    user.held_frames.append(details)
+    release_held_frames(send_socket)  # The message may have got the fallback verdict right away.
+
+
+"""
+Receives the socket of a client, its user and the details of its chat or private message. Sends the text of the 
+message to the pool of the filters, and returns the FilteredMessage. A message beyond the rate limits isn't sent to 
+the pool (it gets the verdict THROTTLED). If filter_max_pending messages are already in the pool (or the pool is 
+broken), the message isn't sent to it, and gets the fallback verdict right away.
+"""
+def submit_filtered(send_socket, user, details):
+    global filters_in_flight
+    filtered = FilteredMessage(send_socket, details)
+    if rate_limited is True:
+        if is_within_rate_limits(user, details[-1]) is False:
+            filtered.verdict = THROTTLED
+            return filtered
+        user.rate_limit_notified = False
+    if filters_in_flight >= filter_max_pending:
+        decide_filtered(filtered, filter_fallback, "overflow", FILTERS_BUSY)
+        return filtered
+    try:
+        filtered.result = filter_pool.apply_async(MessageFilters.run_pipeline, (details[-1],),
+                                                  callback=lambda result: finish_filtered(filtered),
+                                                  error_callback=lambda error: finish_filtered(filtered))
+    except ValueError:  # The pool isn't running.
+        ServerLog.log(str_time() + "The pool of the filters isn't running.", ServerLog.WARNING)
+        decide_filtered(filtered, filter_fallback, "error", FILTERS_BUSY)
+        return filtered
+    filters_in_flight += 1
+    filtering.append(filtered)
+    if async_loop is not None:  # The deadline of the filters (the selectors engine waits for it in loop_timeout).
+        async_loop.call_later(filter_timeout, handle_async_filter_results)
+    return filtered
+
+
+# Called in the result thread of the pool when the filters of a message finish. Passes the message to the loop and
+# wakes it.
+def finish_filtered(filtered):
+    finished_filters.append(filtered)
+    filter_wakeup()
+
+
+# Wakes the selector from a thread of the pool, through the wakeup socket (see watch_shutdown_signals). If the socket
+# is full, the selector is going to wake anyway.
+def wake_selector():
+    try:
+        wakeup_writer.send(b"\0")
+    except OSError:
+        pass
+
+
+# Wakes the asyncio engine from a thread of the pool, to handle the results of the filters.
+def wake_async_loop():
+    try:
+        async_loop.call_soon_threadsafe(handle_async_filter_results)
+    except RuntimeError:  # The event loop has been closed - the server has shut down.
+        pass
+
+
+"""
+Handles the results of the filters: the messages whose filters finished, and the messages whose filters didn't finish 
+within filter_timeout (they get the fallback verdict). Then handles the frames of their senders that are ready, in the 
+order they were sent.
+"""
+def handle_filter_results():
+    senders = []
+    global filters_in_flight
+    while len(finished_filters) != 0:
+        filtered = finished_filters.popleft()
+        filters_in_flight -= 1  # Its place in the pool is free only now, even if it got the fallback verdict before.
+        if filtered.verdict is not None:  # It got the fallback verdict before its filters finished.
+            continue
+        try:
+            verdict, reason = filtered.result.get()
+        except Exception:  # A filter failed in the pool.
+            decide_filtered(filtered, filter_fallback, "error", FILTERS_BUSY)
+        else:
+            if verdict == MessageFilters.TIMEOUT:
+                ServerLog.log(str_time() + "The filter " + reason + " took longer than its timeout.", ServerLog.DEBUG)
+                decide_filtered(filtered, filter_fallback, MessageFilters.TIMEOUT, FILTERS_BUSY)
+            else:
+                decide_filtered(filtered, verdict, verdict, reason)
+        senders.append(filtered.send_socket)
+    now = time.monotonic()
+    # The messages were sent to the pool in order, so the ones whose time passed are at the beginning.
+    while len(filtering) != 0 and (filtering[0].verdict is not None or
+                                   filtering[0].submitted_at + filter_timeout <= now):
+        filtered = filtering.popleft()
+        if filtered.verdict is None:  # Its result is ignored when the filters finish.
+            decide_filtered(filtered, filter_fallback, MessageFilters.TIMEOUT, FILTERS_BUSY)
+            senders.append(filtered.send_socket)
+    for send_socket in senders:
+        release_held_frames(send_socket)
+
+
+# Handles the results of the filters in the asyncio engine (see handle_filter_results).
+def handle_async_filter_results():
+    handle_filter_results()
+    after_async_event()
+
+
+# Receives a FilteredMessage, its verdict, the result counted in the metrics (the verdict, or why the message got the
+# fallback verdict) and the reason to tell the sender if it's rejected. Saves the verdict.
+def decide_filtered(filtered, verdict, result, reason):
+    filtered.verdict = verdict
+    filtered.reason = reason
+    if metrics is not None:
+        metrics.filtered_messages.inc(1, result)
+        metrics.filter_time.observe(time.monotonic() - filtered.submitted_at)
+
+
+# Receives the socket of a client, and handles its held frames that are ready, in the order they were sent - until a
+# message whose filters haven't finished (or until the user leaves the chat).
+def release_held_frames(send_socket):
+    global rate_checked
+    while send_socket in users_dict:
+        user = users_dict[send_socket]
+        if len(user.held_frames) == 0:
+            return
+        details = user.held_frames[0]
+        if type(details) is FilteredMessage and details.verdict is None:
+            return
+        user.held_frames.popleft()
+        if len(user.held_frames) == 0:
+            user.held_frames = NO_MESSAGES
+        if type(details) is not FilteredMessage:
+            handle_frame(send_socket, details)
+        elif details.verdict == MessageFilters.PASS:
+            rate_checked = True
+            handle_frame(send_socket, details.details)
+            rate_checked = False
+        elif details.verdict == THROTTLED:
+            notify_throttled(send_socket, user.name)
+        else:
+            notify_filtered(send_socket, details)
+
+
+# Receives the socket of a user whose message was rejected by the filters (or got the fallback verdict reject) and the
+# FilteredMessage, and tells him why it wasn't sent.
+def notify_filtered(send_socket, filtered):
+    prepare_message_for_sending("Your message wasn't sent because " + filtered.reason, [send_socket])
+    ServerLog.log(str_time() + "A message of " + str(users_dict[send_socket].name) + " was rejected by the filters.")
+
+
+# Receives the socket of a client that sent a hello message. Answers with the version of the protocol that was chosen
+# for the client, and sends the next messages to the client in this version.
+def handle_hello(send_socket):
+    user = users_dict[send_socket]
+    add_to_queue(send_socket, ProtocolV2.hello(user.frame_reader.protocol_version))
+    user.protocol_version = user.frame_reader.protocol_version
+    schedule_connection_check(send_socket, user)  # Clients of version 2 are sent pings.
+
+
+"""
+Receives the socket of a client that asked for messages from the history, the number of messages and a sequence 
+number (strings). If the sequence number is empty, sends the client the last messages in the history, otherwise the 
+messages after the sequence number (for a client that reconnects), from the oldest. At most MAX_HISTORY_MESSAGES 
+messages are sent for one request.
+"""
+def handle_history(send_socket, count, since):
+    if history is None:
+        prepare_message_for_sending(str_time() + "The history of the chat isn't saved.", [send_socket])
+        return
+    if not count.isdigit() or not (since == "" or since.isdigit()):
+        prepare_message_for_sending(str_time() + "Invalid history request.", [send_socket])
+        return
+    count = min(int(count), MAX_HISTORY_MESSAGES)
+    if since == "":
+        messages = history.last(count)
+    else:
+        messages = history.since(int(since), count)
+    for sequence, message_time, kind, text in messages:
+        add_to_queue(send_socket, EncodedMessage(text, sequence))
+    if metrics is not None:
+        metrics.frames_out.inc(len(messages))
+
+
+# Receives the sending socket and prepares a message of the list of managers of the user's room (at most
+# MAX_LISTED_MANAGERS of them, sorted by their names) for this socket. Adds it to the list of messages to send.
+def prepare_managers_message(send_socket):
+    room_managers = users_dict[send_socket].room.managers
+    if len(room_managers) == 0:
+        to_send = str_time() + " No managers yet"
+        prepare_message_for_sending(to_send, [send_socket])
+        return
+
+    to_send = str_time() + "The manager/s of the chat is/are: "
+    manager_names = sorted(users_dict[manager_socket].name for manager_socket in room_managers)
+    # In case the user that sent view-managers is a manager.
+    if send_socket in room_managers:
+        to_send += "\nYou"
+        manager_names.remove(users_dict[send_socket].name)
+    for name in itertools.islice(manager_names, MAX_LISTED_MANAGERS):
+        to_send += "\n" + name
+    if len(manager_names) > MAX_LISTED_MANAGERS:
+        to_send += "\nand " + str(len(manager_names) - MAX_LISTED_MANAGERS) + " more managers"
+    prepare_message_for_sending(to_send, [send_socket])
+
+
+# Receives the sending socket and prepares a message of the list of rooms (at most MAX_LISTED_ROOMS of them) and the
+# number of users in every room for this socket.
+def prepare_rooms_message(send_socket):
+    to_send = str_time() + "You're in the room " + users_dict[send_socket].room.name + ". The rooms of the chat are: "
+    for room in itertools.islice(rooms.values(), MAX_LISTED_ROOMS):
+        to_send += "\n" + room.name + " (" + str(len(room.members)) + ")"
+    if len(rooms) > MAX_LISTED_ROOMS:
+        to_send += "\nand " + str(len(rooms) - MAX_LISTED_ROOMS) + " more rooms"
+    prepare_message_for_sending(to_send, [send_socket])
+
+
+# Receives the socket of a client that subscribed to the presence, and sends it the pages of the snapshot of the roster
+# (shared by all the subscribers of the same version). From then on it gets every change of the roster (see
+# update_presence). A client that subscribes again gets the snapshot again.
+def subscribe_presence(send_socket):
+    presence_subscribers[send_socket] = collections.deque(roster.snapshot())
+    feed_presence(send_socket)
+
+
+# Receives the socket of a subscriber of the presence, and adds the frames waiting for it (the pages of the snapshot
+# and the deltas after them) to its queue while the queue is shorter than half the high water mark, so a big roster
+# doesn't overflow it. The rest are added as the queue is written (see send_and_remove and write_messages).
+def feed_presence(current_socket):
+    user = users_dict[current_socket]
+    backlog = presence_subscribers[current_socket]
+    while len(backlog) != 0 and (len(user.outgoing) == 0 or
+                                 user.queued_bytes + len(backlog[0]) <= high_water_mark // 2):
+        add_to_queue(current_socket, backlog.popleft())
+        if metrics is not None:
+            metrics.frames_out.inc()
+    if len(backlog) == 0:
+        presence_subscribers[current_socket] = NO_MESSAGES
+
+
+# Receives the socket of a user (or a RemoteConnection) whose name, room or flags may have changed, and updates his
+# entry in the roster. The users who didn't log in aren't in the roster.
+def update_presence(current_socket):
+    user = users_dict[current_socket]
+    if user.name is None:
+        return
+    flags = 0
+    if user.is_manager is True:
+        flags |= Presence.MANAGER
+    if user.is_silenced is True:
+        flags |= Presence.SILENCED
+    send_presence_delta(roster.update(current_socket, user.name, user.room.name, flags))
+
+
+# Receives the socket of a user who left the chat, and removes him from the roster.
+def remove_presence(current_socket):
+    send_presence_delta(roster.remove(current_socket))
+
+
+# Receives the PRESENCE_DELTA frame of a change of the roster (or None if nothing changed), and adds it to the queues
+# of all the subscribers (the same bytes object for all of them). A subscriber who hasn't got the whole snapshot yet
+# gets it after the snapshot.
+def send_presence_delta(delta):
+    if delta is None or len(presence_subscribers) == 0:
+        return
+    sent = 0
+    for subscriber, backlog in presence_subscribers.items():
+        if len(backlog) == 0:
+            add_to_queue(subscriber, delta)
+            sent += 1
+        else:
+            backlog.append(delta)
+    if metrics is not None:
+        metrics.frames_out.inc(sent)
+
+
+"""
+Receives the message to send, a list of sockets that should receive the message, and a boolean argument - 
+whether or not the message is a removal message, and the recipient should be removed after the message has sent 
+(optional, by default False). Prepares the message to the format it should be sent in according to the protocol, 
+and adds it to the queues of the recipients. 
+"""
+def prepare_message_for_sending(to_send, recv_sockets, remove_recipient=False):
+    data = EncodedMessage(to_send)
+    for current_socket in recv_sockets:
+        if isinstance(current_socket, RemoteConnection):
+            publish_event({"type": "deliver", "key": current_socket.key, "message": to_send, "remove": remove_recipient})
+            continue
+        add_to_queue(current_socket, data)
+        if metrics is not None:
+            metrics.frames_out.inc()
+        if remove_recipient is True:
+            users_dict[current_socket].remove_after_sending = True
+
+
+"""
+Receives the message to send to all the users in a room, the room, a list of sockets that shouldn't receive it 
+(optional) and the kind of the message in the history of the chat (optional, by default it isn't saved there - only 
+the messages of the main room are saved). Prepares the message to the format it should be sent in according to the 
+protocol once, and adds the same bytes object to the queue of every member of the room, so the cost depends on the 
+size of the room only.
+In the multi-process mode, the message is passed once to the other workers, and each of them sends it to its users.
+"""
+def prepare_broadcast_message(to_send, room, excluded_sockets=(), history_kind=None):
+    sequence = None
+    if history is not None and history_kind is not None and room is main_room:
+        sequence = save_in_history(history_kind, to_send)
+    data = EncodedMessage(to_send, sequence)
+    recipients = 0
+    for current_socket in room.members:
+        if current_socket not in excluded_sockets and not isinstance(current_socket, RemoteConnection):
+            add_to_queue(current_socket, data)
+            recipients += 1
+    if metrics is not None:
+        count_broadcast(recipients)
+    if bus is not None:
+        excluded_keys = [connection_key(current_socket) for current_socket in excluded_sockets]
+        publish_event({"type": "broadcast", "room": room.name, "message": to_send, "excluded": excluded_keys})
+
+
+# Receives the number of the users of this worker that a broadcast message was added to (counted while it's added to
+# their queues), and counts them in the metrics.
+def count_broadcast(recipients):
+    metrics.fan_out.observe(recipients)
+    metrics.frames_out.inc(recipients)
+
+
+"""
+Receives the kind of a message and its text, adds it to the history and returns its sequence number. The messages are
+written to the disk together (group commit): at the end of the iteration of the selectors engine, or in the asyncio
+engine, after the callbacks that are ready to run.
+"""
+def save_in_history(kind, to_send):
+    if history.dirty is False:
+        try:
+            asyncio.get_running_loop().call_soon(history.commit)
+        except RuntimeError:  # The selectors engine, there is no running loop.
+            pass
+    return history.append(kind, to_send)
+
+
+# Receives a message and returns it in the format it should be sent in according to the protocol, encoded (the length
+# and the message are encoded together).
+def encode_message(to_send):
+    return (str(len(to_send)).zfill(LENGTH_DIGITS) + to_send).encode()
+
+
+"""
+Handles situations in which the incoming data is a connection request.
+Accepts the new socket, watches it in the selector and adds the client.
+"""
+def handle_connection_request():
+    ServerLog.log("Accepting a client.")
+    (new_socket, address) = server_socket.accept()
+    new_socket.setblocking(False)
+    set_socket_options(new_socket)
+    selector.register(new_socket, selectors.EVENT_READ)
+    add_client(new_socket)
+
+
+"""
+Receives the socket of a new client (or an AsyncClient), adds the user to the dictionary and to the main room, creates 
+the message to send to all the other users in the main room and adds it to the list of messages to send.
+"""
+def add_client(new_socket):
+    user = User()
+    users_dict[new_socket] = user
+    enter_room(new_socket, user, main_room)
+    schedule_connection_check(new_socket, user)
+    if metrics is not None:
+        metrics.connections.inc()
+    if bus is not None:
+        key = str(worker_number) + ":" + str(next(connection_numbers))
+        connection_keys[new_socket] = key
+        connections_by_key[key] = new_socket
+    to_send = str_time() + "Someone joined the chat"
+    ServerLog.log(to_send)
+    prepare_broadcast_message(to_send, main_room, [new_socket], ChatHistory.PRESENCE)
+
+
+"""
+Handles situations in which the incoming data is a disconnection request, or when the clients socket forcibly closed.
+Receives the sending socke. Disconnects it and removes it.
+Creates the message to send to all the other users in his room and adds it to the list of messages to send.
+"""
+def handle_disconnection(send_socket):
+    user_name = users_dict[send_socket].name
+    room = users_dict[send_socket].room
+    to_send = ""
+    if user_name is None:
+        to_send = str_time() + "Someone left the chat"
+        ServerLog.log(to_send)
+    else:
+        if users_dict[send_socket].is_manager is True:
+            to_send = str_time() + MANAGER_SYMBOL + user_name + " left the chat"
+            ServerLog.log(to_send)
+        else:
+            to_send = str_time() + user_name + " left the chat"
+            ServerLog.log(to_send)
+    close_client_socket(send_socket)
+    unregister_user(send_socket)
+    prepare_broadcast_message(to_send, room, history_kind=ChatHistory.PRESENCE)
+
+
+# Receives the socket of a user that sent his name for the first time and the name, and adds the socket to the index
+# of names. If the user had a name before, removes the socket from the old name first.
+def set_user_name(current_socket, name):
+    user = users_dict[current_socket]
+    if user.name is not None:
+        remove_from_names_index(current_socket, user.name)
+    user.name = name
+    sockets_by_name.setdefault(name, []).append(current_socket)
+    if len(user.room.managers) == 0:
+        unmanaged_rooms.add(user.room)
+    update_presence(current_socket)
+    if not isinstance(current_socket, RemoteConnection):
+        publish_event({"type": "name", "key": connection_key(current_socket), "name": name})
+
+
+# Receives a name a client wants to log in with, and returns whether or not it's valid (the same checks the client
+# does before connecting).
+def is_valid_name(name):
+    return 0 < len(name) <= MAX_NAME_LENGTH and name[0] != MANAGER_SYMBOL and " " not in name
+
+
+# Receives a socket and the name it's listed under in the index of names, and removes it from there.
+def remove_from_names_index(current_socket, name):
+    name_sockets = sockets_by_name[name]
+    name_sockets.remove(current_socket)
+    if len(name_sockets) == 0:
+        del sockets_by_name[name]
+        name_buckets.pop(name, None)
+
+
+# Receives the socket of a user that left the chat (or has been removed from it), and removes the user from the
+# dictionary of users, the roster, the index of names, his room and the rooms he's silenced in.
+def unregister_user(current_socket):
+    user = users_dict.pop(current_socket)
+    presence_subscribers.pop(current_socket, None)
+    remove_presence(current_socket)
+    if user.name is not None:
+        remove_from_names_index(current_socket, user.name)
+    leave_room(current_socket, user)
+    for room in user.silenced_rooms:
+        room.silenced.discard(current_socket)
+        if len(room.silenced) == 0 and removed_rooms.get(room.name) is room:
+            del removed_rooms[room.name]
+    if bus is not None:
+        key = connection_key(current_socket)
+        del connections_by_key[key]
+        if not isinstance(current_socket, RemoteConnection):
+            del connection_keys[current_socket]
+            publish_event({"type": "left", "key": key})
+
+
+# Receives the socket of a user and appoints him as a manager of his room.
+def mark_manager(current_socket):
+    user = users_dict[current_socket]
+    user.is_manager = True
+    user.room.managers.add(current_socket)
+    update_presence(current_socket)
+    publish_event({"type": "manager", "key": connection_key(current_socket), "room": user.room.name})
+
+
+# Receives the socket of a user and silences him in his room.
+def mark_silenced(current_socket):
+    user = users_dict[current_socket]
+    user.is_silenced = True
+    user.room.silenced.add(current_socket)
+    user.silenced_rooms = user.silenced_rooms | {user.room}
+    update_presence(current_socket)
+    publish_event({"type": "silence", "key": connection_key(current_socket), "room": user.room.name})
+
+
+# Receives the name of a room and returns the room, after creating it (or restoring it, see removed_rooms) if it
+# doesn't exist.
+def get_room(room_name):
+    room = rooms.get(room_name)
+    if room is None:
+        room = removed_rooms.pop(room_name, None)
+        if room is None:
+            room = Room(room_name)
+        rooms[room_name] = room
+    return room
+
+
+# Receives a room that has no members (except the main room), and removes it. If users that are still in the chat
+# were silenced in it, it's kept in removed_rooms.
+def remove_room(room):
+    del rooms[room.name]
+    unmanaged_rooms.discard(room)
+    if len(room.silenced) != 0:
+        removed_rooms[room.name] = room
+
+
+# Receives a socket, its user and a room, and adds the user to the members of the room (and updates his roster entry).
+# If the room has no managers, it's checked for a user to appoint.
+def enter_room(current_socket, user, room):
+    user.room = room
+    user.is_silenced = current_socket in room.silenced
+    room.members[current_socket] = None
+    if user.name is not None and len(room.managers) == 0:
+        unmanaged_rooms.add(room)
+    update_presence(current_socket)
+
+
+# Receives a socket and its user, and removes the user from the members and the managers of his room. A room that
+# loses its last manager is checked for a user to appoint, and a room that loses its last member is removed (except
+# the main room).
+def leave_room(current_socket, user):
+    room = user.room
+    del room.members[current_socket]
+    user.is_manager = False
+    if current_socket in room.managers:
+        room.managers.remove(current_socket)
+        if len(room.managers) == 0:
+            unmanaged_rooms.add(room)
+    if len(room.members) == 0 and room is not main_room:
+        remove_room(room)
+
+
+"""
+Receives the socket of a user, the name of a room and whether or not to tell the members of his current room that he 
+left it (optional, by default True). Moves the user to the room (it's created if it doesn't exist), tells him and 
+the members of the room about it.
+In the multi-process mode, the other workers move the user too.
+"""
+def move_to_room(current_socket, room_name, announce_leaving=True):
+    user = users_dict[current_socket]
+    old_room = user.room
+    display_name = user.name
+    if user.is_manager is True:
+        display_name = MANAGER_SYMBOL + user.name
+    leave_room(current_socket, user)
+    room = get_room(room_name)
+    enter_room(current_socket, user, room)
+    publish_event({"type": "join", "key": connection_key(current_socket), "room": room_name})
+    if announce_leaving is True:
+        prepare_broadcast_message(str_time() + display_name + " left the room", old_room,
+                                  history_kind=ChatHistory.PRESENCE)
+    to_send1 = str_time() + "You joined the room " + room_name + " (" + str(len(room.members)) + " users)."
+    prepare_message_for_sending(to_send1, [current_socket])
+    to_send2 = str_time() + user.name + " joined the room"
+    prepare_broadcast_message(to_send2, room, [current_socket], ChatHistory.PRESENCE)
+    ServerLog.log(str_time() + user.name + " moved from the room " + old_room.name + " to the room " + room_name)
+
+
+# Receives a socket of this worker or a RemoteConnection, and returns the key of the connection.
+def connection_key(current_socket):
+    if isinstance(current_socket, RemoteConnection):
+        return current_socket.key
+    return connection_keys.get(current_socket)
+
+
+# Receives an event (dictionary) and passes it to the other workers, in the multi-process mode.
+def publish_event(event):
+    if bus is None:
+        return
+    if len(bus.outgoing) == 0:
+        bus.send_event(event)
+        if not bus.flush():
+            selector.modify(bus.socket, selectors.EVENT_READ | selectors.EVENT_WRITE)
+    else:
+        bus.send_event(event)
+
+
+"""
+Handles the events received from the other workers over the bus: creates, updates and removes the RemoteConnection 
+objects of their users, moves users between rooms, and sends their messages to the users of this worker.
+"""
+def handle_bus_events():
+    events = bus.receive_events()
+    if events is None:  # The main process has exited.
+        raise SystemExit("The hub of the workers has exited.")
+    for event in events:
+        event_type = event["type"]
+        if event_type == "broadcast":
+            room = rooms.get(event["room"])
+            if room is None:  # The room has been removed (its last user has left).
+                continue
+            data = EncodedMessage(event["message"])
+            excluded_sockets = [connections_by_key.get(key) for key in event["excluded"]]
+            recipients = 0
+            for current_socket in room.members:
+                if current_socket not in excluded_sockets and not isinstance(current_socket, RemoteConnection):
+                    add_to_queue(current_socket, data)
+                    recipients += 1
+            if metrics is not None:
+                count_broadcast(recipients)
+        elif event_type == "worker-down":
+            prefix = str(event["worker"]) + ":"
+            for key in [key for key in connections_by_key if key.startswith(prefix)]:
+                unregister_user(connections_by_key[key])
+        elif event_type == "name":
+            remote = RemoteConnection(event["key"])
+            user = User()
+            users_dict[remote] = user
+            connections_by_key[remote.key] = remote
+            enter_room(remote, user, main_room)
+            set_user_name(remote, event["name"])
+        else:
+            current_socket = connections_by_key.get(event["key"])
+            if current_socket is None:  # The user has already left.
+                continue
+            if event_type == "deliver":
+                if isinstance(current_socket, RemoteConnection):  # The user is connected to another worker.
+                    continue
+                prepare_message_for_sending(event["message"], [current_socket], event["remove"])
+            elif event_type == "manager":
+                user = users_dict[current_socket]
+                if user.room.name == event["room"]:  # The user may have moved to another room since.
+                    user.is_manager = True
+                    user.room.managers.add(current_socket)
+                    update_presence(current_socket)
+            elif event_type == "silence":
+                user = users_dict[current_socket]
+                room = rooms.get(event["room"])
+                if room is not None:
+                    room.silenced.add(current_socket)
+                    user.silenced_rooms = user.silenced_rooms | {room}
+                    if user.room is room:
+                        user.is_silenced = True
+                        update_presence(current_socket)
+            elif event_type == "join":
+                user = users_dict[current_socket]
+                leave_room(current_socket, user)
+                enter_room(current_socket, user, get_room(event["room"]))
+            elif event_type == "left":
+                unregister_user(current_socket)
+
+
+"""
+Receives the socket and the name of the sending user, and the name of the target user and returns his socket.
+If there is a user with that name, returns his socket, if not returns None.
+***If the target user and the sending user has the same name, compares between the sockets and if they'r not the same,
+returns the socket. If there is only one socket related to the common name, returns that socket (the socket of the 
+sending user). 
+The sockets are found in the index of names, so only the users with the target name are checked.
+"""
+def socket_by_name(send_socket, send_name, target_name):
+    name_sockets = sockets_by_name.get(target_name, [])
+    if send_name == target_name:
+        for curr_socket in name_sockets:
+            if curr_socket is not send_socket:
+                return curr_socket
+        return send_socket
+
+    if len(name_sockets) == 0:
+        return None
+    return name_sockets[0]
+
+
+"""
+Checks the rooms that may have no managers (see unmanaged_rooms), and appoints a manager automatically in every room 
+that still has none. Only these rooms are checked, not all the rooms of the chat.
+In the multi-process mode, only the first worker appoints managers automatically, so two workers won't appoint two
+managers at the same time.
+"""
+def appoint_managers():
+    rooms_to_check = list(unmanaged_rooms)
+    unmanaged_rooms.clear()
+    if worker_number != 0:
+        return
+    for room in rooms_to_check:
+        if len(room.managers) == 0 and rooms.get(room.name) is room:
+            automatic_manager_appointment(room)
+
+
+"""In case there are no managers in a room (if the chat just opened or if the manager left the room), a new manager
+will automatically be appointed. Receives the room, and appoints as a manager the user related to the first socket in
+the members of the room, that has a name and isn't silenced (in the room or in the main room). A room whose members 
+are all silenced stays without a manager until another user enters it.
+"""
+def automatic_manager_appointment(room):
+    for curr_socket in room.members:
+        curr_user = users_dict[curr_socket]
+        if curr_user.name is not None and curr_user.is_silenced is False and is_silenced_in_chat(curr_user) is False:
+            mark_manager(curr_socket)
+            # Send manager appointment message.
+            to_send1 = str_time() + "You've been appointed  as a manager now!"
+            prepare_message_for_sending(to_send1, [curr_socket])
+            to_send2 = str_time() + curr_user.name + " has been appointed as a manager."
+            prepare_broadcast_message(to_send2, room, [curr_socket], ChatHistory.MODERATION)
+            ServerLog.log(str_time() + curr_user.name + " has been automatically apointed as a manager")
+            break
+
+
+# Receives a user and returns whether or not he has been silenced in the main room. The main room is shared by all the
+# users, so a user silenced there is silenced in the whole chat - he can't send private messages from any room, and he
+# isn't appointed as a manager automatically in any room.
+def is_silenced_in_chat(user):
+    return main_room in user.silenced_rooms
+
+
+"""
+A function that receives the socket and the name of the sending user and whether or not the message is private 
+(optional, by default False). If the user related to the socket is silenced in his room - or, for a private message 
+(which isn't sent in a room), in the main room - returns true, sends him a suitable message, and prints a description 
+in the console.
+"""
+def notify_silenced(send_socket, send_name, private=False):
+    user = users_dict[send_socket]
+    if user.is_silenced is True or (private is True and is_silenced_in_chat(user) is True):
+        to_send = "You cannot speak here!"
+        prepare_message_for_sending(to_send, [send_socket])
+        ServerLog.log(str_time() + send_name + " tried to send something but he's silenced.")
+        return True
+    return False
+
+
+"""
+Receives the socket and the name of the sending user and his message (chat or private). If the message passes a rate 
+limit, it's dropped and the function returns True - the user is sent a suitable message the first time, and isn't 
+sent it again until one of his messages is sent (so a flood doesn't cause a flood of answers). Otherwise returns False.
+"""
+def notify_rate_limited(send_socket, send_name, message):
+    if rate_limited is False or rate_checked is True:
+        return False
+    user = users_dict[send_socket]
+    if is_within_rate_limits(user, message) is True:
+        user.rate_limit_notified = False
+        return False
+    notify_throttled(send_socket, send_name)
+    return True
+
+
+# Receives the socket and the name of a user whose message was dropped by the rate limits, counts it in the metrics,
+# and tells him about it (only the first time, see notify_rate_limited).
+def notify_throttled(send_socket, send_name):
+    user = users_dict[send_socket]
+    if metrics is not None:
+        metrics.throttled.inc()
+    if user.rate_limit_notified is False:
+        user.rate_limit_notified = True
+        prepare_message_for_sending("You're sending messages too fast! Your messages won't be sent for a while.",
+                                    [send_socket])
+        ServerLog.log(str_time() + str(send_name) + " is sending messages too fast.", ServerLog.WARNING)
+
+
+# Receives a user and his message, and returns whether or not it's within the rate limits of his connection and of his
+# name. If it is, its tokens are taken from all of them. The buckets are created when they're first needed.
+def is_within_rate_limits(user, message):
+    if user.rate_buckets is None:
+        user.rate_buckets = new_rate_buckets(rate_limits["messages"], rate_limits["bytes"])
+    buckets = user.rate_buckets
+    if user.name is not None and (rate_limits["name_messages"] > 0 or rate_limits["name_bytes"] > 0):
+        if user.name not in name_buckets:
+            name_buckets[user.name] = new_rate_buckets(rate_limits["name_messages"], rate_limits["name_bytes"])
+        buckets += name_buckets[user.name]
+    size = len(message.encode())
+    now = time.monotonic()
+    for i in range(len(buckets)):
+        # The even buckets count messages, the odd ones count bytes.
+        if buckets[i] is not None and buckets[i].allows(1 if i % 2 == 0 else size, now) is False:
+            return False
+    for i in range(len(buckets)):
+        if buckets[i] is not None:
+            buckets[i].take(1 if i % 2 == 0 else size)
+    return True
+
+
+# Receives a limit of messages and a limit of bytes per second (0 for no limit), and returns a tuple of their token
+# buckets (None for no limit). A bucket holds at least one message.
+def new_rate_buckets(messages_rate, bytes_rate):
+    message_bucket = None
+    byte_bucket = None
+    if messages_rate > 0:
+        message_bucket = TokenBucket(messages_rate, max(1, messages_rate * rate_burst))
+    if bytes_rate > 0:
+        byte_bucket = TokenBucket(bytes_rate, bytes_rate * rate_burst)
+    return message_bucket, byte_bucket
+
+
+"""A function that receives the socket and name of the sending user and the socket and name of the user the message is
+sent to him, or that a command is activated on him.
+If the target socket is None, or if the target socket is the same as the sending socket,
+the function returns true, sends the user a suitable message, and prints a description in the console.
+"""
+def notify_ivalid_name(send_socket, send_name, target_socket, target_name):
+    if target_socket is None:
+        to_send = "Invalid user name. No user with name '" + target_name + "' in the chat."
+        ServerLog.log(str_time() + send_name + " entered an invalid name (" + target_name + ")")
+        prepare_message_for_sending(to_send, [send_socket])
+        return True
+    if target_socket is send_socket:
+        to_send1 = "You cannot use this command on yourself."
+        prepare_message_for_sending(to_send1, [send_socket])
+        ServerLog.log(str_time() + send_name + " tried to use a command on himself.")
+        return True
+    return False
+
+
+"""A function that receives the socket and name of the sending user and the socket and name of the user a command for 
+managers is activated on him.
+If the target user isn't in the room of the sending user (the commands for managers apply to their room only, except 
+the removal from the chat by a manager of the main room), the function returns true, sends the user a suitable message, and prints a description in the console.
+"""
+def notify_not_in_room(send_socket, send_name, target_socket, target_name):
+    room = users_dict[send_socket].room
+    if users_dict[target_socket].room is not room:
+        to_send = target_name + " isn't in the room " + room.name + "."
+        prepare_message_for_sending(to_send, [send_socket])
+        ServerLog.log(str_time() + send_name + " tried to use a command on " + target_name + ", who isn't in his room.")
+        return True
+    return False
+
+
+"""Called in case a user wants to use a command for managers only.
+The function receives the socket and name of the sending user. If he's not a manager, returns true,
+sends him a suitable message and prints a description in the console.
+"""
+def notify_not_manager(send_socket, send_name):
+    if users_dict[send_socket].is_manager is False:
+        to_send = "You'r not allowed to use this command because you'r not a manager."
+        prepare_message_for_sending(to_send, [send_socket])
+        ServerLog.log(str_time() + users_dict[send_socket].name + " tried to use a command available only for "
+                      "managers, although he's not a manager")
+        return True
+    return False
+
+
+# Handles cases in which the data sent from the user is a chat message.
+# Receives the sending socket, the name of the sending user and the message.
+def handle_chat_message(send_socket, send_name, message):
+    if (notify_silenced(send_socket, send_name) is False and
+            notify_rate_limited(send_socket, send_name, message) is False):
+        to_send1 = str_time() + "You: " + message
+        prepare_message_for_sending(to_send1, [send_socket])
+        to_send2 = ""
+        if users_dict[send_socket].is_manager is True:
+            to_send2 = str_time() + MANAGER_SYMBOL + send_name + ": " + message
+        else:
+            to_send2 = str_time() + send_name + ": " + message
+        prepare_broadcast_message(to_send2, users_dict[send_socket].room, [send_socket], ChatHistory.CHAT)
+        ServerLog.log(to_send2)
+
+
+# Handles situations in which the data sent from the user is an appointment of a user as a manager.
+# Receives the socket and the name of the sending user, the socket and the name of the target (the potential receiving
+# socket).
+def handle_appoint_manager(send_socket, send_name, target_socket, target_name):
+    if notify_not_manager(send_socket, send_name) is False:
+        if notify_ivalid_name(send_socket, send_name, target_socket, target_name) is False and \
+                notify_not_in_room(send_socket, send_name, target_socket, target_name) is False:
+            if users_dict[target_socket].is_manager is True:  # If the other user is already a manager
+                to_send = target_name + " is already a manager."
+                prepare_message_for_sending(to_send, [send_socket])
+                ServerLog.log(str_time() + send_name + "tried to appoint " + target_name +
+                              " as a manager but he's already a manager.")
+            else:
+                mark_manager(target_socket)
+                to_send1 = str_time() + MANAGER_SYMBOL + send_name + " appointed you as a manager!"
+                prepare_message_for_sending(to_send1, [target_socket])
+                to_send2 = str_time() + "You appointed " + target_name + " as a manager."
+                prepare_message_for_sending(to_send2, [send_socket])
+                to_send3 = str_time() + MANAGER_SYMBOL + send_name + " appointed " + target_name + " as a manager. "
+                prepare_broadcast_message(to_send3, users_dict[send_socket].room, [target_socket, send_socket],
+                                          ChatHistory.MODERATION)
+                ServerLog.log(to_send3)
+
+
+# Handles situations in which the data sent from the user is a command to remove one of the users.
+# Receives the socket and the name of the sending user, the socket and the name of the target (the potential receiving
+# socket). A manager of the main room removes the user from the chat (he's disconnected, from whichever room he's in),
+# and a manager of another room removes the user from his room only (he goes back to the main room).
+def handle_remove(send_socket, send_name, target_socket, target_name):
+    if notify_not_manager(send_socket, send_name) is False:
+        room = users_dict[send_socket].room
+        if notify_ivalid_name(send_socket, send_name, target_socket, target_name) is False and \
+                (room is main_room or notify_not_in_room(send_socket, send_name, target_socket, target_name) is False):
+            target_room = users_dict[target_socket].room
+            place = "the chat"
+            if room is not main_room:
+                place = "the room " + room.name
+            to_send1 = str_time() + MANAGER_SYMBOL + send_name + " removed you from " + place + "."
+            prepare_message_for_sending(to_send1, [target_socket], room is main_room)
+            to_send2 = str_time() + "You removed " + target_name + " from " + place + "."
+            prepare_message_for_sending(to_send2, [send_socket])
+            to_send3 = str_time() + MANAGER_SYMBOL + send_name + " removed " + target_name + " from " + place + "."
+            prepare_broadcast_message(to_send3, room, [target_socket, send_socket], ChatHistory.MODERATION)
+            if target_room is not room:  # The members of the room the user was removed from are told too.
+                prepare_broadcast_message(to_send3, target_room, [target_socket])
+            ServerLog.log(to_send3)
+            if room is not main_room:
+                move_to_room(target_socket, MAIN_ROOM, False)
+
+
+# Handles situations in which the data sent from the user is a command to silence one of the users.
+# Receives the socket and the name of the sending user, the socket and the name of the target (the potential receiving
+# socket).
+def handle_silence_user(send_socket, send_name, target_socket, target_name):
+    if notify_not_manager(send_socket, send_name) is False:
+        if notify_ivalid_name(send_socket, send_name, target_socket, target_name) is False and \
+                notify_not_in_room(send_socket, send_name, target_socket, target_name) is False:
+            if users_dict[target_socket].is_silenced is True:
+                to_send = target_name + " is already silenced"
+                prepare_message_for_sending(to_send, [send_socket])
+                ServerLog.log(str_time() + send_name + "tried to silence " + target_name +
+                              " although he's already silenced.")
+            else:
+                mark_silenced(target_socket)
+                to_send1 = str_time() + MANAGER_SYMBOL + send_name + " silenced you. You can't send messages any more."
+                prepare_message_for_sending(to_send1, [target_socket])
+                to_send2 = str_time() + "You silenced " + target_name
+                prepare_message_for_sending(to_send2, [send_socket])
+                to_send3 = str_time() + MANAGER_SYMBOL + send_name + " silenced " + target_name
+                prepare_broadcast_message(to_send3, users_dict[send_socket].room, [target_socket, send_socket],
+                                          ChatHistory.MODERATION)
+                ServerLog.log(to_send3)
+
+
+# Handles situations in which the data sent from the user is a request to join a room.
+# Receives the sending socket and the name of the room.
+def handle_join_room(send_socket, room_name):
+    if is_valid_name(room_name) is False:
+        prepare_message_for_sending("Invalid room name.", [send_socket])
+    elif users_dict[send_socket].room.name == room_name:
+        prepare_message_for_sending("You're already in the room " + room_name + ".", [send_socket])
+    else:
+        move_to_room(send_socket, room_name)
+
+
+# Handles situations in which the data sent from the user is a request to leave his room (and go back to the main
+# room). Receives the sending socket.
+def handle_leave_room(send_socket):
+    if users_dict[send_socket].room is main_room:
+        prepare_message_for_sending("You're already in the main room.", [send_socket])
+    else:
+        move_to_room(send_socket, MAIN_ROOM)
+
+
+# Handles cases in which the data sent from the user is a private message.
+# Receives the socket and the name of the sending user, the socket and the name of the target (the potential receiving
+# socket), and the message itself.
+def handle_private_message(send_socket, send_name, target_socket, target_name, message):
+    if (notify_silenced(send_socket, send_name, True) is False and
+            notify_rate_limited(send_socket, send_name, message) is False):
+        if notify_ivalid_name(send_socket, send_name, target_socket, target_name) is False:
+            to_send1 = ""
+            if users_dict[send_socket].is_manager is True:
+                to_send1 = str_time() + "!" + MANAGER_SYMBOL + send_name + ": " + message
+                ServerLog.log(str_time() + MANAGER_SYMBOL + send_name + " sent a private message to " + target_name +
+                              ".")
+            else:
+                to_send1 = str_time() + "!" + send_name + ": " + message
+                ServerLog.log(str_time() + send_name + " sent a private message to " + target_name + ".")
+            prepare_message_for_sending(to_send1, [target_socket])
+            to_send2 = str_time() + "You (private message to " + target_name + "): " + message
+            prepare_message_for_sending(to_send2, [send_socket])
+
+
+if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,140 @@
+# The log of the chat server: the records are written by a background thread, in batches.
+# Auther: Gilad Moyal.
+
+import atexit
+import collections
+import os
+import sys
+import threading
+import time
+
+"""
+The handlers of the server only add a record (time, level and text) to the end of a queue, which doesn't block and
+doesn't need a lock (appending to a deque and removing from its other side are atomic). A background thread wakes up
+every FLUSH_INTERVAL seconds, formats all the waiting records and writes them together.
+The queue is bounded: when it's full (the disk or the terminal is too slow), new records are dropped and counted, so
+the log never slows down the chat. Only the handlers change the count of the dropped records, and only the background
+thread changes the count it has reported, so neither of them needs a lock either.
+Without a log file, the records are written to the standard output as they were printed before (the text only).
+With a log file, every line starts with the date, the time and the level, and when the file gets to max_bytes, it's
+renamed to <file>.1 (the older files to <file>.2 and so on, up to the number of backups) and a new file is started.
+"""
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+LEVELS = {name.lower(): level for level, name in LEVEL_NAMES.items()}  # The names of the levels in the command line.
+FLUSH_INTERVAL = 0.1  # Seconds between the batches the background thread writes.
+MAX_QUEUED_RECORDS = 100000  # The maximal number of records waiting to be written.
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024  # The size of a log file when it's rotated (10 MiB).
+DEFAULT_BACKUPS = 5  # The number of old log files that are kept.
+
+records = collections.deque()  # The records waiting to be written: tuples of time, level and text.
+level = INFO  # The lowest level that is written - records below it are dropped without being queued.
+dropped_records = 0  # The number of records that were dropped because the queue was full (changed by the handlers).
+reported_drops = 0  # The number of dropped records that were reported in the log (changed by the background thread).
+log_path = None  # The path of the log file, or None if the records are written to the standard output.
+max_bytes = DEFAULT_MAX_BYTES
+backups = DEFAULT_BACKUPS
+output = None  # The file the records are written to.
+writer_thread = None
+stopping = threading.Event()
+# The date and time of the last second a record was written in, as a string, so it's formatted once per second.
+formatted_second = None
+formatted_time = ""
+
+
+# Receives the text of a record and its level (optional, by default INFO), and adds it to the queue.
+def log(text, record_level=INFO):
+    global dropped_records
+    if record_level < level:
+        return
+    if len(records) >= MAX_QUEUED_RECORDS:
+        dropped_records += 1
+        return
+    records.append((time.time(), record_level, text))
+
+
+"""
+Receives the path of the log file (None for the standard output), the lowest level to write, the size of a log file
+when it's rotated and the number of old log files to keep. Starts the background thread that writes the records.
+In the multi-process mode it's called by every worker (a thread doesn't survive fork), each with its own log file.
+"""
+def start(path=None, lowest_level=INFO, rotation_bytes=DEFAULT_MAX_BYTES, backups_number=DEFAULT_BACKUPS):
+    global log_path, level, max_bytes, backups, output, writer_thread
+    log_path = path
+    level = lowest_level
+    max_bytes = rotation_bytes
+    backups = backups_number
+    if log_path is None:
+        output = sys.stdout
+    else:
+        output = open(log_path, "a")
+    writer_thread = threading.Thread(target=write_records, name="log-writer", daemon=True)
+    writer_thread.start()
+    atexit.register(stop)
+
+
+# Stops the background thread after it writes the waiting records.
+def stop():
+    if writer_thread is None or stopping.is_set():
+        return
+    stopping.set()
+    writer_thread.join()
+
+
+# The background thread: writes the waiting records every FLUSH_INTERVAL seconds, until the log is stopped.
+def write_records():
+    while not stopping.wait(FLUSH_INTERVAL):
+        write_batch()
+    write_batch()
+
+
+# Formats all the records waiting in the queue and writes them together.
+def write_batch():
+    global reported_drops
+    lines = []
+    while len(records) != 0:
+        lines.append(format_record(*records.popleft()))
+    dropped = dropped_records
+    if dropped != reported_drops:
+        lines.append(format_record(time.time(), WARNING, str(dropped - reported_drops) + " log records were dropped."))
+        reported_drops = dropped
+    if len(lines) == 0:
+        return
+    try:
+        output.write("".join(lines))
+        output.flush()
+        if log_path is not None and output.tell() >= max_bytes:
+            rotate()
+    except (OSError, ValueError):  # The output has been closed (the server is exiting).
+        pass
+
+
+# Receives the time, the level and the text of a record, and returns its line.
+def format_record(record_time, record_level, text):
+    global formatted_second, formatted_time
+    if log_path is None:
+        return text + "\n"
+    second = int(record_time)
+    if second != formatted_second:
+        formatted_second = second
+        formatted_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+    return formatted_time + " " + LEVEL_NAMES[record_level] + " " + text + "\n"
+
+
+# Renames the log file and the old log files (the oldest one is deleted), and opens a new log file.
+def rotate():
+    global output
+    output.close()
+    for number in range(backups - 1, 0, -1):
+        old_path = log_path + "." + str(number)
+        if os.path.exists(old_path):
+            os.replace(old_path, log_path + "." + str(number + 1))
+    if backups > 0:
+        os.replace(log_path, log_path + ".1")
+    else:
+        os.remove(log_path)
+    output = open(log_path, "a")
@@ -0,0 +1,72 @@
+# A timer wheel of the chat server: many deadlines (like the timeouts of the connections), each added in O(1).
+# Auther: Gilad Moyal.
+
+import math
+import time
+
+"""
+The time is divided into ticks of a fixed resolution, and the wheel has a slot for every tick of one revolution. An
+item is added to the slot of the first tick after its deadline (a deadline further than one revolution is kept in its
+slot until the wheel comes around to it again). Advancing the wheel visits only the slots of the ticks that passed, so
+the cost of a tick doesn't depend on the number of items in the other slots. An item expires at most one tick late.
+Items aren't cancelled: an item that isn't relevant anymore (its connection has been closed, or got new data) is
+ignored or added again by the caller when it expires, which is cheaper than finding and removing it every time.
+"""
+
+DEFAULT_RESOLUTION = 0.5  # Seconds in every tick.
+DEFAULT_SLOTS_NUMBER = 512  # The number of ticks in one revolution (with the default resolution, about 4 minutes).
+
+"""
+Represents a timer wheel.
+Described by:
+resolution (float) - the seconds in every tick.
+slots (list of lists) - a list for every tick of the revolution, of the items (deadline and item) that expire in it.
+tick (int) - the last tick that was handled (the time of time.monotonic divided by the resolution).
+size (int) - the number of items in the wheel.
+"""
+
+
+class TimerWheel:
+    def __init__(self, resolution=DEFAULT_RESOLUTION, slots_number=DEFAULT_SLOTS_NUMBER):
+        self.resolution = resolution
+        self.slots = [[] for i in range(slots_number)]
+        self.tick = int(time.monotonic() / resolution)
+        self.size = 0
+
+    # Receives a deadline (of time.monotonic) and an item, and adds the item to the wheel. A deadline that has
+    # already passed expires in the next tick.
+    def add(self, deadline, item):
+        tick = max(math.ceil(deadline / self.resolution), self.tick + 1)
+        self.slots[tick % len(self.slots)].append((deadline, item))
+        self.size += 1
+
+    # Receives the current time (of time.monotonic), and returns a list of the items whose deadline has passed. They
+    # are removed from the wheel.
+    def advance(self, now):
+        current_tick = int(now / self.resolution)
+        if self.size == 0 or current_tick == self.tick:
+            self.tick = max(self.tick, current_tick)
+            return []
+        expired = []
+        # After a long pause every slot is visited once.
+        for tick in range(max(self.tick + 1, current_tick - len(self.slots) + 1), current_tick + 1):
+            slot_index = tick % len(self.slots)
+            slot = self.slots[slot_index]
+            if len(slot) == 0:
+                continue
+            later_items = []  # The items of the next revolutions.
+            for deadline, item in slot:
+                if deadline <= now:
+                    expired.append(item)
+                else:
+                    later_items.append((deadline, item))
+            self.slots[slot_index] = later_items
+        self.tick = current_tick
+        self.size -= len(expired)
+        return expired
+
+    # Returns the time (of time.monotonic) the wheel should be advanced at, or None if it's empty.
+    def next_tick(self):
+        if self.size == 0:
+            return None
+        return (self.tick + 1) * self.resolution
@@ -0,0 +1,80 @@
+# The configuration of the tests: the modules of the chat are imported from the directory above the tests.
+# Auther: Gilad Moyal.
+
+import os
+import re
+import selectors
+import socket
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Server2
+import TimerWheel
+
+
+"""
+Connects clients to the selectors engine of the server in the process of the tests, without the listening socket: 
+every client is a pair of connected sockets, the first is handled by the server (watched in its selector) and the 
+second is read by the test. Returns a function that receives a list of names (optional) and returns a list of such 
+pairs, one for every name, after the clients logged in with the names (None instead of a name skips the login).
+The clients that are still connected at the end of the test are removed, so every test starts with an empty chat.
+"""
+@pytest.fixture
+def connect_clients(monkeypatch):
+    monkeypatch.setattr(Server2, "timers", TimerWheel.TimerWheel())
+    pairs = []
+
+    def connect(names=(None,)):
+        new_pairs = []
+        for name in names:
+            server_side, client_side = socket.socketpair()
+            server_side.setblocking(False)
+            client_side.settimeout(1)
+            Server2.selector.register(server_side, selectors.EVENT_READ)
+            Server2.add_client(server_side)
+            if name is not None:
+                Server2.handle_received_bytes(server_side, ("login" + str(len(name)).zfill(2) + name).encode())
+            new_pairs.append((server_side, client_side))
+        pairs.extend(new_pairs)
+        Server2.flush_pending()
+        return new_pairs
+
+    yield connect
+    for server_side, client_side in pairs:
+        if server_side in Server2.users_dict:
+            Server2.remove_client(server_side)
+        client_side.close()
+    Server2.pending_flush.clear()
+    Server2.overflowed_clients.clear()
+
+
+"""
+Returns a function that receives the socket of a client (the second socket of a pair returned by connect_clients), 
+writes the queues of the server and returns the texts of all the messages the client received since the last call, 
+without the time at their beginning.
+"""
+@pytest.fixture
+def receive_messages():
+    def receive(client_side):
+        Server2.flush_pending()
+        data = b""
+        client_side.setblocking(False)
+        try:
+            while True:
+                data += client_side.recv(Server2.MAX_BYTES)
+        except BlockingIOError:
+            pass
+        finally:
+            client_side.settimeout(1)
+        messages = []
+        while len(data) != 0:
+            length = int(data[:Server2.LENGTH_DIGITS])
+            text = data[Server2.LENGTH_DIGITS:Server2.LENGTH_DIGITS + length].decode()
+            messages.append(re.sub(r"^[0-9]{2}:[0-9]{2} ", "", text))
+            data = data[Server2.LENGTH_DIGITS + length:]
+        return messages
+
+    return receive
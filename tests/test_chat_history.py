@@ -0,0 +1,123 @@
+# Tests of the persistent history of the chat (ChatHistory.py), and of its recovery after the server was stopped in the
+# middle of a write.
+# Auther: Gilad Moyal.
+
+import os
+
+import pytest
+
+import ChatHistory
+import Server2
+
+
+# Receives the directory of a history and a number of messages, and creates the history with the messages "m1",
+# "m2"... committed. Returns the history (still open).
+def create_history(directory, count, segment_size=ChatHistory.DEFAULT_SEGMENT_SIZE):
+    history = ChatHistory.ChatHistory(str(directory), segment_size)
+    for number in range(1, count + 1):
+        history.append(ChatHistory.CHAT, "m" + str(number))
+    history.commit()
+    return history
+
+
+# Receives a history, and returns the sequence numbers and the texts of all its messages.
+def all_messages(history):
+    return [(sequence, text) for sequence, message_time, kind, text in history.last(history.next_sequence)]
+
+
+# Receives the directory of a history, and returns the path of its only segment and of its index.
+def only_segment(directory):
+    segment_names = [name for name in os.listdir(directory) if name.endswith(ChatHistory.SEGMENT_SUFFIX)]
+    assert len(segment_names) == 1
+    segment_path = os.path.join(directory, segment_names[0])
+    return segment_path, segment_path[:-len(ChatHistory.SEGMENT_SUFFIX)] + ChatHistory.INDEX_SUFFIX
+
+
+def test_append_and_read(tmp_path):
+    history = create_history(tmp_path, 5)
+    history.append(ChatHistory.MODERATION, "not committed yet")
+    assert all_messages(history)[-2:] == [(5, "m5"), (6, "not committed yet")]
+    assert [text for sequence, message_time, kind, text in history.last(2)] == ["m5", "not committed yet"]
+    assert [sequence for sequence, message_time, kind, text in history.since(2, 2)] == [3, 4]
+    assert history.since(6, 10) == []
+    history.close()
+
+
+def test_reopen(tmp_path):
+    create_history(tmp_path, 5).close()
+    history = ChatHistory.ChatHistory(str(tmp_path))
+    assert all_messages(history) == [(number, "m" + str(number)) for number in range(1, 6)]
+    assert history.append(ChatHistory.CHAT, "m6") == 6
+    history.close()
+
+
+# The messages are divided into several segments, and are read across them.
+def test_segments(tmp_path):
+    create_history(tmp_path, 50, segment_size=200).close()
+    assert len([name for name in os.listdir(tmp_path) if name.endswith(ChatHistory.SEGMENT_SUFFIX)]) > 1
+    history = ChatHistory.ChatHistory(str(tmp_path), 200)
+    assert all_messages(history) == [(number, "m" + str(number)) for number in range(1, 51)]
+    assert [sequence for sequence, message_time, kind, text in history.since(10, 30)] == list(range(11, 41))
+    history.close()
+
+
+# The last record was written partly: it's cut from the segment, and its sequence number is given again.
+@pytest.mark.parametrize("cut_bytes", [1, 2, ChatHistory.RECORD_HEADER.size + 1])
+def test_truncated_tail(tmp_path, cut_bytes):
+    create_history(tmp_path, 5).close()
+    segment_path, index_path = only_segment(tmp_path)
+    good_size = os.path.getsize(segment_path)
+    with open(segment_path, "r+b") as segment_file:
+        segment_file.truncate(good_size - cut_bytes)
+    history = ChatHistory.ChatHistory(str(tmp_path))
+    messages = all_messages(history)
+    assert messages == [(number, "m" + str(number)) for number in range(1, len(messages) + 1)]
+    assert len(messages) == 4
+    assert os.path.getsize(index_path) == 4 * 8
+    assert history.append(ChatHistory.CHAT, "again") == 5
+    history.close()
+    history = ChatHistory.ChatHistory(str(tmp_path))
+    assert all_messages(history)[-1] == (5, "again")
+    history.close()
+
+
+# The records were written, but the server stopped before their positions were added to the index.
+def test_index_behind_segment(tmp_path):
+    create_history(tmp_path, 5).close()
+    segment_path, index_path = only_segment(tmp_path)
+    with open(index_path, "r+b") as index_file:
+        index_file.truncate(2 * 8)
+    history = ChatHistory.ChatHistory(str(tmp_path))
+    assert all_messages(history) == [(number, "m" + str(number)) for number in range(1, 6)]
+    history.close()
+
+
+# The index of a segment is missing altogether, and the segment ends with a partial record.
+def test_missing_index_and_partial_record(tmp_path):
+    create_history(tmp_path, 3).close()
+    segment_path, index_path = only_segment(tmp_path)
+    os.remove(index_path)
+    with open(segment_path, "ab") as segment_file:
+        segment_file.write(b"\0" * (ChatHistory.RECORD_HEADER.size - 1))
+    history = ChatHistory.ChatHistory(str(tmp_path))
+    assert all_messages(history) == [(1, "m1"), (2, "m2"), (3, "m3")]
+    assert history.next_sequence == 4
+    history.close()
+
+
+# A client that asks for the history gets the last messages of the main room, or the messages after a sequence number.
+def test_history_request(tmp_path, monkeypatch, connect_clients, receive_messages):
+    history = ChatHistory.ChatHistory(str(tmp_path))
+    monkeypatch.setattr(Server2, "history", history)
+    [(first, first_client)] = connect_clients(["a"])
+    first_sequence = history.next_sequence
+    for number in range(1, 4):
+        Server2.handle_received_bytes(first, b"1" + b"0002" + ("m" + str(number)).encode())
+    history.commit()
+    [(second, second_client)] = connect_clients(["b"])
+    receive_messages(second_client)
+    Server2.handle_received_bytes(second, b"9" + b"013" + b"00")
+    assert receive_messages(second_client) == ["@a: m2", "@a: m3", "Someone joined the chat"]
+    Server2.handle_received_bytes(second, b"9" + b"012" + (str(len(str(first_sequence))).zfill(2) + str(first_sequence)).encode())
+    assert receive_messages(second_client) == ["@a: m2", "@a: m3"]
+    history.close()
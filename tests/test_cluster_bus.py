@@ -0,0 +1,167 @@
+# Tests of the state bus of the multi-process mode (ClusterBus.py), and of the handling of its events by a worker of
+# the server (Server2.py).
+# Auther: Gilad Moyal.
+
+import selectors
+import socket
+import threading
+
+import pytest
+
+import ClusterBus
+import Server2
+
+
+# Receives a BusConnection and a number of events, and returns the events received in it until there are that many
+# (or until a second passed without new data).
+def wait_for_events(connection, count):
+    events = []
+    bus_selector = selectors.DefaultSelector()
+    bus_selector.register(connection.socket, selectors.EVENT_READ)
+    while len(events) < count and len(bus_selector.select(1)) != 0:
+        new_events = connection.receive_events()
+        if new_events is None:
+            break
+        events.extend(new_events)
+    bus_selector.close()
+    return events
+
+
+"""
+Starts a hub in a thread, connected to the given number of workers. Returns a list of the BusConnection objects of 
+the workers (the side of the workers), and the thread of the hub, which ends when all the workers are closed.
+"""
+@pytest.fixture
+def hub_workers():
+    worker_connections = []
+    threads = []
+
+    def start(workers_number):
+        hub_connections = {}
+        for worker_number in range(workers_number):
+            hub_socket, worker_socket = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+            hub_connections[worker_number] = ClusterBus.BusConnection(hub_socket)
+            worker_connections.append(ClusterBus.BusConnection(worker_socket))
+        hub_thread = threading.Thread(target=ClusterBus.run_hub, args=(hub_connections,), daemon=True)
+        hub_thread.start()
+        threads.append(hub_thread)
+        return worker_connections, hub_thread
+
+    yield start
+    for connection in worker_connections:
+        connection.socket.close()
+    for hub_thread in threads:
+        hub_thread.join(1)
+
+
+# Lines split between several pieces of data are returned only when they're completed.
+def test_lines_split_between_reads():
+    first_socket, second_socket = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection = ClusterBus.BusConnection(first_socket)
+    second_socket.sendall(b'{"type":"le')
+    assert connection.receive_events() == []
+    second_socket.sendall(b'ft","key":"0:1"}\n{"type":')
+    assert connection.receive_events() == [{"type": "left", "key": "0:1"}]
+    second_socket.close()
+    assert connection.receive_events() is None
+    first_socket.close()
+
+
+# The hub passes every event to all the other workers, in the order it was sent, and not back to its sender.
+def test_hub_relays_events(hub_workers):
+    (first, second, third), hub_thread = hub_workers(3)
+    for number in range(3):
+        first.send_event({"type": "broadcast", "room": "main", "message": str(number), "excluded": []})
+    first.flush()
+    for connection in (second, third):
+        events = wait_for_events(connection, 3)
+        assert [event["message"] for event in events] == ["0", "1", "2"]
+    assert wait_for_events(first, 1) == []
+
+
+# A long burst of events is passed on completely, including the lines the hub had to keep until the socket of the
+# worker accepted them.
+def test_hub_relays_long_burst(hub_workers):
+    (first, second), hub_thread = hub_workers(2)
+    for number in range(5000):
+        first.send_event({"type": "deliver", "key": "1:0", "message": "x" * 100 + str(number), "remove": False})
+    events = []
+    while len(events) < 5000:
+        first.flush()
+        new_events = wait_for_events(second, 1)
+        assert len(new_events) != 0
+        events.extend(new_events)
+    assert [event["message"] for event in events] == ["x" * 100 + str(number) for number in range(5000)]
+
+
+# When a worker exits, the other workers are told about it, and the hub ends when all of them have exited.
+def test_worker_down(hub_workers):
+    (first, second, third), hub_thread = hub_workers(3)
+    third.socket.close()
+    assert wait_for_events(first, 1) == [{"type": "worker-down", "worker": 2}]
+    assert wait_for_events(second, 1) == [{"type": "worker-down", "worker": 2}]
+    first.socket.close()
+    second.socket.close()
+    hub_thread.join(1)
+    assert hub_thread.is_alive() is False
+
+
+"""
+Makes the server of the tests a worker of the multi-process mode: returns the BusConnection of the hub's side of its 
+bus, to read the events it publishes and to send it the events of the other workers. The users of the other workers 
+are removed at the end of the test.
+"""
+@pytest.fixture
+def worker_bus(monkeypatch):
+    hub_socket, worker_socket = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    monkeypatch.setattr(Server2, "bus", ClusterBus.BusConnection(worker_socket))
+    monkeypatch.setattr(Server2, "connection_keys", {})
+    monkeypatch.setattr(Server2, "connections_by_key", {})
+    Server2.selector.register(worker_socket, selectors.EVENT_READ)
+    hub = ClusterBus.BusConnection(hub_socket)
+    yield hub
+    for current_socket in list(Server2.connections_by_key.values()):
+        if isinstance(current_socket, Server2.RemoteConnection):
+            Server2.unregister_user(current_socket)
+    Server2.selector.unregister(worker_socket)
+    worker_socket.close()
+    hub_socket.close()
+
+
+# Receives the BusConnection of the hub's side and events, and passes the events to the worker.
+def send_to_worker(hub, *events):
+    for event in events:
+        hub.send_event(event)
+    hub.flush()
+    Server2.handle_incoming_data(Server2.bus.socket)
+
+
+# The users of a worker are published to the other workers, and the users of other workers get messages from the
+# users of this worker through the bus.
+def test_worker_publishes_its_users(worker_bus, connect_clients):
+    [(server_side, client_side)] = connect_clients(["dana"])
+    key = Server2.connection_keys[server_side]
+    events = wait_for_events(worker_bus, 2)
+    assert {"type": "name", "key": key, "name": "dana"} in events
+    send_to_worker(worker_bus, {"type": "name", "key": "1:0", "name": "gilad"})
+    Server2.handle_received_bytes(server_side, b"5" + b"05gilad" + b"0002hi")
+    [event] = wait_for_events(worker_bus, 1)
+    assert event["key"] == "1:0"
+    assert event["message"].endswith("dana: hi")
+
+
+# The events of the other workers are applied to the users of this worker.
+def test_worker_applies_events(worker_bus, connect_clients, receive_messages):
+    [(server_side, client_side)] = connect_clients(["dana"])
+    receive_messages(client_side)
+    send_to_worker(worker_bus, {"type": "name", "key": "1:0", "name": "gilad"},
+                   {"type": "broadcast", "room": "main", "message": "gilad: hello", "excluded": ["1:0"]})
+    assert receive_messages(client_side) == ["gilad: hello"]
+    remote = Server2.socket_by_name(server_side, "dana", "gilad")
+    assert isinstance(remote, Server2.RemoteConnection)
+    send_to_worker(worker_bus, {"type": "join", "key": "1:0", "room": "dev"})
+    assert Server2.users_dict[remote].room is Server2.rooms["dev"]
+    send_to_worker(worker_bus, {"type": "worker-down", "worker": 1})
+    assert remote not in Server2.users_dict
+    assert "dev" not in Server2.rooms
+    assert Server2.socket_by_name(server_side, "dana", "gilad") is None
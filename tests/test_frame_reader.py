@@ -0,0 +1,103 @@
+# Tests of the separation of the data received from a client into frames (FrameReader of Server2.py), in both versions
+# of the protocol.
+# Auther: Gilad Moyal.
+
+import pytest
+
+import ProtocolV2
+import Server2
+
+V1_DATA = ("login05gilad" + "1" + "0005hello" + "5" + "04dana" + "0007see you" + "view-managers" + "quit").encode()
+V1_FRAMES = [(Server2.LOGIN, "gilad"), (Server2.CHAT_MESSAGE, "hello"), (Server2.PRIVATE_MESSAGE, "dana", "see you"),
+             Server2.VIEW_MANAGERS, Server2.QUIT]
+V2_DATA = (ProtocolV2.hello(2) + ProtocolV2.encode_client_frame(ProtocolV2.LOGIN, "gilad") +
+           ProtocolV2.encode_client_frame(ProtocolV2.CHAT_MESSAGE, "hello") +
+           ProtocolV2.encode_client_frame(ProtocolV2.PRIVATE_MESSAGE, "dana", "see you") +
+           ProtocolV2.encode_client_frame(ProtocolV2.JOIN_ROOM, "dev") +
+           ProtocolV2.encode_client_frame(ProtocolV2.QUIT))
+V2_FRAMES = [Server2.HELLO, (Server2.LOGIN, "gilad"), (Server2.CHAT_MESSAGE, "hello"),
+             (Server2.PRIVATE_MESSAGE, "dana", "see you"), (Server2.JOIN_ROOM, "dev"), Server2.QUIT]
+STREAMS = [(V1_DATA, V1_FRAMES), (V2_DATA, V2_FRAMES)]  # The data of a client, and the frames it's separated into.
+INVALID_DATA = [
+    b"junk",  # Not a command.
+    b"9junk",  # A length that isn't a number.
+    b"login01a" + b"8",  # An unknown command.
+    b"login01a" + b"login01b",  # A second login.
+    b"login01@",  # A name that starts with the manager symbol.
+    b"login01a" + b"1" + b"0002\xff\xfe",  # Text that isn't UTF-8.
+    ProtocolV2.hello(0),  # A version that doesn't exist.
+    ProtocolV2.hello(2) + ProtocolV2.encode_frame(99, b""),  # An unknown frame type.
+    ProtocolV2.hello(2) + ProtocolV2.encode_client_frame(ProtocolV2.CHAT_MESSAGE, "before login"),
+    ProtocolV2.hello(2) + ProtocolV2.encode_client_frame(ProtocolV2.LOGIN, "a" * (Server2.MAX_NAME_LENGTH + 1)),
+    ProtocolV2.hello(2) + ProtocolV2.encode_client_frame(ProtocolV2.LOGIN, "a") +
+    ProtocolV2.encode_client_frame(ProtocolV2.CHAT_MESSAGE, "x" * (Server2.MAX_MESSAGE_LENGTH + 1)),
+]
+
+
+# Receives pieces of data, feeds them to a new FrameReader one after the other and returns the reader and all the
+# frames it returned.
+def feed_pieces(pieces):
+    reader = Server2.FrameReader()
+    frames = []
+    for piece in pieces:
+        frames.extend(reader.feed(piece))
+    return reader, frames
+
+
+@pytest.mark.parametrize("data, expected_frames", STREAMS)
+def test_merged_reads(data, expected_frames):
+    reader, frames = feed_pieces([data])
+    assert frames == expected_frames
+    assert reader.invalid is False
+
+
+# Every byte is received in its own piece of data.
+@pytest.mark.parametrize("data, expected_frames", STREAMS)
+def test_split_reads(data, expected_frames):
+    reader, frames = feed_pieces([data[i:i + 1] for i in range(len(data))])
+    assert frames == expected_frames
+    assert reader.invalid is False
+
+
+# The data is split at every position into two pieces.
+@pytest.mark.parametrize("data, expected_frames", STREAMS)
+def test_split_at_every_position(data, expected_frames):
+    for split in range(1, len(data)):
+        reader, frames = feed_pieces([data[:split], data[split:]])
+        assert frames == expected_frames
+
+
+def test_protocol_version():
+    assert feed_pieces([V1_DATA])[0].protocol_version == 1
+    assert feed_pieces([V2_DATA])[0].protocol_version == 2
+    assert feed_pieces([ProtocolV2.hello(9)])[0].protocol_version == Server2.max_protocol_version
+
+
+# A character of version 1 that is split between two pieces of data.
+def test_split_character():
+    data = "login02éx".encode()
+    reader, frames = feed_pieces([data[:7], data[7:]])
+    assert frames == [(Server2.LOGIN, "éx")]
+
+
+# The original frames of version 1, in which every command starts with the name of the user (only the first one is
+# used).
+def test_names_in_frames():
+    reader, frames = feed_pieces([b"05gilad10002hi", b"05gilad5", b"04dana0003yo!"])
+    assert frames == [(Server2.LOGIN, "gilad"), (Server2.CHAT_MESSAGE, "hi"), (Server2.PRIVATE_MESSAGE, "dana", "yo!")]
+    assert reader.names_in_frames is True
+
+
+@pytest.mark.parametrize("data", INVALID_DATA)
+def test_invalid_data(data):
+    reader, frames = feed_pieces([data])
+    assert reader.invalid is True
+
+
+# The longest fields of version 1 are accepted in version 2.
+def test_longest_fields():
+    data = (ProtocolV2.hello(2) + ProtocolV2.encode_client_frame(ProtocolV2.LOGIN, "a" * Server2.MAX_NAME_LENGTH) +
+            ProtocolV2.encode_client_frame(ProtocolV2.CHAT_MESSAGE, "x" * Server2.MAX_MESSAGE_LENGTH))
+    reader, frames = feed_pieces([data])
+    assert reader.invalid is False
+    assert frames[-1] == (Server2.CHAT_MESSAGE, "x" * Server2.MAX_MESSAGE_LENGTH)
@@ -0,0 +1,44 @@
+# Tests of the index of the connections by the names of the users, and of the answer to view-managers (Server2.py).
+# Auther: Gilad Moyal.
+
+import Server2
+
+
+# The index finds the socket of a name, and another connection of the sender if he's looking for his own name.
+def test_socket_by_name(connect_clients):
+    (first, first_client), (second, second_client), (other, other_client) = connect_clients(["a", "b", "a"])
+    assert Server2.socket_by_name(second, "b", "a") is first
+    assert Server2.socket_by_name(first, "a", "a") is other
+    assert Server2.socket_by_name(second, "b", "b") is second
+    assert Server2.socket_by_name(first, "a", "c") is None
+
+
+# A user that leaves the chat is removed from the index, and a name without connections is removed from it.
+def test_name_removed_from_index(connect_clients):
+    (first, first_client), (second, second_client) = connect_clients(["a", "b"])
+    Server2.handle_received_bytes(second, b"quit")
+    assert "b" not in Server2.sockets_by_name
+    assert Server2.sockets_by_name["a"] == [first]
+
+
+# The managers are listed sorted by their names, and the user that asked is listed first as "You".
+def test_managers_sorted(connect_clients, receive_messages):
+    clients = connect_clients(["dana", "gilad", "bob", "carol"])
+    for server_side, client_side in clients[1:]:
+        Server2.mark_manager(server_side)
+    gilad, gilad_client = clients[1]
+    receive_messages(gilad_client)
+    Server2.handle_received_bytes(gilad, b"view-managers")
+    assert receive_messages(gilad_client) == ["The manager/s of the chat is/are: \nYou\nbob\ncarol\ndana"]
+
+
+# At most MAX_LISTED_MANAGERS managers are listed, so the answer fits in the length field of version 1.
+def test_managers_limited(connect_clients, receive_messages, monkeypatch):
+    monkeypatch.setattr(Server2, "MAX_LISTED_MANAGERS", 2)
+    clients = connect_clients(["e", "d", "c", "b", "a"])
+    for server_side, client_side in clients:
+        Server2.mark_manager(server_side)
+    viewer, viewer_client = connect_clients(["viewer"])[0]
+    receive_messages(viewer_client)
+    Server2.handle_received_bytes(viewer, b"view-managers")
+    assert receive_messages(viewer_client) == ["The manager/s of the chat is/are: \na\nb\nand 3 more managers"]
@@ -0,0 +1,91 @@
+# Tests of the frames of version 2 of the protocol (ProtocolV2.py).
+# Auther: Gilad Moyal.
+
+import pytest
+
+import ProtocolV2
+
+
+# Receives a server frame, and returns its type, flags and payload.
+def split_frame(frame):
+    frame_type, flags, payload_start, payload_end = ProtocolV2.read_frame_header(frame, 0)
+    assert payload_end == len(frame)
+    return frame_type, flags, frame[payload_start:payload_end]
+
+
+@pytest.mark.parametrize("number", [0, 1, 0x7f, 0x80, 300, 16383, 16384, 2 ** 32, 2 ** 63 - 1])
+def test_varint_round_trip(number):
+    encoded = ProtocolV2.encode_varint(number)
+    assert ProtocolV2.decode_varint(encoded, 0, len(encoded)) == (number, len(encoded))
+
+
+# A varint that isn't complete yet, and one that is longer than any valid number.
+def test_varint_partial_and_too_long():
+    encoded = ProtocolV2.encode_varint(300)
+    assert ProtocolV2.decode_varint(encoded, 0, 1) is None
+    with pytest.raises(ValueError):
+        ProtocolV2.decode_varint(b"\x80" * 10 + b"\x01", 0, 11)
+
+
+@pytest.mark.parametrize("command, fields", [
+    (ProtocolV2.QUIT, ()),
+    (ProtocolV2.LOGIN, ("gilad",)),
+    (ProtocolV2.CHAT_MESSAGE, ("hello everyone",)),
+    (ProtocolV2.CHAT_MESSAGE, ("שלום, é and emoji \U0001f600",)),
+    (ProtocolV2.CHAT_MESSAGE, ("x" * 200,)),  # The length takes two bytes.
+    (ProtocolV2.PRIVATE_MESSAGE, ("dana", "see you")),
+    (ProtocolV2.HISTORY, ("20", "")),
+    (ProtocolV2.JOIN_ROOM, ("dev",)),
+])
+def test_client_frame_round_trip(command, fields):
+    frame = ProtocolV2.encode_client_frame(command, *fields)
+    assert ProtocolV2.parse_client_frame(memoryview(frame), 0) == (command, list(fields), len(frame))
+
+
+# Several frames in one buffer are parsed one after the other, and a frame that isn't complete isn't parsed yet.
+def test_client_frames_merged_and_split():
+    first = ProtocolV2.encode_client_frame(ProtocolV2.LOGIN, "a")
+    second = ProtocolV2.encode_client_frame(ProtocolV2.PRIVATE_MESSAGE, "b", "hi")
+    data = memoryview(first + second)
+    command, fields, position = ProtocolV2.parse_client_frame(data, 0)
+    assert (command, fields, position) == (ProtocolV2.LOGIN, ["a"], len(first))
+    assert ProtocolV2.parse_client_frame(data, position) == (ProtocolV2.PRIVATE_MESSAGE, ["b", "hi"], len(data))
+    for end in range(len(second)):
+        assert ProtocolV2.parse_client_frame(memoryview(second[:end]), 0) is None
+
+
+@pytest.mark.parametrize("frame", [
+    ProtocolV2.encode_frame(99, b""),  # An unknown command.
+    ProtocolV2.encode_frame(ProtocolV2.CHAT_MESSAGE, b""),  # A missing field.
+    ProtocolV2.encode_frame(ProtocolV2.CHAT_MESSAGE, b"\x05abc"),  # A field longer than the payload.
+    ProtocolV2.encode_frame(ProtocolV2.PRIVATE_MESSAGE, b"\x01b"),  # A missing second field.
+    ProtocolV2.encode_frame(ProtocolV2.CHAT_MESSAGE, b"\x80"),  # A length that isn't complete.
+])
+def test_invalid_client_frame(frame):
+    with pytest.raises(ValueError):
+        ProtocolV2.parse_client_frame(memoryview(frame), 0)
+
+
+# A field that isn't valid UTF-8.
+def test_client_frame_invalid_text():
+    frame = ProtocolV2.encode_frame(ProtocolV2.CHAT_MESSAGE, b"\x02\xc3\x28")
+    with pytest.raises(UnicodeDecodeError):
+        ProtocolV2.parse_client_frame(memoryview(frame), 0)
+
+
+def test_payload_too_long():
+    header = ProtocolV2.HEADER.pack(ProtocolV2.CHAT_MESSAGE, 0)
+    with pytest.raises(ValueError):
+        ProtocolV2.read_frame_header(header + ProtocolV2.encode_varint(ProtocolV2.MAX_PAYLOAD_LENGTH + 1), 0)
+
+
+def test_server_frame():
+    assert split_frame(ProtocolV2.encode_server_frame("héllo")) == (ProtocolV2.SERVER_TEXT, 0, "héllo".encode())
+
+
+def test_server_frame_with_sequence():
+    frame_type, flags, payload = split_frame(ProtocolV2.encode_server_frame("hi", 1000))
+    assert (frame_type, flags) == (ProtocolV2.SERVER_TEXT, ProtocolV2.SEQUENCE)
+    sequence, position = ProtocolV2.decode_varint(payload, 0, len(payload))
+    assert (sequence, payload[position:]) == (1000, b"hi")
+
@@ -0,0 +1,109 @@
+# Tests of the rooms of the chat, and of the commands for managers in them (Server2.py).
+# Auther: Gilad Moyal.
+
+import Server2
+
+
+# Receives a name of a room, and returns the frame of version 1 that joins it.
+def join_frame(room_name):
+    return ("join-room" + str(len(room_name)).zfill(2) + room_name).encode()
+
+
+# Receives the number of a command for managers and the name of its target, and returns its frame of version 1.
+def command_frame(command, target_name):
+    return (str(command) + str(len(target_name)).zfill(2) + target_name).encode()
+
+
+# Receives a list of the clients (as returned by connect_clients) and throws away the messages they received.
+def skip_messages(clients, receive_messages):
+    for server_side, client_side in clients:
+        receive_messages(client_side)
+
+
+# A user that joins a room becomes its manager, the messages in it are sent to its members only, and it's removed
+# when its last member leaves.
+def test_room_messages(connect_clients, receive_messages):
+    clients = connect_clients(["a", "b", "c"])
+    (a, a_client), (b, b_client), (c, c_client) = clients
+    Server2.handle_received_bytes(b, join_frame("dev"))
+    Server2.handle_received_bytes(c, join_frame("dev"))
+    assert Server2.users_dict[b].room is Server2.rooms["dev"]
+    assert Server2.users_dict[b].is_manager is True
+    assert list(Server2.rooms["dev"].members) == [b, c]
+    skip_messages(clients, receive_messages)
+    Server2.handle_received_bytes(c, b"1" + b"0005hello")
+    assert receive_messages(b_client) == ["c: hello"]
+    assert receive_messages(a_client) == []
+    Server2.handle_received_bytes(b, b"leave-room")
+    Server2.handle_received_bytes(c, b"leave-room")
+    assert "dev" not in Server2.rooms
+    assert Server2.users_dict[c].room is Server2.main_room
+
+
+def test_view_rooms(connect_clients, receive_messages):
+    (a, a_client), (b, b_client) = connect_clients(["a", "b"])
+    Server2.handle_received_bytes(b, join_frame("dev"))
+    receive_messages(a_client)
+    Server2.handle_received_bytes(a, b"view-rooms")
+    assert receive_messages(a_client) == ["You're in the room main. The rooms of the chat are: \nmain (1)\ndev (1)"]
+
+
+# A user silenced in a room can't send messages there, but can in other rooms, and is silenced again when he comes
+# back to the room.
+def test_silence_in_room(connect_clients, receive_messages):
+    clients = connect_clients(["a", "b", "c"])
+    (a, a_client), (b, b_client), (c, c_client) = clients
+    Server2.handle_received_bytes(b, join_frame("dev"))
+    Server2.handle_received_bytes(c, join_frame("dev"))
+    Server2.handle_received_bytes(b, command_frame(Server2.SILENCE_USER, "c"))
+    assert Server2.users_dict[c].is_silenced is True
+    skip_messages(clients, receive_messages)
+    Server2.handle_received_bytes(c, b"1" + b"0005hello")
+    assert receive_messages(b_client) == []
+    Server2.handle_received_bytes(c, b"leave-room")
+    assert Server2.users_dict[c].is_silenced is False
+    skip_messages(clients, receive_messages)
+    Server2.handle_received_bytes(c, b"1" + b"0005hello")
+    assert receive_messages(a_client) == ["c: hello"]
+    Server2.handle_received_bytes(c, join_frame("dev"))
+    assert Server2.users_dict[c].is_silenced is True
+
+
+# A manager of a room can't use the commands for managers on users in other rooms.
+def test_room_manager_scope(connect_clients, receive_messages):
+    (a, a_client), (b, b_client) = connect_clients(["a", "b"])
+    Server2.handle_received_bytes(b, join_frame("dev"))
+    receive_messages(b_client)
+    for command in (Server2.REMOVE_FROM_CHAT, Server2.SILENCE_USER, Server2.APPOINT_MANAGER):
+        Server2.handle_received_bytes(b, command_frame(command, "a"))
+        assert receive_messages(b_client) == ["a isn't in the room dev."]
+    assert Server2.users_dict[a].is_silenced is False
+    assert a in Server2.users_dict
+
+
+# A manager of a room removes a user from the room: the user goes back to the main room and stays in the chat.
+def test_remove_from_room(connect_clients, receive_messages):
+    clients = connect_clients(["a", "b", "c"])
+    (a, a_client), (b, b_client), (c, c_client) = clients
+    Server2.handle_received_bytes(b, join_frame("dev"))
+    Server2.handle_received_bytes(c, join_frame("dev"))
+    skip_messages(clients, receive_messages)
+    Server2.handle_received_bytes(b, command_frame(Server2.REMOVE_FROM_CHAT, "c"))
+    assert receive_messages(c_client)[0] == "@b removed you from the room dev."
+    assert c in Server2.users_dict
+    assert Server2.users_dict[c].room is Server2.main_room
+
+
+# A manager of the main room removes a user from the chat, whichever room the user is in.
+def test_remove_from_chat(connect_clients, receive_messages):
+    clients = connect_clients(["a", "b", "c"])
+    (a, a_client), (b, b_client), (c, c_client) = clients
+    Server2.handle_received_bytes(b, join_frame("dev"))
+    Server2.handle_received_bytes(c, join_frame("dev"))
+    skip_messages(clients, receive_messages)
+    Server2.handle_received_bytes(a, command_frame(Server2.REMOVE_FROM_CHAT, "c"))
+    assert receive_messages(a_client) == ["You removed c from the chat."]
+    assert receive_messages(b_client) == ["@a removed c from the chat."]
+    assert receive_messages(c_client) == ["@a removed you from the chat."]
+    assert c not in Server2.users_dict
+    assert list(Server2.rooms["dev"].members) == [b]
@@ -0,0 +1,92 @@
+# Tests of the queues of the messages sent to the clients (the fan-out of the broadcasts in Server2.py).
+# Auther: Gilad Moyal.
+
+import Server2
+
+
+# A message is encoded once for every version of the protocol, and the same bytes object is returned after that.
+def test_message_encoded_once():
+    message = Server2.EncodedMessage("hello", 7)
+    frame = message.frame(1)
+    assert frame == Server2.encode_message("hello")
+    assert message.frame(1) is frame
+    assert message.frame(2) is message.frame(2)
+    assert message.frame(2) != frame
+
+
+# The same bytes object is added to the queue of every member of the room.
+def test_broadcast_shares_the_payload(connect_clients):
+    (first, first_client), (second, second_client), (third, third_client) = connect_clients(["a", "b", "c"])
+    Server2.prepare_broadcast_message("hi all", Server2.main_room, [third])
+    first_queue = Server2.users_dict[first].outgoing
+    second_queue = Server2.users_dict[second].outgoing
+    assert first_queue[-1] is second_queue[-1]
+    assert first_queue[-1] == Server2.encode_message("hi all")
+    assert len(Server2.users_dict[third].outgoing) == 0
+
+
+# The messages of all the members are written at the end of the iteration, in the order they were queued.
+def test_broadcast_delivered_in_order(connect_clients, receive_messages):
+    (first, first_client), (second, second_client) = connect_clients(["a", "b"])
+    receive_messages(first_client)
+    receive_messages(second_client)
+    for number in range(3):
+        Server2.prepare_broadcast_message("message " + str(number), Server2.main_room)
+    assert receive_messages(first_client) == ["message 0", "message 1", "message 2"]
+    assert receive_messages(second_client) == ["message 0", "message 1", "message 2"]
+    assert len(Server2.pending_flush) == 0
+
+
+# A message longer than the buffers of the socket is written in parts, and the socket is watched for writing until
+# all of it has been sent.
+def test_partial_send(connect_clients, monkeypatch):
+    monkeypatch.setattr(Server2, "high_water_mark", 10 * Server2.MAX_BYTES)
+    [(server_side, client_side)] = connect_clients(["a"])
+    client_side.recv(Server2.MAX_BYTES)
+    user = Server2.users_dict[server_side]
+    data = bytes(range(256)) * 4000
+    Server2.add_to_queue(server_side, data)
+    Server2.flush_pending()
+    assert 0 < user.queued_bytes < len(data)
+    assert Server2.selector.get_key(server_side).events & Server2.selectors.EVENT_WRITE != 0
+    received = b""
+    while len(received) < len(data):
+        received += client_side.recv(Server2.MAX_BYTES)
+        if len(user.outgoing) != 0:
+            Server2.send_and_remove(server_side)
+    assert received == data
+    assert user.queued_bytes == 0 and user.sent_offset == 0
+    assert Server2.selector.get_key(server_side).events == Server2.selectors.EVENT_READ
+
+
+# A client whose queue passes the high water mark is disconnected, and the messages after that are dropped.
+def test_slow_client_disconnected(connect_clients, monkeypatch):
+    monkeypatch.setattr(Server2, "high_water_mark", 100)
+    [(server_side, client_side)] = connect_clients(["a"])
+    user = Server2.users_dict[server_side]
+    Server2.add_to_queue(server_side, b"x" * 150)
+    assert user.overflowed is True
+    assert Server2.overflowed_clients == [server_side]
+    queued_bytes = user.queued_bytes
+    Server2.add_to_queue(server_side, b"y")
+    assert user.queued_bytes == queued_bytes
+    Server2.disconnect_overflowed_clients()
+    assert server_side not in Server2.users_dict
+
+
+# With the pause policy, the server stops reading from a slow client until half of the high water mark is left, and
+# disconnects it only after twice the high water mark.
+def test_slow_client_paused(connect_clients, monkeypatch):
+    monkeypatch.setattr(Server2, "high_water_mark", 100)
+    monkeypatch.setattr(Server2, "slow_client_policy", "pause")
+    [(server_side, client_side)] = connect_clients(["a"])
+    user = Server2.users_dict[server_side]
+    Server2.add_to_queue(server_side, b"x" * 150)
+    assert user.input_paused is True and user.overflowed is False
+    assert Server2.selector.get_key(server_side).events & Server2.selectors.EVENT_READ == 0
+    Server2.flush_pending()
+    assert user.input_paused is False
+    assert Server2.selector.get_key(server_side).events == Server2.selectors.EVENT_READ
+    Server2.add_to_queue(server_side, b"x" * 150)
+    Server2.add_to_queue(server_side, b"x" * 150)
+    assert user.overflowed is True